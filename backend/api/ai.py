@@ -1,123 +1,282 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
-from models.schemas import ChatRequest, ImageChatRequest, CSVAnalysisRequest, CSVAnalysisResponse, PlotData
-from services.chat_service import ai_service
-import json
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from models.schemas import ChatRequest, ImageChatRequest, CSVAnalysisRequest, CSVAnalysisResponse, PlotData, DatasetUpload
+from services.ai_service import ai_service
+from starlette.concurrency import run_in_threadpool
+from operator import attrgetter
+import logging
+import time
+import base64
+from typing import Optional
+from uuid import uuid4
 import pandas as pd
-import io
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import orjson
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-@router.post("/ai/chat")
-async def chat_with_ai(request: ChatRequest):
+ARROW_STREAM_TYPE = "application/vnd.apache.arrow.stream"
+
+# Same options ORJSONResponse uses, so plot payloads with numpy arrays serialize
+_NDJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+# Streamed text is coalesced into chunks of this size, or flushed after this long
+STREAM_BUFFER_BYTES = 4096
+STREAM_FLUSH_SECONDS = 0.05
+
+async def _parse_body(request: Request, model):
+    """Parse and validate the raw JSON body in a single pydantic-core pass"""
+    try:
+        return model.model_validate_json(await request.body())
+    except ValidationError as e:
+        # Same error shape FastAPI gives for a declared body parameter
+        raise RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in e.errors()])
+
+def _json_body_openapi(model, **extra_content):
+    """openapi_extra documenting a JSON request body that _parse_body reads by hand"""
+    schema = model.model_json_schema()
+    defs = schema.pop("$defs", {})
+    
+    # Inline nested models: "#/$defs/..." refs don't resolve inside the OpenAPI document
+    def resolve(node):
+        if isinstance(node, dict):
+            if "$ref" in node:
+                return resolve(defs[node["$ref"].rsplit("/", 1)[-1]])
+            return {key: resolve(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [resolve(value) for value in node]
+        return node
+    
+    content = {"application/json": {"schema": resolve(schema)}, **extra_content}
+    return {"requestBody": {"required": True, "content": content}}
+
+def _chunk_extractor(chunk):
+    """Pick how to read text from stream chunks, based on the first chunk's type"""
+    if hasattr(chunk, 'content'):
+        return attrgetter('content')
+    if hasattr(chunk, 'text'):
+        return attrgetter('text')
+    return str
+
+async def _stream_text(response_stream):
+    """Yield the streamed text as UTF-8 bytes, coalescing small model chunks"""
+    extract = None
+    buf = bytearray()
+    # Never flushed yet, so the first non-empty chunk goes out immediately
+    last_flush = float("-inf")
+    async for chunk in response_stream:
+        if extract is None:
+            extract = _chunk_extractor(chunk)
+        text = extract(chunk)
+        if not text:
+            continue
+        buf += text.encode("utf-8")
+        # Time-based flush keeps later bytes arriving quickly
+        now = time.monotonic()
+        if len(buf) >= STREAM_BUFFER_BYTES or now - last_flush > STREAM_FLUSH_SECONDS:
+            yield bytes(buf)
+            buf.clear()
+            last_flush = now
+    if buf:
+        yield bytes(buf)
+
+def _read_arrow_stream(body: bytes):
+    """Read an Arrow IPC stream into an Arrow-backed DataFrame"""
+    table = pa.ipc.open_stream(pa.BufferReader(body)).read_all()
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+def _parse_csv_data(csv_data):
+    """Build a DataFrame from the request's csv_data (CSV text, records or columns)"""
+    if isinstance(csv_data, str) and csv_data.strip():
+        # Arrow's CSV reader parses columns in parallel in C++; keeping the
+        # columns Arrow-backed lets the agent's pandas code run on Arrow kernels
+        table = pacsv.read_csv(pa.BufferReader(csv_data.encode("utf-8")))
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+    elif isinstance(csv_data, list):
+        if csv_data and all(isinstance(row, dict) for row in csv_data):
+            # Records go straight into Arrow columns, skipping pandas' object-dtype pass
+            return pa.Table.from_pylist(csv_data).to_pandas(types_mapper=pd.ArrowDtype)
+        return pd.DataFrame(csv_data)
+    elif isinstance(csv_data, dict):
+        return pa.Table.from_pydict(csv_data).to_pandas(types_mapper=pd.ArrowDtype)
+    return None
+
+async def _request_dataframe(request):
+    """DataFrame for a CSV request: inline csv_data, else the dataset uploaded for the session"""
+    if request.csv_data:
+        try:
+            # Parse off the event loop so large uploads don't block other requests
+            return await run_in_threadpool(_parse_csv_data, request.csv_data)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Failed to parse CSV data: {str(e)}")
+    
+    if request.session_id:
+        df = ai_service.get_dataset(request.session_id, request.dataset_version)
+        if df is None:
+            # The client re-uploads on 409 (e.g. after a server restart) and retries
+            raise HTTPException(status_code=409, detail="Dataset not uploaded for this session")
+        return df
+    return None
+
+@router.put("/ai/datasets/{session_id}", openapi_extra=_json_body_openapi(
+    DatasetUpload,
+    **{ARROW_STREAM_TYPE: {"schema": {"type": "string", "format": "binary"}}}
+))
+async def upload_dataset(session_id: str, raw_request: Request, version: Optional[str] = None):
+    """Upload a session's dataset once; CSV requests then reference it by session_id
+    
+    Accepts an Arrow IPC stream (version in the query string) or a JSON DatasetUpload.
+    """
+    content_type = raw_request.headers.get("content-type", "")
+    try:
+        if content_type.startswith(ARROW_STREAM_TYPE):
+            df = await run_in_threadpool(_read_arrow_stream, await raw_request.body())
+        else:
+            body = await _parse_body(raw_request, DatasetUpload)
+            version = body.version
+            df = await run_in_threadpool(_parse_csv_data, body.csv_data)
+    except RequestValidationError:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to parse dataset: {str(e)}")
+    if df is None:
+        raise HTTPException(status_code=400, detail="Dataset is empty")
+    
+    ai_service.put_dataset(session_id, df, version)
+    return {"session_id": session_id, "version": version, "rows": len(df)}
+
+@router.post("/ai/chat", openapi_extra=_json_body_openapi(ChatRequest))
+async def chat_with_ai(raw_request: Request):
     """Chat with AI - text streaming"""
+    request = await _parse_body(raw_request, ChatRequest)
     try:
-        def generate():
-            # Call AI service
-            response_stream = ai_service.generate_text_response(
-                request.user_input, 
-                request.chat_history
-            )
-            
-            for chunk in response_stream:
-                if hasattr(chunk, 'content') and chunk.content:
-                    yield chunk.content
-                elif hasattr(chunk, 'text') and chunk.text:
-                    yield chunk.text
-                else:
-                    yield str(chunk)
+        # Call AI service
+        response_stream = ai_service.generate_text_response(
+            request.user_input, 
+            request.chat_history,
+            request.session_id
+        )
         
-        return StreamingResponse(generate(), media_type="text/plain")
+        return StreamingResponse(_stream_text(response_stream), media_type="text/plain")
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/ai/chat/image")
-async def chat_with_image(request: ImageChatRequest):
+def _image_data_url(body: bytes, mime_type: str):
+    return f"data:{mime_type};base64,{base64.b64encode(body).decode('ascii')}"
+
+@router.put("/ai/images/{session_id}")
+async def upload_image(session_id: str, raw_request: Request, version: Optional[str] = None):
+    """Upload a session's image once as raw bytes; image chat requests then reference it by session_id"""
+    mime_type = raw_request.headers.get("content-type", "").split(";")[0].strip()
+    if not mime_type.startswith("image/"):
+        raise HTTPException(status_code=415, detail="Expected an image/* body")
+    body = await raw_request.body()
+    if not body:
+        raise HTTPException(status_code=400, detail="Image is empty")
+    
+    # The model API takes base64, so encode once here instead of on every turn
+    image_url = await run_in_threadpool(_image_data_url, body, mime_type)
+    ai_service.put_image(session_id, image_url, version)
+    return {"session_id": session_id, "version": version, "bytes": len(body)}
+
+@router.post("/ai/chat/image", openapi_extra=_json_body_openapi(ImageChatRequest))
+async def chat_with_image(raw_request: Request):
     """Chat with AI including image (streaming)"""
+    request = await _parse_body(raw_request, ImageChatRequest)
+    image_url = None
+    if not request.image_data:
+        image_url = ai_service.get_image(request.session_id, request.image_version) if request.session_id else None
+        if image_url is None:
+            # The client re-uploads on 409 (e.g. after a server restart) and retries
+            raise HTTPException(status_code=409, detail="Image not uploaded for this session")
     try:
-        def generate():
-            # Call AI service to get stream response
-            response_stream = ai_service.generate_image_response(
-                request.user_input,
-                request.image_data,
-                request.chat_history
-            )
-            
-            for chunk in response_stream:
-                if hasattr(chunk, 'content') and chunk.content:
-                    yield chunk.content
-                elif hasattr(chunk, 'text') and chunk.text:
-                    yield chunk.text
-                else:
-                    yield str(chunk)
+        # Call AI service to get stream response
+        response_stream = ai_service.generate_image_response(
+            request.user_input,
+            request.image_data,
+            request.chat_history,
+            request.session_id,
+            image_url=image_url
+        )
 
         # Stream results to client
-        return StreamingResponse(generate(), media_type="text/plain")
+        return StreamingResponse(_stream_text(response_stream), media_type="text/plain")
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/ai/chat/csv")
-async def chat_with_csv(request: CSVAnalysisRequest):
+@router.post("/ai/chat/csv", openapi_extra=_json_body_openapi(CSVAnalysisRequest))
+async def chat_with_csv(raw_request: Request):
     """Chat with AI for CSV data analysis with plotting support"""
+    request = await _parse_body(raw_request, CSVAnalysisRequest)
     try:
         if not request.enhanced_query:
             raise HTTPException(status_code=400, detail="Enhanced query is required")
         
-        df = None
-        if request.csv_data:
-            try:
-                if isinstance(request.csv_data, str) and request.csv_data.strip():
-                    df = pd.read_csv(io.StringIO(request.csv_data))
-                elif isinstance(request.csv_data, list):
-                    df = pd.DataFrame(request.csv_data)
-                elif isinstance(request.csv_data, dict):
-                    df = pd.DataFrame(request.csv_data)
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Failed to parse CSV data: {str(e)}")
+        df = await _request_dataframe(request)
         
         # Generate response with AI service
-        response_text = ai_service.generate_csv_response(
+        run_id = uuid4().hex
+        # The agent blocks on LLM round-trips, so keep it off the event loop
+        response_text = await ai_service.agenerate_csv_response(
             enhanced_query=request.enhanced_query,
             dataframe=df,
-            session_id=request.session_id
+            session_id=request.session_id,
+            run_id=run_id
         )
         
-        # Get plots from AI service
-        plots = ai_service.get_plots(request.session_id)
-        print(f"📊 Retrieved {len(plots)} plots from AI service")
-        
-        # Convert plots to serializable format - FIX SERIALIZATION ERROR
-        serializable_plots = []
-        for i, plot in enumerate(plots):
-            try:
-                if hasattr(plot, 'to_json'):
-                    # Use to_json() instead of to_dict() to avoid serialization errors
-                    plot_json = plot.to_json()
-                    plot_dict = json.loads(plot_json)
-                    
-                    serializable_plots.append({
-                        "data": plot_dict.get("data", []),
-                        "layout": plot_dict.get("layout", {})
-                    })
-                    print(f"✅ Successfully serialized plot {i+1}")
-                else:
-                    print(f"⚠️ Plot {i+1} is not a plotly figure")
-            except Exception as plot_error:
-                print(f"❌ Error serializing plot {i+1}: {plot_error}")
-                # Skip error plots to prevent API crash
+        # Get this run's plots from AI service - already serialized by the plot tool
+        serializable_plots = ai_service.get_plots(request.session_id, run_id)
+        logger.debug("📊 Retrieved %d plots from AI service", len(serializable_plots))
         
-        # Clear plots after sending
-        ai_service.clear_plots(request.session_id)
+        # Clear this run's plots after sending
+        ai_service.clear_plots(request.session_id, run_id)
         
-        return {
+        return ORJSONResponse({
             "content": response_text,
             "plots": serializable_plots
-        }
+        })
         
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"❌ Error in CSV chat: {str(e)}")
-        import traceback
-        print(f"🔍 Traceback: {traceback.format_exc()}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        logger.exception("❌ Error in CSV chat: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/ai/chat/csv/stream", openapi_extra=_json_body_openapi(CSVAnalysisRequest))
+async def chat_with_csv_stream(raw_request: Request):
+    """CSV analysis as NDJSON events: status/text while the agent runs, then this run's plots"""
+    request = await _parse_body(raw_request, CSVAnalysisRequest)
+    if not request.enhanced_query:
+        raise HTTPException(status_code=400, detail="Enhanced query is required")
+    
+    df = await _request_dataframe(request)
+    
+    run_id = uuid4().hex
+    
+    async def events():
+        try:
+            async for kind, content in ai_service.astream_csv_response(
+                enhanced_query=request.enhanced_query,
+                dataframe=df,
+                session_id=request.session_id,
+                run_id=run_id
+            ):
+                yield orjson.dumps({"type": kind, "content": content}) + b"\n"
+            
+            # Terminal event: plots are only complete once the agent has finished
+            plots = ai_service.get_plots(request.session_id, run_id)
+            yield orjson.dumps({"type": "plots", "plots": plots}, option=_NDJSON_OPTIONS) + b"\n"
+        except Exception as e:
+            logger.exception("❌ Error in CSV stream: %s", e)
+            yield orjson.dumps({"type": "error", "content": str(e)}) + b"\n"
+        finally:
+            ai_service.clear_plots(request.session_id, run_id)
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson")
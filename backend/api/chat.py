@@ -1,14 +1,31 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
-from models.schemas import MessageCreate, MessageResponse
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response
+from typing import List, Optional
+import hashlib
+import orjson
+from models.schemas import MessageCreate, MessageBulkCreate, MessageResponse
 from services.chat_service import chat_service
 
 router = APIRouter()
 
-@router.get("/sessions/{session_id}/messages", response_model=List[MessageResponse])
-async def get_session_messages(session_id: str):
-    messages = chat_service.get_session_messages(session_id)
-    return messages
+# Rows come straight from Supabase, so they are returned as-is; the model is only documented
+@router.get("/sessions/{session_id}/messages", responses={200: {"model": List[MessageResponse]}})
+async def get_session_messages(
+    session_id: str,
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    before_id: Optional[int] = None
+):
+    messages = await chat_service.get_session_messages(session_id, limit, before_id)
+    body = orjson.dumps(messages)
+    
+    # Clients revalidate with If-None-Match; an unchanged history costs a bodyless 304
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    headers = {"ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @router.post("/sessions/{session_id}/messages", response_model=MessageResponse)
 async def add_message(session_id: str, message: MessageCreate):
@@ -18,7 +35,27 @@ async def add_message(session_id: str, message: MessageCreate):
         "timestamp": message.timestamp.isoformat() if message.timestamp else None
     }
     
-    result = chat_service.add_message(session_id, message_data)
+    result = await chat_service.add_message(session_id, message_data)
+    if not result:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    return result
+
+@router.post("/sessions/{session_id}/messages/bulk", response_model=List[MessageResponse])
+async def add_messages(session_id: str, bulk: MessageBulkCreate):
+    if not bulk.messages:
+        return []
+    
+    messages_data = [
+        {
+            "role": message.role,
+            "content": message.content,
+            "timestamp": message.timestamp.isoformat() if message.timestamp else None
+        }
+        for message in bulk.messages
+    ]
+    
+    result = await chat_service.add_messages(session_id, messages_data)
     if not result:
         raise HTTPException(status_code=404, detail="Session not found")
     
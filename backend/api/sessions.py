@@ -1,14 +1,24 @@
-from fastapi import APIRouter, HTTPException
-from typing import List, Dict, Any
-from models.schemas import SessionCreate, SessionResponse, FileCreate, FileResponse
+from fastapi import APIRouter, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from typing import List, Dict, Any, Optional
+import base64
+from models.schemas import SessionCreate, SessionResponse, FileCreate, FileBatchCreate, FileResponse
 from services.session_service import session_service
 from services.chat_service import chat_service
 
 router = APIRouter()
 
-@router.get("/sessions", response_model=Dict[str, Any])
+@router.get("/sessions")
 async def get_all_sessions():
-    return session_service.get_all_sessions()
+    return await session_service.get_all_sessions()
+
+@router.get("/sessions/version")
+async def get_sessions_version():
+    version = await session_service.get_sessions_version()
+    if version is None:
+        raise HTTPException(status_code=503, detail="Sessions version unavailable")
+    
+    return {"version": version}
 
 @router.post("/sessions", response_model=SessionResponse)
 async def create_session(session: SessionCreate):
@@ -20,7 +30,7 @@ async def create_session(session: SessionCreate):
         "created_at": datetime.now().isoformat()
     }
     
-    result = session_service.create_session(session_data)
+    result = await session_service.create_session(session_data)
     if not result:
         raise HTTPException(status_code=500, detail="Failed to create session")
     
@@ -28,7 +38,7 @@ async def create_session(session: SessionCreate):
 
 @router.delete("/sessions/{session_id}")
 async def delete_session(session_id: str):
-    success = session_service.delete_session(session_id)
+    success = await session_service.delete_session(session_id)
     if not success:
         raise HTTPException(status_code=404, detail="Session not found")
     
@@ -36,7 +46,7 @@ async def delete_session(session_id: str):
 
 @router.post("/sessions/{session_id}/files", response_model=FileResponse)
 async def save_session_file(session_id: str, file_data: FileCreate):
-    result = chat_service.save_session_file(
+    result = await chat_service.save_session_file(
         session_id, 
         file_data.file_type, 
         file_data.file_data, 
@@ -48,9 +58,63 @@ async def save_session_file(session_id: str, file_data: FileCreate):
     
     return result
 
-@router.get("/sessions/{session_id}/files/{file_type}", response_model=FileResponse)
+@router.post("/sessions/{session_id}/files/batch", response_model=List[FileResponse])
+async def save_session_files(session_id: str, batch: FileBatchCreate):
+    if not batch.files:
+        return []
+    
+    files_data = [
+        {
+            "file_type": file.file_type,
+            "file_data": file.file_data,
+            "file_name": file.file_name
+        }
+        for file in batch.files
+    ]
+    
+    result = await chat_service.save_session_files(session_id, files_data)
+    if not result:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    return result
+
+def _raw_image_record(body: bytes, mime_type: str, file_name: Optional[str]):
+    """Stored shape of an image file, the same one clients build for base64 JSON uploads"""
+    return {
+        'image_data': base64.b64encode(body).decode('ascii'),
+        'file_type': 'image_base64',
+        'format': 'base64',
+        'mime_type': mime_type,
+        'metadata': {
+            'file_name': file_name or 'image.jpg',
+            'size_bytes': len(body),
+            'size_mb': len(body) / (1024 * 1024)
+        },
+        'has_full_data': True
+    }
+
+@router.put("/sessions/{session_id}/files/{file_type}/raw", response_model=FileResponse)
+async def save_session_file_raw(session_id: str, file_type: str, raw_request: Request, file_name: Optional[str] = None):
+    """Save an image file sent as raw bytes rather than base64 inside JSON"""
+    mime_type = raw_request.headers.get("content-type", "").split(";")[0].strip()
+    if not mime_type.startswith("image/"):
+        raise HTTPException(status_code=415, detail="Expected an image/* body")
+    body = await raw_request.body()
+    if not body:
+        raise HTTPException(status_code=400, detail="File is empty")
+    
+    # Storage is JSON, so encode once here, off the event loop
+    file_data = await run_in_threadpool(_raw_image_record, body, mime_type, file_name)
+    result = await chat_service.save_session_file(session_id, file_type, file_data, file_name)
+    if not result:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    return result
+
+# Returned as stored; file_data can be large, so skip re-validating it on the way out
+@router.get("/sessions/{session_id}/files/{file_type}", responses={200: {"model": FileResponse}})
 async def get_session_file(session_id: str, file_type: str):
-    result = chat_service.get_session_file(session_id, file_type)
+    result = await chat_service.get_session_file(session_id, file_type)
     if not result:
         raise HTTPException(status_code=404, detail="File not found")
     
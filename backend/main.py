@@ -1,8 +1,123 @@
+import atexit
+import logging
+import os
+import queue
+import zlib
+from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from starlette.concurrency import run_in_threadpool
 from api import chat, sessions, ai
+from utils.supabase_client import supabase
+
+def configure_logging():
+    """Send log records through a queue so request handlers never block on stream writes"""
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    
+    root = logging.getLogger()
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    root.addHandler(QueueHandler(log_queue))
+    
+    listener.start()
+    atexit.register(listener.stop)
+
+configure_logging()
+
+# Limits on gzip request bodies, before and after inflating; larger ones get a 413
+MAX_GZIP_REQUEST_BYTES = 32 * 1024 * 1024
+MAX_INFLATED_REQUEST_BYTES = 128 * 1024 * 1024
+_INFLATE_STEP_BYTES = 1024 * 1024
+
+class RequestTooLarge(Exception):
+    pass
 
-app = FastAPI(title="Chat Backend API")
+def _inflate_gzip(data: bytes, limit: int) -> bytes:
+    """Inflate a gzip body, refusing to produce more than limit bytes (gzip bombs)"""
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    out = bytearray()
+    pending = data
+    while True:
+        out += inflater.decompress(pending, _INFLATE_STEP_BYTES)
+        if len(out) > limit:
+            raise RequestTooLarge()
+        pending = inflater.unconsumed_tail
+        if not pending:
+            break
+    out += inflater.flush()
+    if len(out) > limit:
+        raise RequestTooLarge()
+    if not inflater.eof:
+        raise EOFError("truncated gzip body")
+    return bytes(out)
+
+class GzipRequestMiddleware:
+    """Inflate request bodies sent with Content-Encoding: gzip before routing sees them"""
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        headers = scope.get("headers", []) if scope["type"] == "http" else []
+        if not any(k == b"content-encoding" and v.strip().lower() == b"gzip" for k, v in headers):
+            await self.app(scope, receive, send)
+            return
+        
+        chunks = []
+        received = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunk = message.get("body", b"")
+            received += len(chunk)
+            if received > MAX_GZIP_REQUEST_BYTES:
+                await self._reject(scope, receive, send, 413, "Request body too large")
+                return
+            chunks.append(chunk)
+            more_body = message.get("more_body", False)
+        
+        try:
+            # Large file payloads; inflate off the event loop
+            body = await run_in_threadpool(_inflate_gzip, b"".join(chunks), MAX_INFLATED_REQUEST_BYTES)
+        except RequestTooLarge:
+            await self._reject(scope, receive, send, 413, "Decompressed request body too large")
+            return
+        except (OSError, EOFError, zlib.error):
+            await self._reject(scope, receive, send, 400, "Invalid gzip request body")
+            return
+        
+        scope = dict(scope, headers=[
+            (k, v) for k, v in headers if k not in (b"content-encoding", b"content-length")
+        ] + [(b"content-length", str(len(body)).encode("ascii"))])
+        body_sent = False
+        
+        async def receive_body():
+            nonlocal body_sent
+            if body_sent:
+                return await receive()
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        
+        await self.app(scope, receive_body, send)
+    
+    @staticmethod
+    async def _reject(scope, receive, send, status_code, detail):
+        response = ORJSONResponse({"detail": detail}, status_code=status_code)
+        await response(scope, receive, send)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One async Supabase client (and connection pool) for the whole process
+    await supabase.connect()
+    yield
+
+app = FastAPI(title="Chat Backend API", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -13,6 +128,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Clients gzip large file uploads
+app.add_middleware(GzipRequestMiddleware)
+
 # Include routers
 app.include_router(chat.router, prefix="/api/v1")
 app.include_router(sessions.router, prefix="/api/v1")
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import Optional, Dict, Any, List
 from datetime import datetime
 
@@ -27,6 +27,9 @@ class MessageCreate(BaseModel):
     content: str
     timestamp: datetime
 
+class MessageBulkCreate(BaseModel):
+    messages: List[MessageCreate]
+
 class MessageResponse(BaseModel):
     id: int
     session_id: str
@@ -39,6 +42,9 @@ class FileCreate(BaseModel):
     file_data: Dict[str, Any]
     file_name: Optional[str] = None
 
+class FileBatchCreate(BaseModel):
+    files: List[FileCreate]
+
 class FileResponse(BaseModel):
     id: int
     session_id: str
@@ -48,25 +54,39 @@ class FileResponse(BaseModel):
     created_at: datetime
 
 # New AI schemas
+# Request models are parsed straight from the raw body with model_validate_json
+# and never mutated afterwards
+_REQUEST_CONFIG = ConfigDict(extra='ignore', frozen=True)
+
 class ChatMessage(BaseModel):
+    model_config = _REQUEST_CONFIG
     role: str
     content: str
-    def to_dict(self):
-        return {
-            "role": self.role,
-            "content": self.content
-        }
 
 class ChatRequest(BaseModel):
+    model_config = _REQUEST_CONFIG
     user_input: str
     chat_history: List[ChatMessage]
+    session_id: Optional[str] = None
 
 class ImageChatRequest(BaseModel):
+    model_config = _REQUEST_CONFIG
     user_input: str
-    image_data: str
+    # Inline base64 image; when omitted, the image uploaded for session_id is used
+    image_data: Optional[str] = None
     chat_history: List[ChatMessage]
+    session_id: Optional[str] = None
+    image_version: Optional[str] = None
     
 class CSVAnalysisRequest(BaseModel):
+    model_config = _REQUEST_CONFIG
     enhanced_query: str
+    # Omit csv_data to analyze the dataset uploaded for session_id at dataset_version
+    csv_data: Any = None
+    session_id: Optional[str] = None
+    dataset_version: Optional[str] = None
+
+class DatasetUpload(BaseModel):
+    model_config = _REQUEST_CONFIG
     csv_data: Any
-    session_id: Optional[str] = None
\ No newline at end of file
+    version: Optional[str] = None
\ No newline at end of file
@@ -0,0 +1,337 @@
+import asyncio
+import logging
+from typing import List, Dict, Any
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from functools import lru_cache
+
+from models.schemas import ChatMessage
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain.schema import SystemMessage, HumanMessage, AIMessage
+import os
+from langchain_experimental.agents import create_pandas_dataframe_agent
+from langchain.agents import tool
+from plotly.graph_objects import Figure
+import orjson
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on per-session state kept in memory by AIService
+MAX_CACHED_SESSIONS = 128
+# Plots kept per session; older runs' plots fall off the end
+MAX_PLOTS_PER_SESSION = 32
+# Most recent history messages sent to the model with each turn
+MAX_PROMPT_HISTORY = 20
+# Pandas-agent runs allowed to execute at once in worker threads
+MAX_CONCURRENT_CSV_RUNS = os.cpu_count() or 4
+
+# Run id of the CSV request currently driving the agent; read by the plot tool
+_plot_run = ContextVar("plot_run", default=None)
+
+_ROLE_CLS = {"user": HumanMessage, "assistant": AIMessage, "system": SystemMessage}
+
+# Leading base64 characters of each image format's magic bytes
+_BASE64_IMAGE_PREFIXES = (
+    ("UklGR", "image/webp"),
+    ("iVBORw0KGgo", "image/png"),
+    ("R0lGOD", "image/gif"),
+)
+
+def _image_mime_type(image_data: str) -> str:
+    """Infer the data URL mime type from the encoded bytes; uploads may be re-encoded as WebP"""
+    for prefix, mime_type in _BASE64_IMAGE_PREFIXES:
+        if image_data.startswith(prefix):
+            return mime_type
+    return "image/jpeg"
+
+@lru_cache(maxsize=None)
+def _load_model(model_name: str, temperature: float) -> ChatGoogleGenerativeAI:
+    """Build one Gemini client per (model, temperature) and share it process-wide"""
+    return ChatGoogleGenerativeAI(
+        model=model_name,
+        google_api_key=os.getenv("GOOGLE_API_KEY"),
+        temperature=temperature,
+        streaming=True
+    )
+
+class AIService:
+    def __init__(self, model_name="gemini-2.5-flash", temperature=0.3):
+        # Text, image and CSV agents all go through this one client
+        self.llm = _load_model(model_name, temperature)
+        self.system_message = SystemMessage(content="You are a helpful assistant.")
+        # session_id -> pandas agent (holds its DataFrame), least recently used first
+        self.agents = OrderedDict()
+        # session_id -> deque of (run_id, {"data", "layout"}) tuples, least recently used first
+        self.plots_storage = OrderedDict()
+        # session_id -> ((role, content) keys, converted LangChain messages)
+        self._history_cache = OrderedDict()
+        # session_id -> (version, DataFrame) uploaded once per dataset, least recently used first
+        self.datasets = OrderedDict()
+        # session_id -> (version, image data URL) uploaded once per image, least recently used first
+        self.images = OrderedDict()
+        # Created on first use so it binds to the server's event loop (Python 3.9)
+        self._csv_sem = None
+    def convert_to_langchain_messages(self, messages: List[ChatMessage]) -> List:
+        """Convert custom ChatMessage objects to LangChain messages"""
+        if not messages:
+            return []
+        # Unknown roles are sent as user turns
+        return [_ROLE_CLS.get(msg.role, HumanMessage)(content=msg.content) for msg in messages]
+    def _get_history_messages(self, chat_history: List[ChatMessage], session_id=None) -> List:
+        """Convert chat history, reusing the prefix already converted for this session"""
+        if not session_id:
+            return self.convert_to_langchain_messages(chat_history)
+        
+        keys = [(msg.role, msg.content) for msg in chat_history]
+        cached = self._history_cache.get(session_id)
+        
+        if cached and len(keys) >= len(cached[0]) and keys[:len(cached[0])] == cached[0]:
+            # Only the new tail of the history needs converting
+            cached_keys, cached_messages = cached
+            converted = cached_messages + self.convert_to_langchain_messages(chat_history[len(cached_keys):])
+        else:
+            converted = self.convert_to_langchain_messages(chat_history)
+        
+        self._history_cache[session_id] = (keys, converted)
+        self._history_cache.move_to_end(session_id)
+        if len(self._history_cache) > MAX_CACHED_SESSIONS:
+            self._history_cache.popitem(last=False)
+        
+        return converted
+    def _build_messages(self, chat_history, session_id, user_message):
+        """System prompt, the sliding window of recent history, then the new user turn"""
+        history = self._get_history_messages(chat_history, session_id)
+        return (self.system_message, *history[-MAX_PROMPT_HISTORY:], user_message)
+    async def generate_text_response(self, user_input, chat_history, session_id=None):
+        """Generate text response with history"""
+        messages = self._build_messages(chat_history, session_id, HumanMessage(content=user_input))
+        response = self.llm.astream(messages)
+        async for chunk in response:
+            yield chunk
+    
+    def generate_image_response(self, user_input, image_data, chat_history, session_id=None, image_url=None):
+        """Generate response for image analysis; pass image_url to use an image from put_image"""
+        if image_url is None:
+            image_url = f"data:{_image_mime_type(image_data)};base64,{image_data}"
+        content = [
+            {"type": "text", "text": user_input},
+            {"type": "image_url", "image_url": {"url": image_url}}
+        ]
+        messages = self._build_messages(chat_history, session_id, HumanMessage(content=content))
+        
+        return self.llm.astream(messages)
+    def generate_csv_response(self, enhanced_query: str, dataframe=None, session_id=None, run_id=None) -> str:
+        """Generate response for CSV analysis using pandas agent
+        
+        Plots created during this call are tagged with run_id, so get_plots
+        can pick them out without clearing the session's earlier plots.
+        """
+        try:
+            if dataframe is None:
+                return "❌ No dataset available. Please upload a CSV file first."
+            
+            agent = self._get_or_create_agent(dataframe, session_id)
+            
+            token = _plot_run.set(run_id or uuid4().hex)
+            try:
+                response = agent.run(enhanced_query)
+            finally:
+                _plot_run.reset(token)
+            
+            return response
+            
+        except Exception as e:
+            return f"❌ Error analyzing CSV data: {str(e)}"
+
+    async def agenerate_csv_response(self, enhanced_query: str, dataframe=None, session_id=None, run_id=None) -> str:
+        """Run generate_csv_response in a worker thread, bounded by MAX_CONCURRENT_CSV_RUNS"""
+        if self._csv_sem is None:
+            self._csv_sem = asyncio.Semaphore(MAX_CONCURRENT_CSV_RUNS)
+        async with self._csv_sem:
+            return await asyncio.to_thread(
+                self.generate_csv_response, enhanced_query, dataframe, session_id, run_id
+            )
+
+    def put_dataset(self, session_id, dataframe, version=None):
+        """Keep a session's parsed dataset for later turns; a new version also drops the session's agent"""
+        self.datasets[session_id] = (version, dataframe)
+        self.datasets.move_to_end(session_id)
+        while len(self.datasets) > MAX_CACHED_SESSIONS:
+            evicted_id, _ = self.datasets.popitem(last=False)
+            # The agent references the evicted frame; drop it too or the frame stays alive
+            self.agents.pop(evicted_id, None)
+        # The pandas agent is bound to the frame it was created with
+        self.agents.pop(session_id, None)
+
+    def get_dataset(self, session_id, version=None):
+        """The session's uploaded DataFrame, or None if missing or of another version"""
+        entry = self.datasets.get(session_id)
+        if entry is None or (version is not None and entry[0] != version):
+            return None
+        self.datasets.move_to_end(session_id)
+        return entry[1]
+
+    def put_image(self, session_id, image_url, version=None):
+        """Keep a session's image, as the data URL sent to the model, for later turns"""
+        self.images[session_id] = (version, image_url)
+        self.images.move_to_end(session_id)
+        while len(self.images) > MAX_CACHED_SESSIONS:
+            self.images.popitem(last=False)
+
+    def get_image(self, session_id, version=None):
+        """The session's uploaded image data URL, or None if missing or of another version"""
+        entry = self.images.get(session_id)
+        if entry is None or (version is not None and entry[0] != version):
+            return None
+        self.images.move_to_end(session_id)
+        return entry[1]
+
+    def iter_csv_response(self, enhanced_query: str, dataframe=None, session_id=None, run_id=None):
+        """Yield ("status", tool name) for each agent step, then ("text", answer)
+        
+        Must be consumed from a single thread, since the plot run id lives in a ContextVar.
+        """
+        if dataframe is None:
+            yield "text", "❌ No dataset available. Please upload a CSV file first."
+            return
+        
+        token = _plot_run.set(run_id or uuid4().hex)
+        try:
+            agent = self._get_or_create_agent(dataframe, session_id)
+            for chunk in agent.stream({"input": enhanced_query}):
+                for action in chunk.get("actions", ()):
+                    yield "status", action.tool
+                if "output" in chunk:
+                    yield "text", chunk["output"]
+        except Exception as e:
+            yield "text", f"❌ Error analyzing CSV data: {str(e)}"
+        finally:
+            _plot_run.reset(token)
+
+    async def astream_csv_response(self, enhanced_query: str, dataframe=None, session_id=None, run_id=None):
+        """Async view of iter_csv_response; the agent runs in one worker thread, bounded like agenerate_csv_response"""
+        if self._csv_sem is None:
+            self._csv_sem = asyncio.Semaphore(MAX_CONCURRENT_CSV_RUNS)
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        done = object()
+        
+        def produce():
+            try:
+                for event in self.iter_csv_response(enhanced_query, dataframe, session_id, run_id):
+                    loop.call_soon_threadsafe(events.put_nowait, event)
+            finally:
+                loop.call_soon_threadsafe(events.put_nowait, done)
+        
+        async with self._csv_sem:
+            worker = asyncio.ensure_future(asyncio.to_thread(produce))
+            try:
+                while True:
+                    event = await events.get()
+                    if event is done:
+                        break
+                    yield event
+            finally:
+                # Hold the slot until the agent thread has really finished
+                await worker
+
+    def _get_or_create_agent(self, dataframe, session_id=None):
+        """Get existing agent or create new one with plot tools"""
+        try:
+            if session_id and session_id in self.agents:
+                self.agents.move_to_end(session_id)
+                return self.agents[session_id]
+            plot_tools = self._create_plot_tools(session_id)
+            
+            agent = create_pandas_dataframe_agent(
+                self.llm,
+                dataframe,
+                verbose=True,
+                handle_parsing_errors=True,
+                allow_dangerous_code=True,  
+                agent_type="openai-tools",  
+                max_iterations=3,  # Reduce for testing
+                early_stopping_method="generate", 
+                return_intermediate_steps=False,
+                extra_tools=plot_tools
+            )
+            
+            if session_id:
+                self.agents[session_id] = agent
+                while len(self.agents) > MAX_CACHED_SESSIONS:
+                    self.agents.popitem(last=False)
+            
+            return agent
+            
+        except Exception as e:
+            raise Exception(f"Error creating agent: {str(e)}")
+    def _create_plot_tools(self, session_id=None):
+        """Create plotting tools for the agent"""
+        try:
+            @tool
+            def plotChart(data: str) -> str:
+                """Plots json data using plotly Figure. Use it only for plotting charts and graphs."""
+                try:
+                    # Parse once; Figure() validates the dict without another string pass
+                    fig = Figure(orjson.loads(data))
+                    
+                    if session_id:
+                        # Keep the serializable payload rather than the Figure object
+                        plot_dict = fig.to_plotly_json()
+                        self._session_plots(session_id).append((_plot_run.get(), {
+                            "data": plot_dict.get("data", []),
+                            "layout": plot_dict.get("layout", {})
+                        }))
+                    
+                    return "Chart created successfully and will be displayed to the user."
+                    
+                except Exception as e:
+                    return f"Error plotting chart: {str(e)}"
+            
+            return [plotChart]
+            
+        except Exception as e:
+            return []
+    
+    def _session_plots(self, session_id):
+        """Get (or create) the plot deque for a session, evicting the least recently used"""
+        plots = self.plots_storage.get(session_id)
+        if plots is None:
+            plots = self.plots_storage[session_id] = deque(maxlen=MAX_PLOTS_PER_SESSION)
+            if len(self.plots_storage) > MAX_CACHED_SESSIONS:
+                self.plots_storage.popitem(last=False)
+        else:
+            self.plots_storage.move_to_end(session_id)
+        return plots
+    
+    def get_plots(self, session_id, run_id=None):
+        """Get serialized plots ({"data", "layout"} dicts) for a session, optionally for one run only"""
+        try:
+            if session_id in self.plots_storage:
+                # Snapshot first; the plot tool may still be appending from another thread
+                tagged = list(self.plots_storage[session_id])
+                plots = [plot for plot_run, plot in tagged if run_id is None or plot_run == run_id]
+                logger.debug("📊 Found %d plots in storage", len(plots))
+                return plots
+            logger.debug("📊 No plots found for session %s", session_id)
+            return []
+        except Exception as e:
+            logger.error("❌ Error getting plots: %s", e)
+            return []
+
+    def clear_plots(self, session_id, run_id=None):
+        """Clear plots for a session, or only those produced by one run"""
+        try:
+            if run_id is None:
+                self.plots_storage.pop(session_id, None)
+                return
+            plots = self.plots_storage.get(session_id)
+            if plots is not None:
+                remaining = [item for item in list(plots) if item[0] != run_id]
+                plots.clear()
+                plots.extend(remaining)
+        except Exception as e:
+            pass
+
+ai_service = AIService()
@@ -1,13 +1,25 @@
+import logging
+from collections import defaultdict
 from datetime import datetime
 from utils.supabase_client import supabase
 
+logger = logging.getLogger(__name__)
+
+# Session ids per messages query, keeping the in.(...) filter's URL short
+SESSION_ID_CHUNK = 100
+# Rows requested per page; at or below PostgREST's default max-rows (1000), so a
+# short page reliably means the end of the result
+MESSAGES_PAGE_SIZE = 1000
+
 class ChatRepository:
     """Repository pattern for database operations - Backend only"""
     
-    def __init__(self):
-        self.client = supabase.client if supabase.client else None
+    @property
+    def client(self):
+        # Resolved per call: the async client is only created at app startup
+        return supabase.client
 
-    def create_session(self, session_data):
+    async def create_session(self, session_data):
         """Create new session - save basic information only"""
         if not self.client:
             return None
@@ -19,10 +31,10 @@ class ChatRepository:
             "created_at": datetime.now().isoformat()
         }
         
-        response = self.client.table("chat_sessions").insert(data).execute()
+        response = await self.client.table("chat_sessions").insert(data).execute()
         return response.data[0] if response.data else None
 
-    def add_message(self, session_id, message_data):
+    async def add_message(self, session_id, message_data):
         """Add one message to session"""
         if not self.client:
             return None
@@ -35,77 +47,153 @@ class ChatRepository:
             "message_type": message_data.get("type", "text")
         }
         
-        response = self.client.table("chat_messages").insert(data).execute()
+        response = await self.client.table("chat_messages").insert(data).execute()
         return response.data[0] if response.data else None
 
-    def get_session_messages(self, session_id):
-        """Get all messages for one session"""
+    async def add_messages(self, session_id, messages_data):
+        """Add several messages to session with a single insert"""
+        if not self.client or not messages_data:
+            return []
+            
+        now = datetime.now().isoformat()
+        data = [
+            {
+                "session_id": session_id,
+                "role": message_data["role"],
+                "content": message_data["content"],
+                "timestamp": message_data.get("timestamp", now),
+                "message_type": message_data.get("type", "text")
+            }
+            for message_data in messages_data
+        ]
+        
+        response = await self.client.table("chat_messages").insert(data).execute()
+        return response.data if response.data else []
+
+    async def get_session_messages(self, session_id, limit=None, before_id=None):
+        """Get messages for one session: all of them, or the newest `limit` older than before_id"""
         if not self.client:
             return []
             
-        response = self.client.table("chat_messages")\
+        if limit is None:
+            response = await self.client.table("chat_messages")\
+                .select("*")\
+                .eq("session_id", session_id)\
+                .order("timestamp")\
+                .execute()
+                
+            return response.data if response.data else []
+        
+        # Keyset page on the autoincrement id, newest first, then flip to chronological order
+        query = self.client.table("chat_messages")\
             .select("*")\
-            .eq("session_id", session_id)\
-            .order("timestamp")\
-            .execute()
-            
-        return response.data if response.data else []
+            .eq("session_id", session_id)
+        if before_id is not None:
+            query = query.lt("id", before_id)
+        response = await query.order("id", desc=True).limit(limit).execute()
+        
+        return list(reversed(response.data)) if response.data else []
 
-    def get_all_sessions(self):
+    async def get_all_sessions(self):
         """Get all sessions with message count"""
         if not self.client:
             return {}
             
         # Get sessions
-        sessions_response = self.client.table("chat_sessions")\
+        sessions_response = await self.client.table("chat_sessions")\
             .select("*")\
             .order("created_at", desc=True)\
             .execute()
             
+        sessions = sessions_response.data or []
+        if not sessions:
+            return {}
+        
+        # Get messages a chunk of sessions at a time, then bucket by session
+        session_ids = [session["session_id"] for session in sessions]
+        messages_by_session = defaultdict(list)
+        for i in range(0, len(session_ids), SESSION_ID_CHUNK):
+            for message in await self._get_messages_for_sessions(session_ids[i:i + SESSION_ID_CHUNK]):
+                messages_by_session[message["session_id"]].append(message)
+            
         sessions_data = {}
         
-        for session in sessions_response.data:
+        for session in sessions:
             session_id = session["session_id"]
             
-            # Get messages for this session
-            messages = self.get_session_messages(session_id)
-            
             sessions_data[session_id] = {
                 "name": session["name"],
                 "mode": session["mode"],
                 "created_at": session["created_at"],
-                "messages": messages
+                "messages": messages_by_session.get(session_id, [])
             }
             
         return sessions_data
 
-    def delete_session(self, session_id):
+    async def _get_messages_for_sessions(self, session_ids):
+        """All messages of the given sessions in timestamp order, paged past the max-rows cap"""
+        messages = []
+        start = 0
+        while True:
+            # id breaks timestamp ties so pages neither overlap nor skip rows
+            response = await self.client.table("chat_messages")\
+                .select("*")\
+                .in_("session_id", session_ids)\
+                .order("timestamp")\
+                .order("id")\
+                .range(start, start + MESSAGES_PAGE_SIZE - 1)\
+                .execute()
+            page = response.data or []
+            messages.extend(page)
+            if len(page) < MESSAGES_PAGE_SIZE:
+                return messages
+            start += MESSAGES_PAGE_SIZE
+
+    async def get_sessions_version(self):
+        """Cheap fingerprint of the session list: session count plus newest created_at"""
+        if not self.client:
+            return None
+            
+        try:
+            response = await self.client.table("chat_sessions")\
+                .select("created_at", count="exact")\
+                .order("created_at", desc=True)\
+                .limit(1)\
+                .execute()
+                
+            newest = response.data[0]["created_at"] if response.data else ""
+            return f"{response.count or 0}:{newest}"
+        except Exception as e:
+            logger.error("❌ Error getting sessions version: %s", e)
+            return None
+
+    async def delete_session(self, session_id):
         """Delete session and all its messages"""
         if not self.client:
             return False
             
         try:
             # Delete files first
-            self.delete_session_files(session_id)
+            await self.delete_session_files(session_id)
             
             # Delete messages first
-            self.client.table("chat_messages")\
+            await self.client.table("chat_messages")\
                 .delete()\
                 .eq("session_id", session_id)\
                 .execute()
                 
             # Delete session
-            self.client.table("chat_sessions")\
+            await self.client.table("chat_sessions")\
                 .delete()\
                 .eq("session_id", session_id)\
                 .execute()
                 
             return True
         except Exception as e:
-            print(f"Error deleting session: {e}")
+            logger.error("Error deleting session: %s", e)
             return False
 
-    def save_session_file(self, session_id, file_type, file_data, file_name=None):
+    async def save_session_file(self, session_id, file_type, file_data, file_name=None):
         """Save file data (CSV/Image) for session to database with storage strategy support"""
         if not self.client:
             return None
@@ -129,22 +217,48 @@ class ChatRepository:
             #         .eq("file_type", file_type)\
             #         .execute()
             # else:
-            response = self.client.table("session_files").insert(data).execute()
+            response = await self.client.table("session_files").insert(data).execute()
                 
-            print(f"💾 Database save file success for session {session_id}")
+            logger.debug("💾 Database save file success for session %s", session_id)
             return response.data[0] if response.data else None
             
         except Exception as e:
-            print(f"❌ Error saving session file: {e}")
+            logger.error("❌ Error saving session file: %s", e)
             return None
 
-    def get_session_file(self, session_id, file_type):
+    async def save_session_files(self, session_id, files_data):
+        """Save several files for session with a single insert"""
+        if not self.client or not files_data:
+            return []
+            
+        try:
+            now = datetime.now().isoformat()
+            data = [
+                {
+                    "session_id": session_id,
+                    "file_type": file_data["file_type"],
+                    "file_name": file_data.get("file_name"),
+                    "file_data": file_data["file_data"],
+                    "created_at": now
+                }
+                for file_data in files_data
+            ]
+            
+            response = await self.client.table("session_files").insert(data).execute()
+            logger.debug("💾 Database save %d files success for session %s", len(data), session_id)
+            return response.data if response.data else []
+            
+        except Exception as e:
+            logger.error("❌ Error saving session files: %s", e)
+            return []
+
+    async def get_session_file(self, session_id, file_type):
         """Get file data for session from database"""
         if not self.client:
             return None
             
         try:
-            response = self.client.table("session_files")\
+            response = await self.client.table("session_files")\
                 .select("*")\
                 .eq("session_id", session_id)\
                 .eq("file_type", file_type)\
@@ -152,17 +266,17 @@ class ChatRepository:
                 
             if response.data and len(response.data) > 0:
                 file_record = response.data[0]
-                print(f"✅ Database get file success: {file_type} -> {file_type} for session {session_id}")
+                logger.debug("✅ Database get file success: %s for session %s", file_type, session_id)
                 return file_record
             else:
-                print(f"📭 File not found in database: {file_type} -> {file_type} for session {session_id}")
+                logger.debug("📭 File not found in database: %s for session %s", file_type, session_id)
                 return None
                 
         except Exception as e:
-            print(f"❌ Error getting session file: {e}")
+            logger.error("❌ Error getting session file: %s", e)
             return None
 
-    def delete_session_files(self, session_id, file_type=None):
+    async def delete_session_files(self, session_id, file_type=None):
         """Delete file data for session"""
         if not self.client:
             return False
@@ -175,10 +289,10 @@ class ChatRepository:
             if file_type:
                 query = query.eq("file_type", file_type)
                 
-            query.execute()
+            await query.execute()
             return True
         except Exception as e:
-            print(f"❌ Error deleting session files: {e}")
+            logger.error("❌ Error deleting session files: %s", e)
             return False
 
 # Initialize repository instance
@@ -5,13 +5,16 @@ class SessionService:
     def __init__(self):
         self.repository = chat_repo
     
-    def get_all_sessions(self) -> Dict[str, Any]:
-        return self.repository.get_all_sessions()
+    async def get_all_sessions(self) -> Dict[str, Any]:
+        return await self.repository.get_all_sessions()
     
-    def create_session(self, session_data: Dict[str, Any]) -> Dict[str, Any]:
-        return self.repository.create_session(session_data)
+    async def get_sessions_version(self) -> str:
+        return await self.repository.get_sessions_version()
     
-    def delete_session(self, session_id: str) -> bool:
-        return self.repository.delete_session(session_id)
+    async def create_session(self, session_data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.repository.create_session(session_data)
+    
+    async def delete_session(self, session_id: str) -> bool:
+        return await self.repository.delete_session(session_id)
 
 session_service = SessionService()
\ No newline at end of file
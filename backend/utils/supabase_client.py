@@ -1,24 +1,32 @@
 import os
-import streamlit as st
-from supabase import create_client, Client
+import logging
+from supabase import acreate_client, AsyncClient
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 class SupabaseClient:
     def __init__(self):
         self.url = os.getenv("SUPABASE_URL")
         self.key = os.getenv("SUPABASE_KEY")
-        self.client: Client = None
-        
-        if self.url and self.key:
-            try:
-                self.client = create_client(self.url, self.key)
-            except Exception as e:
-                st.error(f"❌ Supabase connection error: {e}")
+        # Created in connect() once the server's event loop is running
+        self.client: AsyncClient = None
+    
+    async def connect(self):
+        """Create the process-wide async client and warm up its connection pool"""
+        if self.client is not None or not (self.url and self.key):
+            return
+        try:
+            self.client = await acreate_client(self.url, self.key)
+            # Cheap query so DNS, TLS and auth are settled before the first real request
+            await self.client.table("chat_sessions").select("session_id").limit(1).execute()
+        except Exception as e:
+            logger.error("❌ Supabase connection error: %s", e)
     
     def is_connected(self):
         return self.client is not None
 
 # Global instance
-supabase = SupabaseClient()
\ No newline at end of file
+supabase = SupabaseClient()
@@ -1,15 +1,27 @@
 import streamlit as st
+from collections import OrderedDict
+from itertools import islice
 from utils.session_manager import (
     add_chat_to_sessions, 
     delete_chat_session, 
     clear_all_chats,
-    create_new_chat,
-    load_sessions_from_database
+    load_sessions_from_database,
+    touch_session,
+    batch_state,
+    new_chat_state
 )
 from services.api_client import api_client
 
-def render_sidebar():
-    st.sidebar.markdown("""
+# Chats listed in the sidebar
+MAX_SIDEBAR_CHATS = 15
+
+MODES = (("💬", "core"), ("🖼️", "image"), ("📊", "csv"))
+MODE_ICONS = {"core": "💬", "image": "🖼️", "csv": "📊"}
+
+# Upload state dropped when switching modes
+TEMP_KEYS = ('pending_upload', 'temp_df', 'temp_csv_name')
+
+SIDEBAR_CSS = """
     <style>
     .sidebar-chat-list {
         max-height: 400px;
@@ -30,20 +42,28 @@ def render_sidebar():
         border-left: 3px solid #ff4b4b;
     }
     </style>
-    """, unsafe_allow_html=True)
+    """
+
+def render_sidebar():
+    st.sidebar.markdown(SIDEBAR_CSS, unsafe_allow_html=True)
 
     # Initialize session state
     if "all_sessions" not in st.session_state:
-        st.session_state.all_sessions = {}
+        st.session_state.all_sessions = OrderedDict()
     if "current_session" not in st.session_state:
         st.session_state.current_session = None
     if "show_new_chat" not in st.session_state:
         st.session_state.show_new_chat = True
     if "current_mode" not in st.session_state:
         st.session_state.current_mode = "core"
-    if "sessions_loaded" not in st.session_state:
-        load_sessions_from_database()
-        st.session_state.sessions_loaded = True
+    # Reload only when the server's session list changed (e.g. from another tab)
+    version = api_client.get_sessions_version() if api_client.base_url else None
+    if ("sessions_loaded" not in st.session_state or
+            (version is not None and version != st.session_state.get("_sessions_version"))):
+        # Remember the version only once the list really is loaded, so failures are retried
+        if load_sessions_from_database():
+            st.session_state.sessions_loaded = True
+            st.session_state._sessions_version = version
 
     with st.sidebar:
         status_text = "🟢 API Connected" if api_client.base_url else "🟡 Local"
@@ -53,11 +73,9 @@ def render_sidebar():
         
         # Mode selection with auto new chat
         mode_cols = st.columns(3)
-        modes = [("💬", "core"), ("🖼️", "image"), ("📊", "csv")]
-        
         current_mode = st.session_state.current_mode
         
-        for i, (icon, mode) in enumerate(modes):
+        for i, (icon, mode) in enumerate(MODES):
             with mode_cols[i]:
                 if st.button(
                     icon, 
@@ -76,29 +94,11 @@ def render_sidebar():
         
         # New Chat button - creates chat in current mode
         if st.button("✨ New Chat", use_container_width=True, key="new_chat_main"):
-            create_new_chat()  # This will use the current mode
-            st.rerun()
+            batch_state(**new_chat_state())  # This will use the current mode
         
         st.markdown("---")
         
-        st.markdown("**Chats**")
-        
-        if st.session_state.all_sessions:
-            st.markdown('<div class="sidebar-chat-list">', unsafe_allow_html=True)
-            
-            # Get sorted chats - ALWAYS sort when rendering
-            sorted_chats = get_sorted_sessions()
-            
-            for chat_id, chat_data in sorted_chats[:15]:  # Show only top 15
-                render_chat_item_fast(chat_id, chat_data)
-            
-            st.markdown('</div>', unsafe_allow_html=True)
-            
-            total_chats = len(st.session_state.all_sessions)
-            if total_chats > 15:
-                st.caption(f"... and {total_chats - 15} more chats")
-        else:
-            st.info("No chats yet", icon="💬")
+        _render_chat_list()
         
         st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
         
@@ -108,66 +108,68 @@ def render_sidebar():
                 
         st.markdown('</div>', unsafe_allow_html=True)
 
-def get_sorted_sessions():
-    """Get sessions sorted by creation time (newest first) with caching"""
-    if not st.session_state.all_sessions:
-        return []
+@st.fragment
+def _render_chat_list():
+    """Render the chat list; list-only changes rerun just this fragment"""
+    st.markdown("**Chats**")
     
-    # Check cache to avoid unnecessary sorting
-    current_session_count = len(st.session_state.all_sessions)
-    if (hasattr(st.session_state, 'cached_sorted_sessions') and 
-        st.session_state.cached_sorted_sessions_count == current_session_count):
-        return st.session_state.cached_sorted_sessions
+    if st.session_state.all_sessions:
+        st.markdown('<div class="sidebar-chat-list">', unsafe_allow_html=True)
+        
+        sorted_chats = get_sorted_sessions()
+        active_id = st.session_state.current_session
+        # Looked up once for the whole list rather than per item
+        button, columns = st.button, st.columns
+        
+        for chat_id, chat_data in sorted_chats:
+            render_chat_item_fast(chat_id, chat_data, active_id, button, columns)
+        
+        st.markdown('</div>', unsafe_allow_html=True)
+        
+        total_chats = len(st.session_state.all_sessions)
+        if total_chats > MAX_SIDEBAR_CHATS:
+            st.caption(f"... and {total_chats - MAX_SIDEBAR_CHATS} more chats")
+    else:
+        st.info("No chats yet", icon="💬")
+
+def get_sorted_sessions():
+    """Get the newest sessions to list; all_sessions is already kept newest first
     
-    # Sort by created_at timestamp, newest first
-    sorted_sessions = sorted(
-        list(st.session_state.all_sessions.items()),
-        key=lambda x: x[1].get("created_at", ""), 
-        reverse=True
-    )
+    The result is cached until a mutation site calls invalidate_sorted_sessions().
+    """
+    cached = st.session_state.get("cached_sorted_sessions")
+    if cached is not None:
+        return cached
     
-    # Cache results
+    sorted_sessions = list(islice(st.session_state.all_sessions.items(), MAX_SIDEBAR_CHATS))
     st.session_state.cached_sorted_sessions = sorted_sessions
-    st.session_state.cached_sorted_sessions_count = current_session_count
-    
     return sorted_sessions
 
 def switch_mode_and_create_chat(new_mode):
     """Switch to new mode and prepare for new chat"""
     # Only switch mode and reset state, DO NOT create chat_id
-    st.session_state.current_mode = new_mode
-    st.session_state.current_session = None
-    st.session_state.show_new_chat = True
-    
-    # Reset messages and temp data
-    if "current_messages" in st.session_state:
-        st.session_state.current_messages = []
+    updates = new_chat_state()
+    updates["current_mode"] = new_mode
     
-    # Reset temp data
-    temp_keys = ['temp_image_data', 'uploaded_image_name', 'temp_df', 'temp_csv_name']
-    for key in temp_keys:
-        if hasattr(st.session_state, key):
-            delattr(st.session_state, key)
-    
-    st.rerun()
+    # Reset temp data in the same batch
+    batch_state(delete=TEMP_KEYS, **updates)
 
-def render_chat_item_fast(chat_id, chat_data):
+def render_chat_item_fast(chat_id, chat_data, active_id, button=st.button, columns=st.columns):
     """Render chat item with mode awareness"""
     name = chat_data.get("name", "Untitled")
     mode = chat_data.get("mode", "core")
     
-    mode_icons = {"core": "💬", "image": "🖼️", "csv": "📊"}
-    icon = mode_icons.get(mode, "💭")
+    icon = MODE_ICONS.get(mode, "💭")
     
-    display_name = name[:20] + "..." if len(name) > 20 else name
+    display_name = f"{name[:20]}…" if len(name) > 20 else name
     
-    is_active = chat_id == st.session_state.current_session
+    is_active = chat_id == active_id
     
-    col1, col2 = st.columns([0.85, 0.15])
+    col1, col2 = columns([0.85, 0.15])
     
     with col1:
         with st.container():
-            if st.button(
+            if button(
                 f"{icon} {display_name}", 
                 key=f"btn_{chat_id}",
                 use_container_width=True,
@@ -176,28 +178,23 @@ def render_chat_item_fast(chat_id, chat_data):
                 load_chat_session_fast(chat_id, chat_data)
     
     with col2:
-        if st.button(
+        if button(
             "❌", 
             key=f"del_{chat_id}",
             help=f"Delete {name}",
             use_container_width=True
         ):
             delete_chat_session(chat_id, name)
-            st.rerun()
 
 def load_chat_session_fast(chat_id, chat_data):
     """Load session and update corresponding mode"""
     try:
-        st.session_state.current_session = chat_id
-        st.session_state.show_new_chat = False
+        touch_session(chat_id)
         
         # Update mode from the loaded chat
         mode = chat_data.get("mode", "core")
-        st.session_state.current_mode = mode
-        
-        st.rerun()
+        batch_state(current_session=chat_id, show_new_chat=False, current_mode=mode)
         
     except Exception as e:
         st.error(f"Error loading chat")
-        create_new_chat() 
-        st.rerun()
\ No newline at end of file
+        batch_state(**new_chat_state())
\ No newline at end of file
@@ -1,14 +1,37 @@
 import streamlit as st
+import logging
+from collections import deque
 from datetime import datetime
 from components.sidebar import add_chat_to_sessions
-from utils.session_manager import save_current_session
+from utils.session_manager import save_current_session, queue_session_save, invalidate_sorted_sessions
 from services.api_client import api_client
 from utils.helpers import (
     display_message_timestamp,
-    prepare_chat_history_for_api,
+    get_chat_history_for_api,
+    extend_chat_history_cache,
+    stream_api_response,
     generate_fallback_response
 )
 
+logger = logging.getLogger(__name__)
+
+# Caption format for message timestamps
+TS_FMT = '%H:%M • %b %d, %Y'
+# Messages kept in session state; older ones drop off the left end
+MAX_MESSAGES = 50
+
+# User-facing messages for failed chat requests, by HTTP status
+STATUS_MESSAGES = {
+    400: "❌ Bad request. Please check your input and try again.",
+    401: "❌ Authentication error. Please check your API credentials.",
+    403: "❌ Access forbidden. Please check your permissions.",
+    404: "❌ Service not found. Please check the endpoint URL.",
+    429: "❌ Rate limit exceeded. Please wait a moment and try again.",
+    500: "❌ Server error. Please try again later.",
+    502: "❌ Bad gateway. The server is temporarily unavailable.",
+    503: "❌ Service unavailable. Please try again later.",
+}
+
 
 def render_core_chat():
     """Core Chat Mode - Multi-turn text conversations with AI assistant"""
@@ -34,7 +57,7 @@ def _display_chat_history(current_session_id):
     try:
         # Initialize messages array if not exists
         if "current_messages" not in st.session_state:
-            st.session_state.current_messages = []
+            st.session_state.current_messages = deque(maxlen=MAX_MESSAGES)
         
         # Load from API only when needed (new session or session changed)
         if current_session_id and (not st.session_state.current_messages or 
@@ -59,32 +82,46 @@ def _display_chat_history(current_session_id):
 
 def _load_messages_from_api(session_id):
     """Load messages from API only when necessary"""
+    # Sessions created in this browser session have no stored messages yet
+    if session_id in st.session_state.get("_empty_sessions", ()):
+        st.session_state.current_messages = deque(maxlen=MAX_MESSAGES)
+        st.session_state.last_session_id = session_id
+        return
+    
     try:
         db_messages = api_client.get_session_messages(session_id)
         if db_messages:
-            st.session_state.current_messages = db_messages
+            st.session_state.current_messages = deque(db_messages, maxlen=MAX_MESSAGES)
             st.session_state.last_session_id = session_id
             print(f"✅ Loaded {len(db_messages)} messages from API")
         else:
-            st.session_state.current_messages = []
+            st.session_state.current_messages = deque(maxlen=MAX_MESSAGES)
             print(f"ℹ️ No messages found for session {session_id}")
             
     except ConnectionError as e:
         st.error("❌ Connection error: Cannot connect to server. Please check your internet connection.")
-        st.session_state.current_messages = []
+        st.session_state.current_messages = deque(maxlen=MAX_MESSAGES)
         print(f"❌ Connection error loading messages: {e}")
         
     except TimeoutError as e:
         st.error("❌ Timeout error: Server took too long to respond.")
-        st.session_state.current_messages = []
+        st.session_state.current_messages = deque(maxlen=MAX_MESSAGES)
         print(f"❌ Timeout error loading messages: {e}")
         
     except Exception as e:
         st.error(f"❌ Error loading messages: {str(e)}")
-        st.session_state.current_messages = []
+        st.session_state.current_messages = deque(maxlen=MAX_MESSAGES)
         print(f"❌ Error loading messages: {e}")
 
 
+def _current_messages():
+    """current_messages as a bounded deque; other modes and resets may leave a plain list"""
+    messages = st.session_state.get("current_messages")
+    if not isinstance(messages, deque) or messages.maxlen != MAX_MESSAGES:
+        messages = st.session_state.current_messages = deque(messages or (), maxlen=MAX_MESSAGES)
+    return messages
+
+
 def _show_welcome_message():
     """Display welcome message for new chat sessions"""
     st.info("""
@@ -115,9 +152,8 @@ def _process_user_message(user_input, current_session_id):
         
         # Display user message
         with st.chat_message("user"):
-            st.caption(f"🕒 {current_time.strftime('%H:%M • %b %d, %Y')}")
+            st.caption(f"🕒 {current_time.strftime(TS_FMT)}")
             st.markdown(user_input)
-        _auto_scroll_to_bottom()
         
         # Create new session if needed
         session_id = _ensure_session_exists(user_input, current_session_id)
@@ -152,7 +188,9 @@ def _ensure_session_exists(user_input, current_session_id):
             # Update session state
             st.session_state.current_session = chat_id
             st.session_state.show_new_chat = False
-            st.session_state.current_messages = []
+            st.session_state.current_messages = deque(maxlen=MAX_MESSAGES)
+            st.session_state.last_session_id = chat_id
+            st.session_state._empty_sessions = st.session_state.get("_empty_sessions", set()) | {chat_id}
             
             print(f"🆕 Created session from first message: {chat_id}")
             return chat_id
@@ -169,8 +207,9 @@ def _generate_ai_response(user_input, session_id, current_time):
     """Generate AI response via backend API with comprehensive error handling"""
     with st.chat_message("assistant"):
         try:
-            response_time = datetime.now()
-            st.caption(f"🕒 {response_time.strftime('%H:%M • %b %d, %Y')}")
+            # Same turn as the user message, so reuse its timestamp
+            response_time = current_time
+            st.caption(f"🕒 {response_time.strftime(TS_FMT)}")
             
             message_placeholder = st.empty()
             full_response = ""
@@ -180,7 +219,7 @@ def _generate_ai_response(user_input, session_id, current_time):
             
             # Prepare chat history for API
             try:
-                chat_history = prepare_chat_history_for_api(st.session_state.current_messages)
+                chat_history = get_chat_history_for_api(st.session_state.current_messages)
                 print(f"📝 Prepared chat history: {len(chat_history)} messages")
             except Exception as e:
                 st.error("❌ Error preparing conversation history")
@@ -189,28 +228,18 @@ def _generate_ai_response(user_input, session_id, current_time):
             
             # Call API with timeout handling
             try:
-                response = api_client.stream_chat(user_input, chat_history)
+                response = api_client.stream_chat(user_input, chat_history, session_id)
                 
                 if response and response.status_code == 200:
                     # Process streaming response
                     try:
-                        for chunk in response.iter_content(decode_unicode=True, chunk_size=1024):
-                            if chunk:
-                                full_response += chunk
-                                message_placeholder.markdown(full_response + "▌")
-                        
-                        message_placeholder.markdown(full_response)
+                        full_response = stream_api_response(response, message_placeholder)
                         
                         # Validate response content
                         if not full_response.strip():
                             full_response = "I received an empty response. Please try again."
                             message_placeholder.markdown(full_response)
                             
-                    except UnicodeDecodeError as e:
-                        st.error("❌ Encoding error in response stream")
-                        full_response = "I encountered an encoding error. Please try again."
-                        message_placeholder.markdown(full_response)
-                        
                     except Exception as e:
                         st.error("❌ Error reading response stream")
                         full_response = "I encountered an error while processing the response. Please try again."
@@ -220,24 +249,9 @@ def _generate_ai_response(user_input, session_id, current_time):
                     # Handle HTTP status codes
                     status_code = response.status_code if response else "Unknown"
                     
-                    if status_code == 400:
-                        error_msg = "❌ Bad request. Please check your input and try again."
-                    elif status_code == 401:
-                        error_msg = "❌ Authentication error. Please check your API credentials."
-                    elif status_code == 403:
-                        error_msg = "❌ Access forbidden. Please check your permissions."
-                    elif status_code == 404:
-                        error_msg = "❌ Service not found. Please check the endpoint URL."
-                    elif status_code == 429:
-                        error_msg = "❌ Rate limit exceeded. Please wait a moment and try again."
-                    elif status_code == 500:
-                        error_msg = "❌ Server error. Please try again later."
-                    elif status_code == 502:
-                        error_msg = "❌ Bad gateway. The server is temporarily unavailable."
-                    elif status_code == 503:
-                        error_msg = "❌ Service unavailable. Please try again later."
-                    else:
-                        error_msg = f"❌ Request failed with status {status_code}. Please try again."
+                    error_msg = STATUS_MESSAGES.get(
+                        status_code, f"❌ Request failed with status {status_code}. Please try again."
+                    )
                     
                     st.error(error_msg)
                     full_response = "Sorry, I couldn't process your request at this time. Please try again."
@@ -264,7 +278,7 @@ def _generate_ai_response(user_input, session_id, current_time):
         except Exception as e:
             # Critical error handling
             critical_error_msg = "❌ **Critical Error**: Unable to generate response. Please refresh the page and try again."
-            st.caption(f"🕒 {datetime.now().strftime('%H:%M • %b %d, %Y')}")
+            st.caption(f"🕒 {current_time.strftime(TS_FMT)}")
             st.error("A critical error occurred.")
             _handle_response_error(user_input, session_id, current_time, e)
 
@@ -272,8 +286,7 @@ def _generate_ai_response(user_input, session_id, current_time):
 def _update_chat_history(user_input, ai_response, session_id, user_time, ai_time):
     """Update chat history in session state and save to database"""
     try:
-        # Add new messages to session state
-        new_messages = st.session_state.current_messages + [
+        new_entries = [
             {
                 "role": "user", 
                 "content": user_input,
@@ -286,24 +299,15 @@ def _update_chat_history(user_input, ai_response, session_id, user_time, ai_time
             }
         ]
         
-        # Limit message history to prevent memory issues (keep last 50 messages)
-        if len(new_messages) > 50:
-            new_messages = new_messages[-50:]
-            print(f"ℹ️ Truncated chat history to 50 messages")
-        
-        # Update session state
-        st.session_state.current_messages = new_messages
+        # Append in place; maxlen keeps only the last 50 messages
+        messages = _current_messages()
+        messages.extend(new_entries)
+        extend_chat_history_cache(messages, new_entries)
+        st.session_state.get("_empty_sessions", set()).discard(session_id)
         
-        # Save to database with error handling
-        try:
-            save_current_session(new_messages)
-            print(f"💾 Saved {len(new_messages)} messages to database")
-        except ConnectionError as e:
-            st.error("❌ Connection error: Could not save conversation. Your messages may not be persisted.")
-            print(f"❌ Database connection error: {e}")
-        except Exception as e:
-            st.error("❌ Error saving conversation. Your messages may not be persisted.")
-            print(f"❌ Database save error: {e}")
+        # Save to database in the background; the worker logs its own failures
+        queue_session_save(session_id, list(messages))
+        logger.debug("💾 Queued %d messages for saving", len(messages))
             
     except Exception as e:
         st.error(f"❌ Error updating chat history: {str(e)}")
@@ -320,6 +324,7 @@ def _update_session_name(user_input, session_id):
         
         if session_id in st.session_state.all_sessions:
             st.session_state.all_sessions[session_id]["name"] = new_name
+            invalidate_sorted_sessions()
             print(f"📝 Updated session name to: {new_name}")
             
     except Exception as e:
@@ -333,11 +338,12 @@ def _handle_response_error(user_input, session_id, current_time, error):
         error_time = datetime.now()
         
         # Display error message
-        st.caption(f"🕒 {error_time.strftime('%H:%M • %b %d, %Y')}")
+        st.caption(f"🕒 {error_time.strftime(TS_FMT)}")
         st.error("An unexpected error occurred. Our team has been notified.")
         
         # Update session state with error message
-        new_messages = st.session_state.current_messages + [
+        messages = _current_messages()
+        messages.extend([
             {
                 "role": "user", 
                 "content": user_input,
@@ -348,33 +354,17 @@ def _handle_response_error(user_input, session_id, current_time, error):
                 "content": error_msg,
                 "timestamp": error_time.isoformat()
             }
-        ]
-        
-        st.session_state.current_messages = new_messages
+        ])
         
         # Save to database
         try:
-            save_current_session(new_messages)
+            save_current_session(list(messages))
         except Exception as save_error:
             print(f"❌ Failed to save error messages: {save_error}")
             
     except Exception as e:
         print(f"❌ Critical error in error handling: {e}")
         # Reset state to avoid infinite error loops
-        st.session_state.current_messages = []
+        st.session_state.current_messages = deque(maxlen=MAX_MESSAGES)
+        st.session_state.pop("_prep_hist_cache", None)
         st.error("A critical error occurred. Please refresh the page.")
-        
-    
-def _auto_scroll_to_bottom():
-    """Force scroll to bottom of the chat container."""
-    st.markdown(
-        """
-        <script>
-        var chatContainer = window.parent.document.querySelector('.stChatMessageContainer');
-        if (chatContainer) {
-            chatContainer.scrollTop = chatContainer.scrollHeight;
-        }
-        </script>
-        """,
-        unsafe_allow_html=True
-    )
\ No newline at end of file
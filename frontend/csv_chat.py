@@ -1,18 +1,230 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
+import numpy as np
 import os
+import io
+import base64
+import hashlib
 import tempfile
+import logging
+import textwrap
+import threading
+from collections import OrderedDict, deque, namedtuple
+from itertools import islice
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from urllib.parse import urlparse
 import requests
+import orjson
 from components.sidebar import add_chat_to_sessions
-from utils.session_manager import save_current_session, load_session_file_data, save_session_file_data
+from utils.session_manager import (
+    queue_session_append,
+    pop_save_error,
+    load_session_file_data,
+    queue_session_files_save
+)
 from services.api_client import api_client
 from utils.helpers import (
     display_message_timestamp,
     prepare_chat_history_for_api
 )
-import plotly.graph_objects as go
+
+logger = logging.getLogger(__name__)
+
+# DataFrames kept in the shared store before the least recently used is dropped
+MAX_CACHED_DATAFRAMES = 32
+_df_store_lock = threading.Lock()
+
+
+@st.cache_resource
+def _df_store():
+    """Process-wide DataFrame store keyed by chat session id
+
+    session_state keeps only file_info/loaded flags, so Streamlit never copies the frames.
+    """
+    return OrderedDict()
+
+
+def _get_session_df(session_id):
+    with _df_store_lock:
+        store = _df_store()
+        df = store.get(session_id)
+        if df is not None:
+            store.move_to_end(session_id)
+        return df
+
+
+def _set_session_df(session_id, df):
+    # Restored records can arrive as a dict; convert once here, never on read
+    if isinstance(df, dict):
+        df = pd.DataFrame(df)
+    with _df_store_lock:
+        store = _df_store()
+        store[session_id] = df
+        store.move_to_end(session_id)
+        while len(store) > MAX_CACHED_DATAFRAMES:
+            store.popitem(last=False)
+    return df
+
+
+# Per-session file facts read on every rerun, precomputed from file_info
+FileMeta = namedtuple('FileMeta', ['size_mb', 'rows', 'cols', 'is_large'])
+
+
+@lru_cache(maxsize=256)
+def _is_large(size_mb, rows):
+    """Files at least this big only keep metadata in permanent storage"""
+    return size_mb >= 10 or rows > 1000
+
+
+def _make_meta(file_info):
+    """Build the FileMeta for a file_info dict once, when it is stored"""
+    size_mb = file_info.get('size_mb', 0)
+    rows = file_info.get('rows', 0)
+    return FileMeta(size_mb, rows, file_info.get('columns', 0), _is_large(size_mb, rows))
+
+
+def _session_meta(session_id):
+    """FileMeta for a session, or None when it has no file info"""
+    entry = st.session_state.session_data.get(session_id) if session_id else None
+    return entry.get('meta') if entry else None
+
+
+# Messages fetched per page of chat history
+HISTORY_PAGE_SIZE = 30
+
+# Messages kept in session state; loading older pages raises the cap to fit them
+MAX_MESSAGES = 50
+
+# Messages drawn per rerun; earlier loaded ones stay hidden until requested
+RENDER_WINDOW = 50
+
+SCROLL_TO_LATEST_JS = """
+<script>
+const messages = window.parent.document.querySelectorAll('[data-testid="stChatMessage"]');
+if (messages.length) {
+    messages[messages.length - 1].scrollIntoView({block: "end"});
+}
+</script>
+"""
+
+# Upload state held until the first message creates the session
+CSV_TEMP_KEYS = ('temp_df', 'temp_file_info', 'temp_csv_name', 'temp_file_obj', 'temp_file_path')
+
+# Scatter traces longer than this render with WebGL; longer still are downsampled
+SCATTERGL_MIN_POINTS = 1000
+DOWNSAMPLE_MIN_POINTS = 5000
+DOWNSAMPLE_POINTS = 2000
+
+# Per-chart limits, whatever the model returns: traces drawn, and points across all traces
+MAX_CHART_TRACES = 100
+MAX_CHART_POINTS = 20000
+MIN_TRACE_POINTS = 100
+
+# Set CSV_PLOTLY_HTML=1 to send charts straight to the browser as Plotly JSON instead of
+# st.plotly_chart; each chart is then its own iframe carrying the installed plotly.js
+PLOTLY_HTML_CHARTS = os.getenv("CSV_PLOTLY_HTML", "0") == "1"
+DEFAULT_CHART_HEIGHT = 500
+
+PLOTLY_HTML_TEMPLATE = """
+<style>body {{ margin: 0; }}</style>
+<div id="chart" style="width:100%;height:{height}px;"></div>
+<script>{plotly_js}</script>
+<script>
+Plotly.newPlot("chart", {data}, {layout}, {{responsive: true, displaylogo: false}});
+</script>
+"""
+
+# Largest CSV accepted from a URL
+MAX_URL_BYTES = 200 * 1024 * 1024
+
+URL_REQUEST_HEADERS = {'User-Agent': 'Mozilla/5.0 (compatible; CSV-Analyzer)'}
+
+# Content types accepted from a URL without a warning
+CSV_CONTENT_TYPES = frozenset({'text/csv', 'application/csv', 'text/plain'})
+
+# Bytes sampled for encoding detection
+ENCODING_SNIFF_BYTES = 65536
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _parse_csv_bytes(digest, size, _raw):
+    """Parse CSV bytes with a sniffed encoding; cached by (sha256 digest, size) across reruns
+    
+    Returns (DataFrame, encoding).
+    """
+    encoding = _detect_encoding(_raw)
+    try:
+        return _downcast(_read_csv_once(io.BytesIO(_raw), encoding)), encoding
+    except (UnicodeDecodeError, LookupError):
+        pass
+    except pd.errors.ParserError as e:
+        # The pyarrow engine reports bad bytes as a parser error
+        if "UTF8" not in str(e):
+            raise
+    # latin-1 maps every byte, so this single retry cannot fail on decoding
+    return _downcast(_read_csv_once(io.BytesIO(_raw), 'latin-1')), 'latin-1'
+
+
+def _downcast(df):
+    """Shrink integer columns to the smallest dtype that holds their values
+
+    Lossless, unlike float32 or categoricals; api_client widens them back to
+    int64 before upload so the agent's arithmetic cannot overflow.
+    """
+    for col in df.select_dtypes("integer").columns:
+        df[col] = pd.to_numeric(df[col], downcast="integer")
+    return df
+
+
+def _detect_encoding(raw):
+    """Guess the encoding from a prefix instead of retrying full parses"""
+    # Imported on the first upload rather than when the page loads
+    from charset_normalizer import from_bytes
+    
+    best = from_bytes(raw[:ENCODING_SNIFF_BYTES]).best()
+    return best.encoding if best and best.encoding else 'utf-8'
+
+
+def _read_csv_once(source, encoding=None):
+    """Read a whole CSV in one pass with Arrow's multithreaded parser, or pandas' C engine"""
+    try:
+        return pd.read_csv(source, encoding=encoding, engine="pyarrow")
+    except ImportError:
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return pd.read_csv(source, encoding=encoding)
+
+
+@st.cache_data(show_spinner=False, persist="disk", max_entries=16)
+def _fetch_csv_url(url):
+    """Download a CSV URL; repeat loads of the same URL are served from Streamlit's disk cache
+    
+    Returns (content bytes, lower-cased response headers).
+    """
+    with requests.get(url, stream=True, timeout=30, headers=URL_REQUEST_HEADERS) as response:
+        response.raise_for_status()
+        
+        # Check file size
+        content_length = response.headers.get('content-length')
+        if content_length and int(content_length) > MAX_URL_BYTES:
+            raise ValueError("File too large (over 200MB). Please use a smaller file.")
+        
+        buf = io.BytesIO()
+        for chunk in response.iter_content(chunk_size=65536):
+            if chunk:
+                buf.write(chunk)
+                if buf.tell() > MAX_URL_BYTES:
+                    raise ValueError("File exceeds 200MB limit during download.")
+        
+        return buf.getvalue(), {k.lower(): v for k, v in response.headers.items()}
+
+
+def _parse_csv_cached(raw):
+    """Hash the raw bytes once and parse them through the cached parser"""
+    return _parse_csv_bytes(hashlib.sha256(raw).hexdigest(), len(raw), raw)
 
 def render_csv_chat():
     """Main CSV Chat Mode - AI-powered CSV data analysis interface"""
@@ -27,27 +239,58 @@ def render_csv_chat():
         
         st.markdown("---")
         
-        # Display chat interface based on state
-        if st.session_state.show_new_chat or st.session_state.current_session is None:
-            _show_chat_placeholder(display_df)
-        else:
-            _display_chat_history(st.session_state.current_session)
-        
-        # Process user input
-        user_input = st.chat_input("Ask about the data...")
-        if user_input:
-            _process_user_message(user_input, st.session_state.current_session, display_df)
+        _chat_history_panel(display_df)
+        _chat_input_panel(display_df)
             
     except Exception as e:
         st.error(f"❌ Unexpected error in CSV chat: {str(e)}")
 
 
-def _display_chat_history(current_session_id):
+@st.fragment
+def _chat_history_panel(display_df):
+    """Chat history as of the last full run; sending messages does not redraw it"""
+    # Everything sent so far is drawn here, so the tail starts empty again
+    st.session_state.chat_tail = []
+    current_session_id = st.session_state.current_session
+    
+    # Display chat interface based on state
+    if st.session_state.show_new_chat or current_session_id is None:
+        _show_chat_placeholder(display_df)
+    else:
+        _display_chat_history(current_session_id, display_df)
+
+
+@st.fragment
+def _chat_input_panel(display_df):
+    """Messages sent since the history was drawn, then the chat input
+    
+    Sending a message reruns only this panel, so each turn draws just the new tail.
+    """
+    for msg in st.session_state.get("chat_tail", ()):
+        _render_message(msg)
+    
+    # Saves run in the background; report a failed one on the next turn
+    save_error = pop_save_error(st.session_state.current_session)
+    if save_error:
+        st.warning("⚠️ Could not save the last messages. Your conversation may not be persisted.")
+    
+    # Process user input; read the session from state since the first message creates it here
+    user_input = st.chat_input("Ask about the data...")
+    if user_input:
+        _process_user_message(user_input, st.session_state.current_session, display_df)
+
+
+def _render_message(msg):
+    with st.chat_message(msg["role"]):
+        display_message_timestamp(msg)
+        st.markdown(msg["content"])
+
+
+def _display_chat_history(current_session_id, display_df=None):
     """Display chat messages from session state without API calls"""
     try:
-        # Initialize messages array if not exists
-        if "current_messages" not in st.session_state:
-            st.session_state.current_messages = []
+        # Initialize messages deque if not exists (other modes may leave a list)
+        _csv_messages()
         
         # Load from API only when needed (new session or session changed)
         if current_session_id and (not st.session_state.current_messages or 
@@ -56,39 +299,92 @@ def _display_chat_history(current_session_id):
         
         # Show placeholder if no messages
         if not st.session_state.current_messages:
-            _show_chat_placeholder(_get_current_dataframe(current_session_id))
+            _show_chat_placeholder(display_df)
             return
         
-        # Render all messages from session state
-        for msg in st.session_state.current_messages:
-            with st.chat_message(msg["role"]):
-                display_message_timestamp(msg)
-                st.markdown(msg["content"])
+        # Older pages are only fetched on request
+        if st.session_state.get("has_older_messages"):
+            if st.button("⬆ Load older", key="load_older_messages"):
+                _load_older_messages(current_session_id)
+                # Full run so the input panel's tail is folded back into the history
+                st.rerun()
+        
+        # Render only the newest messages; each one costs a Markdown pass per rerun
+        msgs = st.session_state.current_messages
+        window = st.session_state.get("render_window", RENDER_WINDOW)
+        hidden = len(msgs) - window
+        if hidden > 0:
+            if st.button(f"Show {min(hidden, RENDER_WINDOW)} earlier messages", key="grow_render_window"):
+                st.session_state.render_window = window + RENDER_WINDOW
+                st.rerun()
+            msgs = islice(msgs, hidden, None)
+        
+        for msg in msgs:
+            _render_message(msg)
                 
     except Exception as e:
         st.error(f"❌ Error displaying chat history: {str(e)}")
-        _show_chat_placeholder(_get_current_dataframe(current_session_id))
+        _show_chat_placeholder(display_df)
 
 
 def _load_messages_from_api(session_id):
-    """Load messages from API only when necessary"""
+    """Load the newest page of messages from API only when necessary"""
     try:
-        db_messages = api_client.get_session_messages(session_id)
+        db_messages = api_client.get_session_messages(session_id, limit=HISTORY_PAGE_SIZE)
+        _set_history_cursor(db_messages)
+        st.session_state.render_window = RENDER_WINDOW
         if db_messages:
-            st.session_state.current_messages = db_messages
+            st.session_state.current_messages = deque(db_messages, maxlen=MAX_MESSAGES)
             st.session_state.last_session_id = session_id
         else:
-            st.session_state.current_messages = []
+            st.session_state.current_messages = deque(maxlen=MAX_MESSAGES)
             
     except ConnectionError as e:
         st.error("❌ Connection error: Cannot load chat history. Please check your connection.")
-        st.session_state.current_messages = []
+        st.session_state.current_messages = deque(maxlen=MAX_MESSAGES)
     except TimeoutError as e:
         st.error("❌ Timeout error: Server took too long to respond.")
-        st.session_state.current_messages = []
+        st.session_state.current_messages = deque(maxlen=MAX_MESSAGES)
     except Exception as e:
         st.error(f"❌ Error loading messages: {str(e)}")
-        st.session_state.current_messages = []
+        st.session_state.current_messages = deque(maxlen=MAX_MESSAGES)
+
+
+def _csv_messages():
+    """current_messages as a bounded deque, converting the plain list other modes leave behind"""
+    messages = st.session_state.get("current_messages")
+    if not isinstance(messages, deque):
+        messages = deque(messages or (), maxlen=MAX_MESSAGES)
+        st.session_state.current_messages = messages
+    return messages
+
+
+def _load_older_messages(session_id):
+    """Prepend the page of messages just before the oldest one loaded"""
+    try:
+        older = api_client.get_session_messages(
+            session_id,
+            limit=HISTORY_PAGE_SIZE,
+            before_id=st.session_state.get("oldest_loaded_id")
+        )
+        _set_history_cursor(older)
+        if older:
+            merged = older + list(st.session_state.current_messages)
+            st.session_state.current_messages = deque(merged, maxlen=max(MAX_MESSAGES, len(merged)))
+            # Keep the page the user asked for visible
+            st.session_state.render_window = (
+                st.session_state.get("render_window", RENDER_WINDOW) + len(older)
+            )
+    except Exception as e:
+        st.error(f"❌ Error loading older messages: {str(e)}")
+
+
+def _set_history_cursor(page):
+    """Remember where the next older page starts; a short page means history is exhausted"""
+    st.session_state.oldest_loaded_id = page[0].get("id") if page else None
+    st.session_state.has_older_messages = (
+        len(page) == HISTORY_PAGE_SIZE and st.session_state.oldest_loaded_id is not None
+    )
 
 
 def _handle_csv_upload_section(current_session_id):
@@ -101,16 +397,11 @@ def _handle_csv_upload_section(current_session_id):
         
         # Get current data state
         current_df = _get_current_dataframe(current_session_id)
-        has_temp_data = hasattr(st.session_state, 'temp_df') and st.session_state.temp_df is not None
+        has_temp_data = st.session_state.get('temp_df') is not None
         
         # Check if this is a large file with only metadata
-        is_large_file = False
-        if current_session_id and current_session_id in st.session_state.session_data:
-            file_info = st.session_state.session_data[current_session_id].get('file_info', {})
-            file_size_mb = file_info.get('size_mb', 0)
-            row_count = file_info.get('rows', 0)
-            if file_size_mb >= 10 or row_count > 1000:
-                is_large_file = True
+        meta = _session_meta(current_session_id)
+        is_large_file = bool(meta and meta.is_large)
         
         # Show upload options only if no data loaded
         if current_df is None and not has_temp_data and not is_large_file:
@@ -128,16 +419,14 @@ def _display_file_info(current_session_id):
     """Display information about current CSV file"""
     try:
         if current_session_id and current_session_id in st.session_state.session_data:
-            file_info = st.session_state.session_data[current_session_id].get('file_info', {})
-            if file_info:
-                filename = file_info.get('filename', 'Unknown')
-                size_mb = file_info.get('size_mb', 0)
-                rows = file_info.get('rows', 0)
-                columns = file_info.get('columns', 0)
+            session_data = st.session_state.session_data[current_session_id]
+            meta = session_data.get('meta')
+            if meta:
+                filename = session_data['file_info'].get('filename', 'Unknown')
                 
-                st.info(f"📁 **Current file**: {filename} ({size_mb:.2f} MB, {rows} rows, {columns} columns)")
+                st.info(f"📁 **Current file**: {filename} ({meta.size_mb:.2f} MB, {meta.rows} rows, {meta.cols} columns)")
     except Exception as e:
-        print(f"❌ Error displaying file info: {e}")
+        logger.exception("❌ Error displaying file info")
 
 
 def _initialize_session_data(current_session_id):
@@ -148,31 +437,32 @@ def _initialize_session_data(current_session_id):
         
     try:
         st.session_state.session_data[current_session_id] = {
-            'df': None,
             'file_info': None,
             'file_path': None,
+            'meta': None,
             'loaded': False
         }
         
         # Restore file info from API first
         file_info = load_session_file_data(current_session_id, 'csv_info')
         if file_info:
+            meta = _make_meta(file_info)
             st.session_state.session_data[current_session_id]['file_info'] = file_info
+            st.session_state.session_data[current_session_id]['meta'] = meta
             
             # Show caution for large files
-            file_size_mb = file_info.get('size_mb', 0)
-            row_count = file_info.get('rows', 0)
-            
-            if file_size_mb >= 10 or row_count > 1000:
-                st.error(f"⚠️ **Large file detected**: This dataset ({file_size_mb:.1f}MB, {row_count:,} rows) was too large for permanent storage. Please create a new chat and re-upload the file for analysis.")
+            if meta.is_large:
+                st.error(f"⚠️ **Large file detected**: This dataset ({meta.size_mb:.1f}MB, {meta.rows:,} rows) was too large for permanent storage. Please create a new chat and re-upload the file for analysis.")
                 return
             else:
                 # For small files, try to load full data
                 full_data = load_session_file_data(current_session_id, 'csv_data')
                 if full_data is not None:
-                    st.session_state.session_data[current_session_id]['df'] = full_data
+                    _set_session_df(current_session_id, full_data)
                     st.session_state.session_data[current_session_id]['loaded'] = True
                     st.success("✅ Full dataset restored from API")
+                else:
+                    st.session_state.session_data[current_session_id]['restore_failed'] = True
             
     except Exception as e:
         st.error(f"❌ Error restoring dataset info: {str(e)}")
@@ -216,31 +506,11 @@ def _handle_file_upload():
                 st.error("❌ File is empty. Please upload a valid CSV file.")
                 return
             
-            # Read file with encoding detection and chunking for large files
+            # Read file with encoding detection
             with st.spinner("📖 Reading CSV file..."):
                 try:
-                    # Try different encodings
-                    encodings = ['utf-8', 'latin-1', 'iso-8859-1', 'cp1252']
-                    new_df = None
-                    
-                    for encoding in encodings:
-                        try:
-                            uploaded_csv.seek(0)  # Reset file pointer
-                            if file_size > 10:  # Read in chunks for large files
-                                chunk_size = 10000
-                                chunks = []
-                                for chunk in pd.read_csv(uploaded_csv, chunksize=chunk_size, encoding=encoding):
-                                    chunks.append(chunk)
-                                new_df = pd.concat(chunks, ignore_index=True)
-                            else:
-                                new_df = pd.read_csv(uploaded_csv, encoding=encoding)
-                            break
-                        except UnicodeDecodeError:
-                            continue
-                    
-                    if new_df is None:
-                        st.error("❌ Could not read file encoding. Please try saving as UTF-8.")
-                        return
+                    # Parse once per distinct file; reruns hit the cache
+                    new_df, encoding = _parse_csv_cached(uploaded_csv.getvalue())
                     
                     # Validate DataFrame
                     if new_df.empty:
@@ -258,7 +528,8 @@ def _handle_file_upload():
                         'rows': len(new_df),
                         'columns': len(new_df.columns),
                         'columns_list': new_df.columns.tolist(),
-                        'encoding': 'detected',
+                        'encoding': encoding,
+                        'mem_bytes': int(new_df.memory_usage(deep=True).sum()),
                         'upload_timestamp': datetime.now().isoformat()
                     }
                     
@@ -296,6 +567,12 @@ def _handle_url_import():
             key="csv_url"
         )
         
+        force_refresh = st.checkbox(
+            "Force refresh",
+            key="csv_url_refresh",
+            help="Download the file again instead of reusing the cached copy"
+        )
+        
         if st.button("Load from URL", key="load_url") and csv_url:
             # Validate URL format
             parsed_url = urlparse(csv_url)
@@ -308,64 +585,47 @@ def _handle_url_import():
             
             with st.spinner("🔍 Downloading CSV..."):
                 try:
-                    # Download file with timeout
-                    headers = {'User-Agent': 'Mozilla/5.0 (compatible; CSV-Analyzer)'}
-                    response = requests.get(csv_url, stream=True, timeout=30, headers=headers)
-                    response.raise_for_status()
+                    if force_refresh:
+                        _fetch_csv_url.clear()
+                    
+                    # Download into memory once per URL; the parser reads the same bytes
+                    try:
+                        raw, response_headers = _fetch_csv_url(csv_url)
+                    except ValueError as e:
+                        st.error(f"❌ {e}")
+                        return
                     
                     # Check content type
-                    content_type = response.headers.get('content-type', '').lower()
-                    if 'text/csv' not in content_type and 'application/csv' not in content_type:
+                    content_type = response_headers.get('content-type', '').lower()
+                    if not any(ct in content_type for ct in CSV_CONTENT_TYPES):
                         st.warning(f"⚠️ Server returned content type: {content_type}")
                     
-                    # Check file size
-                    content_length = response.headers.get('content-length')
-                    if content_length:
-                        file_size = int(content_length) / (1024 * 1024)
-                        if file_size > 200:
-                            st.error("❌ File too large (over 200MB). Please use a smaller file.")
-                            return
-                    
-                    # Create temporary file
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as tmp_file:
-                        downloaded_size = 0
-                        for chunk in response.iter_content(chunk_size=8192):
-                            if chunk:
-                                tmp_file.write(chunk)
-                                downloaded_size += len(chunk)
-                                if downloaded_size > 200 * 1024 * 1024:
-                                    st.error("❌ File exceeds 200MB limit during download.")
-                                    os.unlink(tmp_file.name)
-                                    return
-                        tmp_file_path = tmp_file.name
+                    downloaded_size = len(raw)
                     
                     file_size = downloaded_size / (1024 * 1024)
                     
-                    # Read CSV file
+                    # Read CSV file through the same cached parser as uploads
                     try:
-                        if file_size > 10:
-                            chunk_size = 10000
-                            chunks = []
-                            for chunk in pd.read_csv(tmp_file_path, chunksize=chunk_size):
-                                chunks.append(chunk)
-                            new_df = pd.concat(chunks, ignore_index=True)
-                        else:
-                            new_df = pd.read_csv(tmp_file_path)
+                        new_df, encoding = _parse_csv_cached(raw)
                     except pd.errors.EmptyDataError:
                         st.error("❌ Downloaded file is empty.")
-                        os.unlink(tmp_file_path)
                         return
                     except pd.errors.ParserError as e:
                         st.error(f"❌ Error parsing CSV: {str(e)}")
-                        os.unlink(tmp_file_path)
                         return
                     
                     # Validate DataFrame
                     if new_df.empty:
                         st.error("❌ CSV file is empty or contains no data.")
-                        os.unlink(tmp_file_path)
                         return
                     
+                    # Only large downloads are kept on disk as well
+                    tmp_file_path = None
+                    if file_size >= 10:
+                        with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as tmp_file:
+                            tmp_file.write(raw)
+                            tmp_file_path = tmp_file.name
+                    
                     # Store file information
                     file_info = {
                         'filename': os.path.basename(parsed_url.path) or "url_import.csv",
@@ -375,6 +635,8 @@ def _handle_url_import():
                         'columns': len(new_df.columns),
                         'columns_list': new_df.columns.tolist(),
                         'url': csv_url,
+                        'encoding': encoding,
+                        'mem_bytes': int(new_df.memory_usage(deep=True).sum()),
                         'upload_timestamp': datetime.now().isoformat()
                     }
                     
@@ -416,22 +678,9 @@ def _handle_url_import():
 def _get_current_dataframe(current_session_id):
     """Get current DataFrame from session data or temporary storage"""
     try:
-        df_data = None
-        
         if current_session_id and current_session_id in st.session_state.session_data:
-            df_data = st.session_state.session_data[current_session_id].get('df')
-        else:
-            df_data = getattr(st.session_state, 'temp_df', None)
-        
-        # Convert dict to DataFrame if needed
-        if isinstance(df_data, dict):
-            try:
-                df_data = pd.DataFrame(df_data)
-            except Exception as e:
-                st.error(f"❌ Error converting stored data to DataFrame: {str(e)}")
-                return None
-        
-        return df_data
+            return _get_session_df(current_session_id)
+        return st.session_state.get('temp_df', None)
         
     except Exception as e:
         st.error(f"❌ Error accessing dataset: {str(e)}")
@@ -442,7 +691,7 @@ def _get_full_dataframe(session_id):
     """Get full DataFrame for analysis"""
     try:
         # First check if we have temporary data
-        temp_df = getattr(st.session_state, 'temp_df', None)
+        temp_df = st.session_state.get('temp_df', None)
         if temp_df is not None:
             return temp_df
         
@@ -450,23 +699,21 @@ def _get_full_dataframe(session_id):
             session_data = st.session_state.session_data[session_id]
             
             # Return data if available
-            if session_data.get('df') is not None:
-                return session_data['df']
+            df = _get_session_df(session_id)
+            if df is not None:
+                return df
             
             # Check if this is a large file with only metadata
-            file_info = session_data.get('file_info', {})
-            if file_info:
-                file_size_mb = file_info.get('size_mb', 0)
-                row_count = file_info.get('rows', 0)
-                
-                if file_size_mb >= 10 or row_count > 1000:
-                    return None
+            meta = session_data.get('meta')
+            if meta and meta.is_large:
+                return None
             
-            # For small files, try to load from csv_data
-            full_data = load_session_file_data(session_id, 'csv_data')
-            if full_data is not None:
-                session_data['df'] = full_data
-                return full_data
+            # For small files, try to load from csv_data - once, not on every turn
+            if not session_data.get('restore_failed'):
+                full_data = load_session_file_data(session_id, 'csv_data')
+                if full_data is not None:
+                    return _set_session_df(session_id, full_data)
+                session_data['restore_failed'] = True
         
         # Fallback to current data
         return _get_current_dataframe(session_id)
@@ -476,6 +723,21 @@ def _get_full_dataframe(session_id):
         return _get_current_dataframe(session_id)
 
 
+def _null_count(df):
+    """Count missing values once per DataFrame, memoized in the session's data"""
+    session_id = st.session_state.current_session
+    entry = st.session_state.session_data.get(session_id) if session_id else None
+    cached = entry.get('null_count') if entry else None
+    if cached is not None and cached[0] == id(df):
+        return cached[1]
+    
+    # One reduction over the flat mask instead of per-column sums
+    count = int(df.isna().to_numpy().sum())
+    if entry is not None:
+        entry['null_count'] = (id(df), count)
+    return count
+
+
 def _display_dataset_overview(df):
     """Display dataset overview and statistics"""
     try:
@@ -487,23 +749,30 @@ def _display_dataset_overview(df):
         with col2:
             st.metric("Columns", len(df.columns))
         with col3:
-            st.metric("Missing Values", df.isnull().sum().sum())
+            null_count = _null_count(df)
+            st.metric("Missing Values", null_count)
         
-        with st.expander("📋 Dataset Preview"):
-            st.dataframe(df.head(), use_container_width=True)
+        # Expander bodies run even when collapsed; the table is only built after opt-in
+        with st.expander("📋 Dataset Preview", expanded=False):
+            if st.checkbox("Show first rows", key="_preview_requested"):
+                preview = df.iloc[:5]
+                if all(isinstance(dtype, pd.ArrowDtype) for dtype in preview.dtypes):
+                    # Arrow-backed frames go to the frontend without a pandas->Arrow pass
+                    import pyarrow as pa
+                    preview = pa.Table.from_pandas(preview, preserve_index=False)
+                st.dataframe(preview, use_container_width=True)
         
         # Check if this is a large file with only metadata
-        current_session_id = st.session_state.current_session
-        if current_session_id and current_session_id in st.session_state.session_data:
-            file_info = st.session_state.session_data[current_session_id].get('file_info', {})
-            actual_rows = file_info.get('rows', 0)
+        meta = _session_meta(st.session_state.current_session)
+        if meta:
+            actual_rows = meta.rows
             current_rows = len(df)
             
             if actual_rows > current_rows:
                 st.warning(f"⚠️ **Large File Limitation**: Showing {current_rows} rows preview (original: {actual_rows:,} rows). Full analysis requires re-uploading the file.")
         
         # Show data quality warnings
-        if df.isnull().sum().sum() > len(df) * 0.5:
+        if null_count > len(df) * 0.5:
             st.warning("⚠️ High percentage of missing values detected. Data quality may be affected.")
         
         if len(df) == 0:
@@ -520,13 +789,9 @@ def _show_chat_placeholder(display_df):
     try:
         if display_df is not None:
             # Check if this is a large file with limitations
-            current_session_id = st.session_state.current_session
-            if current_session_id and current_session_id in st.session_state.session_data:
-                file_info = st.session_state.session_data[current_session_id].get('file_info', {})
-                file_size_mb = file_info.get('size_mb', 0)
-                row_count = file_info.get('rows', 0)
-                
-                if file_size_mb >= 10 or row_count > 1000:
+            meta = _session_meta(st.session_state.current_session)
+            if meta:
+                if meta.is_large:
                     st.warning("🎯 **Dataset loaded (Preview Mode)**: This large dataset is in preview mode. Ask questions about the data, but note the file will need to be re-uploaded for future sessions.")
                 else:
                     st.success("🎯 **Dataset loaded!** Ask questions about the data.")
@@ -544,14 +809,10 @@ def _process_user_message(user_input, current_session_id, display_df):
         current_time = datetime.now()
         
         # Check if this is a large file session with no data
-        if current_session_id and current_session_id in st.session_state.session_data:
-            file_info = st.session_state.session_data[current_session_id].get('file_info', {})
-            if file_info:
-                file_size_mb = file_info.get('size_mb', 0)
-                row_count = file_info.get('rows', 0)
-                if (file_size_mb >= 10 or row_count > 1000) and display_df is None:
-                    st.error(f"❌ **Large file limitation**: This dataset ({file_size_mb:.1f}MB, {row_count:,} rows) was too large for permanent storage. Please create a new chat and re-upload the file.")
-                    return
+        meta = _session_meta(current_session_id)
+        if meta and meta.is_large and display_df is None:
+            st.error(f"❌ **Large file limitation**: This dataset ({meta.size_mb:.1f}MB, {meta.rows:,} rows) was too large for permanent storage. Please create a new chat and re-upload the file.")
+            return
         
         # Validate data availability
         if display_df is None:
@@ -572,16 +833,13 @@ def _process_user_message(user_input, current_session_id, display_df):
             st.caption(f"🕒 {current_time.strftime('%H:%M • %b %d, %Y')}")
             st.markdown(user_input)
         
-        # Auto-scroll to bottom
-        _auto_scroll_to_bottom()
-        
         # Ensure session exists
         session_id = _ensure_session_exists(user_input, current_session_id, display_df)
         if not session_id:
             return
         
         # Generate AI response
-        _generate_ai_response(user_input, session_id, current_time)
+        _generate_ai_response(user_input, session_id, current_time, df=display_df)
         
     except Exception as e:
         st.error(f"❌ Error processing message: {str(e)}")
@@ -613,16 +871,18 @@ def _create_new_session(user_input, display_df):
         # Update session state
         st.session_state.current_session = chat_id
         st.session_state.show_new_chat = False
-        st.session_state.current_messages = []
+        st.session_state.current_messages = deque(maxlen=MAX_MESSAGES)
+        st.session_state.has_older_messages = False
         
         # Initialize session data
-        file_info = getattr(st.session_state, 'temp_file_info', {})
-        file_path = getattr(st.session_state, 'temp_file_path', None)
+        file_info = st.session_state.get('temp_file_info', {})
+        file_path = st.session_state.get('temp_file_path', None)
         
+        _set_session_df(chat_id, display_df)
         st.session_state.session_data[chat_id] = {
-            'df': display_df,
             'file_info': file_info,
             'file_path': file_path,
+            'meta': _make_meta(file_info) if file_info else None,
             'loaded': True
         }
         
@@ -641,126 +901,272 @@ def _create_new_session(user_input, display_df):
 def _save_csv_info_to_api(session_id, file_info):
     """Save file info to API - only save full data for small files"""
     try:
-        csv_name = getattr(st.session_state, 'temp_csv_name', "uploaded_data.csv")
+        csv_name = st.session_state.get('temp_csv_name', "uploaded_data.csv")
         
-        # Save metadata (always save)
-        save_session_file_data(session_id, 'csv_info', file_info, f"{csv_name}_info")
+        # Metadata is always saved; small files add their full data to the same request
+        files = [('csv_info', file_info, f"{csv_name}_info")]
         
         # Save full data only for small files
-        full_df = getattr(st.session_state, 'temp_df', None)
+        full_df = st.session_state.get('temp_df', None)
         if full_df is not None:
             # Check file size and row count conditions
-            file_size_mb = file_info.get('size_mb', 0)
-            row_count = file_info.get('rows', 0)
-            
-            if file_size_mb < 10 and row_count <= 1000:
+            if not _is_large(file_info.get('size_mb', 0), file_info.get('rows', 0)):
                 try:
-                    # Convert DataFrame to CSV string
-                    csv_string = full_df.to_csv(index=False)
+                    # Parquet keeps dtypes and is far smaller than CSV text; zstd packs
+                    # tighter than snappy and the payload is base64'd into JSON anyway
+                    buf = io.BytesIO()
+                    full_df.to_parquet(buf, engine="pyarrow", compression="zstd", index=False)
                     file_data_to_save = {
                         'file_type': 'csv_data',
-                        'csv_string': csv_string,
+                        'format': 'parquet',
+                        'parquet_b64': base64.b64encode(buf.getvalue()).decode("ascii"),
                         'rows': len(full_df),
                         'columns': len(full_df.columns),
                         'file_name': csv_name
                     }
                     
-                    save_session_file_data(session_id, 'csv_data', file_data_to_save, f"{csv_name}_data")
+                    files.append(('csv_data', file_data_to_save, f"{csv_name}_data"))
                 except Exception as e:
-                    print(f"❌ Error saving full data as CSV: {e}")
+                    logger.exception("❌ Error saving full data as Parquet")
+        
+        # Uploaded by the background save worker; failures surface via pop_save_error
+        queue_session_files_save(session_id, files)
                 
     except Exception as e:
-        print(f"❌ Error saving CSV info: {e}")
+        logger.exception("❌ Error saving CSV info")
 
 
 def _cleanup_temp_data():
     """Clean up temporary data after session creation"""
     try:
-        for key in ['temp_df', 'temp_file_info', 'temp_csv_name', 'temp_file_obj', 'temp_file_path']:
-            if hasattr(st.session_state, key):
-                delattr(st.session_state, key)
+        for key in CSV_TEMP_KEYS:
+            st.session_state.pop(key, None)
     except Exception as e:
-        print(f"❌ Error cleaning up temp data: {e}")
+        logger.exception("❌ Error cleaning up temp data")
 
 
-def _generate_ai_response(user_input, session_id, current_time):
+def _generate_ai_response(user_input, session_id, current_time, df=None):
     """Generate AI response using CSV-specific backend API with plotting support"""
+    # (content, time) of the assistant reply; whichever path sets it, the turn is saved once
+    answer = None
     with st.chat_message("assistant"):
         try:
             response_time = datetime.now()
             st.caption(f"🕒 {response_time.strftime('%H:%M • %b %d, %Y')}")
             
-            # Get full data for analysis
-            full_dataframe = _get_full_dataframe(session_id)
+            # Get full data for analysis; the frame already on screen skips the store/API lookup
+            full_dataframe = df if df is not None else _get_full_dataframe(session_id)
             
             if full_dataframe is None:
                 st.error("❌ Unable to load dataset for analysis.")
                 error_msg = "I couldn't access the dataset for analysis. Please try uploading the file again."
-                _update_chat_history(user_input, error_msg, session_id, current_time, response_time)
+                answer = (error_msg, response_time)
                 return
             
             # Prepare query with CSV context
             enhanced_query = _prepare_csv_context(user_input, st.session_state.current_messages)
             
-            # Show loading indicator
-            with st.spinner("🤔 Analyzing data and creating visualizations..."):
-                try:
-                    # Call CSV analysis API
-                    api_response = api_client.csv_chat(enhanced_query, full_dataframe, session_id)
-                    
-                    # Extract text response and plots
-                    text_response = api_response.get("content", "No response received.")
-                    plots_data = api_response.get("plots", [])
+            # Stream the analysis: tool steps show as status, plots arrive in the last event
+            status = st.empty()
+            status.caption("🤔 Analyzing data and creating visualizations...")
+            text_placeholder = st.empty()
+            text_response = ""
+            plots_data = []
+            try:
+                for event in _stream_csv_analysis(enhanced_query, full_dataframe, session_id):
+                    kind = event.get("type")
+                    if kind == "status":
+                        status.caption(f"⚙️ Running {event.get('content')}...")
+                    elif kind == "text":
+                        text_response += event.get("content", "")
+                        text_placeholder.markdown(text_response)
+                    elif kind == "plots":
+                        plots_data = event.get("plots", [])
+                    elif kind == "error":
+                        raise RuntimeError(event.get("content"))
+                status.empty()
+                
+                if not text_response:
+                    text_response = "No response received."
+                    text_placeholder.markdown(text_response)
+                
+                # Display plots if any
+                if plots_data:
+                    st.markdown("---")
+                    st.subheader("📊 Visualizations")
                     
-                    # Display text response
-                    st.markdown(text_response)
+                    # Build charts up front (in parallel for many), then render in order
+                    build_chart = _plotly_html if PLOTLY_HTML_CHARTS else _build_figure
+                    if len(plots_data) > 3:
+                        with ThreadPoolExecutor(max_workers=4) as pool:
+                            charts = list(pool.map(build_chart, plots_data))
+                    else:
+                        charts = [build_chart(plot_info) for plot_info in plots_data]
                     
-                    # Display plots if any
-                    if plots_data:
-                        st.markdown("---")
-                        st.subheader("📊 Visualizations")
-                        
-                        for i, plot_info in enumerate(plots_data):
+                    # Stable keys let Streamlit match each chart to its element instead of remounting
+                    turn_key = f"csv_plot_{session_id}_{response_time.timestamp()}"
+                    with st.container():
+                        for i, (plot_info, chart) in enumerate(zip(plots_data, charts)):
+                            if isinstance(chart, Exception):
+                                st.error(f"❌ Error displaying chart {i+1}: {str(chart)}")
+                                continue
                             try:
-                                # Recreate plotly figure from data
-                                fig = go.Figure(
-                                    data=plot_info.get("data", []),
-                                    layout=plot_info.get("layout", {})
-                                )
-                                
-                                st.plotly_chart(fig, use_container_width=True)
+                                if isinstance(chart, str):
+                                    components.html(chart, height=_chart_height(plot_info))
+                                else:
+                                    st.plotly_chart(chart, use_container_width=True, key=f"{turn_key}_{i}")
                             except Exception as plot_error:
                                 st.error(f"❌ Error displaying chart {i+1}: {str(plot_error)}")
-                    
-                    # Update chat history (only text response)
-                    _update_chat_history(user_input, text_response, session_id, current_time, response_time)
-                    _auto_scroll_to_bottom()
-                    
-                except Exception as api_error:
-                    st.error(f"❌ Analysis error: {str(api_error)}")
-                    error_msg = "I encountered an error while analyzing the data. Please try again or rephrase your question."
-                    _update_chat_history(user_input, error_msg, session_id, current_time, response_time)
+                
+                # Chat history keeps only the text response
+                answer = (text_response, response_time)
+                
+            except Exception as api_error:
+                status.empty()
+                st.error(f"❌ Analysis error: {str(api_error)}")
+                error_msg = "I encountered an error while analyzing the data. Please try again or rephrase your question."
+                answer = (error_msg, response_time)
             
         except Exception as e:
-            error_msg = f"❌ **System Error**: {str(e)}"
-            st.caption(f"🕒 {datetime.now().strftime('%H:%M • %b %d, %Y')}")
-            st.error("An unexpected error occurred during analysis.")
-            _handle_response_error(user_input, session_id, current_time, e)
+            answer = _handle_response_error(e)
+        finally:
+            if answer is not None:
+                _update_chat_history(user_input, answer[0], session_id, current_time, answer[1])
+    
+    _auto_scroll_to_bottom()
 
 
-def _prepare_csv_context(user_input, current_messages):
-    """Prepare enhanced query with CSV data context"""
+def _downsample_xy(x, y, n_out):
+    """Keep each bucket's min and max y (plus the last point) so peaks survive downsampling"""
+    n = len(y)
     try:
-        context_messages = []
-        for msg in current_messages[-20:]: 
-            if msg["role"] == "user":
-                context_messages.append(f"User: {msg['content']}")
-            elif msg["role"] == "assistant":
-                context_messages.append(f"Assistant: {msg['content']}")
+        values = np.asarray(y, dtype=float)
+    except (TypeError, ValueError):
+        # Non-numeric y: fall back to an even stride
+        idx = np.linspace(0, n - 1, n_out).astype(int)
+    else:
+        n_buckets = max(n_out // 2, 1)
+        size = n // n_buckets
+        blocks = values[:size * n_buckets].reshape(n_buckets, size)
+        nan = np.isnan(blocks)
+        offsets = np.arange(n_buckets) * size
+        lo = np.where(nan, np.inf, blocks).argmin(axis=1) + offsets
+        hi = np.where(nan, -np.inf, blocks).argmax(axis=1) + offsets
+        idx = np.unique(np.concatenate([lo, hi, [n - 1]]))
+    
+    new_x = np.asarray(x, dtype=object)[idx].tolist() if x is not None else idx.tolist()
+    return new_x, np.asarray(y, dtype=object)[idx].tolist()
+
+
+def _lighten_traces(traces):
+    """Switch long scatter traces to WebGL and downsample so the chart stays within its point budget"""
+    traces = traces[:MAX_CHART_TRACES]
+    limit, n_out = DOWNSAMPLE_MIN_POINTS, DOWNSAMPLE_POINTS
+    total = sum(len(trace["y"]) for trace in traces if isinstance(trace.get("y"), list))
+    if total > MAX_CHART_POINTS:
+        # Split the budget evenly so many medium traces are thinned too
+        limit = max(MAX_CHART_POINTS // len(traces), MIN_TRACE_POINTS)
+        n_out = min(n_out, limit)
+    
+    lightened = []
+    for trace in traces:
+        y = trace.get("y")
+        # Plain lists only; typed-array payloads and other trace types pass through
+        if trace.get("type", "scatter") in ("scatter", "scattergl") and isinstance(y, list):
+            if len(y) > SCATTERGL_MIN_POINTS:
+                trace = dict(trace, type="scattergl")
+            x = trace.get("x")
+            if len(y) > limit and (x is None or (isinstance(x, list) and len(x) == len(y))):
+                trace = dict(trace)
+                trace["x"], trace["y"] = _downsample_xy(x, y, n_out)
+        lightened.append(trace)
+    return lightened
+
+
+def _build_figure(plot_info):
+    """Recreate a plotly figure from the backend's serialized plot; returns the exception on failure"""
+    # Plotly is only imported once a response actually has charts
+    import plotly.graph_objects as go
+    
+    try:
+        # The backend built these with plotly already, so skip per-property validation
+        return go.Figure(
+            data=_lighten_traces(plot_info.get("data", [])),
+            layout=plot_info.get("layout", {}),
+            skip_invalid=True,
+            _validate=False
+        )
+    except Exception as e:
+        return e
+
+
+def _chart_height(plot_info):
+    return (plot_info.get("layout") or {}).get("height") or DEFAULT_CHART_HEIGHT
+
+
+def _json_for_script(value):
+    """Serialize for inlining in a <script> block without closing it early"""
+    return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY).decode().replace("</", "<\\/")
+
+
+@lru_cache(maxsize=1)
+def _plotly_js():
+    """plotly.js bundled with the installed plotly package, so charts need no CDN"""
+    from plotly.offline import get_plotlyjs
+    return get_plotlyjs()
+
+def _plotly_html(plot_info):
+    """Embed the backend's Plotly JSON in a page that draws it with Plotly.newPlot
+
+    Skips building a go.Figure only for Streamlit to serialize it again; returns the
+    exception on failure.
+    """
+    try:
+        return PLOTLY_HTML_TEMPLATE.format(
+            height=_chart_height(plot_info),
+            plotly_js=_plotly_js(),
+            data=_json_for_script(_lighten_traces(plot_info.get("data", []))),
+            layout=_json_for_script(plot_info.get("layout", {}))
+        )
+    except Exception as e:
+        return e
+
+
+def _dataset_version(session_id, df):
+    """Identify the session's dataset so a re-upload replaces the server's copy"""
+    entry = st.session_state.session_data.get(session_id) or {}
+    file_info = entry.get('file_info') or {}
+    if file_info.get('upload_timestamp'):
+        return f"{file_info.get('size_bytes', 0)}:{file_info['upload_timestamp']}"
+    return f"{len(df)}x{len(df.columns)}"
+
+
+def _stream_csv_analysis(enhanced_query, df, session_id):
+    """Stream analysis events, uploading the dataset only when the server doesn't have it"""
+    entry = st.session_state.session_data.setdefault(session_id, {})
+    version = _dataset_version(session_id, df)
+    
+    for attempt in range(2):
+        if entry.get('dataset_version_sent') != version:
+            if not api_client.ensure_dataset(session_id, df, version):
+                yield {"type": "error", "content": "Could not upload the dataset for analysis."}
+                return
+            entry['dataset_version_sent'] = version
         
-        chat_history = "\n".join(context_messages) if context_messages else "No previous conversation."
+        for event in api_client.csv_chat_stream(enhanced_query, session_id, version):
+            if event.get("type") == "dataset_missing":
+                # Server lost its copy (e.g. restarted); upload again and retry once
+                entry.pop('dataset_version_sent', None)
+                break
+            yield event
+        else:
+            return
+    
+    yield {"type": "error", "content": "The server did not keep the uploaded dataset."}
 
-        enhanced_query = f"""
+
+# Static analysis prompt; only the conversation and question are filled in per turn
+CSV_PROMPT_TEMPLATE = textwrap.dedent("""
         You are a smart data analysis assistant that helps users explore and understand CSV datasets.
 
         DATA CONTEXT:
@@ -786,20 +1192,72 @@ def _prepare_csv_context(user_input, current_messages):
         4. Be concise and data-driven in your responses
 
         Now analyze the dataset and provide the most relevant, data-driven answer:
-        """
+        """)
 
-        
-        return enhanced_query
+CONTEXT_ROLES = {"user": "User", "assistant": "Assistant"}
+
+# Prompt history budget: newest messages that fit in this many tokens, at most this many messages
+CONTEXT_TOKEN_BUDGET = 2000
+CONTEXT_MAX_MESSAGES = 20
+
+
+@lru_cache(maxsize=1)
+def _token_encoder():
+    """tiktoken encoder used to size history, or None when it is unavailable"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def _count_tokens(text):
+    encoder = _token_encoder()
+    if encoder is None:
+        # Roughly four characters per token for English text
+        return len(text) // 4 + 1
+    return len(encoder.encode(text))
+
+
+def _context_window(current_messages):
+    """Newest (role, content) pairs within the token budget, oldest first"""
+    window = []
+    used = 0
+    for msg in islice(reversed(current_messages), CONTEXT_MAX_MESSAGES):
+        used += _count_tokens(msg["content"])
+        if used > CONTEXT_TOKEN_BUDGET:
+            break
+        window.append((msg["role"], msg["content"]))
+    window.reverse()
+    return tuple(window)
+
+
+@lru_cache(maxsize=32)
+def _build_prompt(user_input, history_key):
+    """Format the prompt for a question and its (role, content) history; repeats hit the cache"""
+    chat_history = "\n".join(
+        f"{CONTEXT_ROLES[role]}: {content}"
+        for role, content in history_key
+        if role in CONTEXT_ROLES
+    ) or "No previous conversation."
+    
+    return CSV_PROMPT_TEMPLATE.format(chat_history=chat_history, user_input=user_input)
+
+
+def _prepare_csv_context(user_input, current_messages):
+    """Prepare enhanced query with CSV data context"""
+    try:
+        return _build_prompt(user_input, _context_window(current_messages))
         
     except Exception as e:
-        print(f"❌ Error preparing CSV context: {e}")
+        logger.exception("❌ Error preparing CSV context")
         return user_input  # Fallback to original query
 
 
 def _update_chat_history(user_input, ai_response, session_id, user_time, ai_time):
     """Update chat history in session state and save to database"""
     try:
-        new_messages = st.session_state.current_messages + [
+        new_entries = [
             {
                 "role": "user", 
                 "content": user_input,
@@ -811,71 +1269,28 @@ def _update_chat_history(user_input, ai_response, session_id, user_time, ai_time
                 "timestamp": ai_time.isoformat()
             }
         ]
+        # The deque's maxlen limits message history to prevent memory issues
+        _csv_messages().extend(new_entries)
+        st.session_state.setdefault("chat_tail", []).extend(new_entries)
         
-        # Limit message history to prevent memory issues
-        if len(new_messages) > 50:
-            new_messages = new_messages[-50:]
-        
-        # Update session state
-        st.session_state.current_messages = new_messages
-        
-        # Save to database
-        try:
-            save_current_session(new_messages)
-        except ConnectionError as e:
-            st.error("❌ Connection error: Could not save conversation. Your messages may not be persisted.")
-        except Exception as e:
-            st.error("❌ Error saving conversation. Your messages may not be persisted.")
+        # Save only this turn, off the render path; the loaded history may be just the newest page
+        queue_session_append(session_id, new_entries)
             
     except Exception as e:
         st.error(f"❌ Error updating chat history: {str(e)}")
 
 
-def _handle_response_error(user_input, session_id, current_time, error):
-    """Handle errors during response generation"""
-    try:
-        error_msg = f"❌ **System Error**: {str(error)}"
-        error_time = datetime.now()
-        
-        st.caption(f"🕒 {error_time.strftime('%H:%M • %b %d, %Y')}")
-        st.error("An unexpected error occurred. Our team has been notified.")
-        
-        new_messages = st.session_state.current_messages + [
-            {
-                "role": "user", 
-                "content": user_input,
-                "timestamp": current_time.isoformat()
-            },
-            {
-                "role": "assistant", 
-                "content": error_msg,
-                "timestamp": error_time.isoformat()
-            }
-        ]
-        
-        st.session_state.current_messages = new_messages
-        
-        try:
-            save_current_session(new_messages)
-        except Exception as save_error:
-            print(f"❌ Failed to save error messages: {save_error}")
-            
-    except Exception as e:
-        print(f"❌ Critical error in error handling: {e}")
-        st.session_state.current_messages = []
-        st.error("A critical error occurred. Please refresh the page.")
+def _handle_response_error(error):
+    """Show an unexpected turn failure; returns the (content, time) reply to record for it"""
+    error_msg = f"❌ **System Error**: {str(error)}"
+    error_time = datetime.now()
+    
+    st.caption(f"🕒 {error_time.strftime('%H:%M • %b %d, %Y')}")
+    st.error("An unexpected error occurred during analysis.")
+    return error_msg, error_time
 
 
 def _auto_scroll_to_bottom():
-    """Force scroll to bottom of the chat container"""
-    st.markdown(
-        """
-        <script>
-        var chatContainer = window.parent.document.querySelector('[data-testid="stChatMessageContainer"]');
-        if (chatContainer) {
-            chatContainer.scrollTop = chatContainer.scrollHeight;
-        }
-        </script>
-        """,
-        unsafe_allow_html=True
-    )
\ No newline at end of file
+    """Scroll the page to the newest chat message once the turn has rendered"""
+    # st.markdown never executes <script>; a zero-height component iframe does
+    components.html(SCROLL_TO_LATEST_JS, height=0)
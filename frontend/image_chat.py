@@ -1,24 +1,79 @@
 import streamlit as st
 import base64
+import hashlib
+import io
+import logging
+import os
+from collections import deque, namedtuple
 from datetime import datetime
 from components.sidebar import add_chat_to_sessions
-from utils.session_manager import save_current_session, load_session_file_data, save_session_file_data
+from utils.session_manager import (
+    save_current_session,
+    load_session_file_data,
+    queue_session_files_save,
+    pop_save_error
+)
 from services.api_client import api_client
 from utils.helpers import (
     display_message_timestamp,
-    prepare_chat_history_for_api,
+    get_chat_history_for_api,
+    extend_chat_history_cache,
+    stream_api_response,
     generate_fallback_response
 )
 
+logger = logging.getLogger(__name__)
+
+# Longest side kept when compressing large uploads
+MAX_IMAGE_DIMENSION = 2048
+
+# Images go to the backend once per session as raw bytes; set IMAGE_UPLOAD_BINARY=0 to send base64 every turn
+IMAGE_UPLOAD_BINARY = os.getenv("IMAGE_UPLOAD_BINARY", "1") != "0"
+
+# Caption format for message timestamps
+TS_FMT = '%H:%M • %b %d, %Y'
+
+# An upload waiting for the first message to create its session; stored whole, so it is never half set
+PendingUpload = namedtuple('PendingUpload', ['image_bytes', 'file_info', 'digest'])
+
+# Longest side of the on-page preview
+PREVIEW_MAX_DIMENSION = 1024
+
+# Messages kept in session state; older ones drop off the left end
+MAX_MESSAGES = 40
+
+# Large uploads are re-encoded as lossy WebP unless they need palette or transparency
+WEBP_QUALITY = 82
+FORMAT_MIME_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp'}
+
+# Optional image backends: libvips is preferred, Pillow is the fallback
+try:
+    import pyvips
+except (ImportError, OSError):
+    pyvips = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# SIMD base64 from pybase64 when installed, stdlib otherwise
+try:
+    from pybase64 import b64encode_as_string as _b64encode, b64decode as _b64decode
+except ImportError:
+    def _b64encode(data):
+        return base64.b64encode(data).decode("ascii")
+    
+    _b64decode = base64.b64decode
+
 
 def render_image_chat():
     """Image Chat Mode - Analyze images with AI assistant"""
     try:
-        # Handle image upload and session initialization
-        _handle_image_upload_section(st.session_state.current_session)
+        # Handle image upload and session initialization; resolves the image once per rerun
+        display_image_data = _handle_image_upload_section(st.session_state.current_session)
         
         # Display image preview if available
-        display_image_data = _get_current_image_data(st.session_state.current_session)
         if display_image_data:
             _display_image_preview(display_image_data)
         
@@ -30,6 +85,11 @@ def render_image_chat():
         else:
             _display_chat_history(st.session_state.current_session, display_image_data)
         
+        # Background saves report failures on the next run
+        save_error = pop_save_error(st.session_state.current_session)
+        if save_error:
+            st.warning("⚠️ Could not save the image to storage. It may not be available after a restart.")
+        
         # Handle user input if image is loaded
         if display_image_data:
             user_input = st.chat_input("Ask about the image...")
@@ -42,23 +102,25 @@ def render_image_chat():
 
 
 def _handle_image_upload_section(current_session_id):
-    """Handle image file upload section with error handling"""
+    """Handle image file upload section with error handling; returns the current image bytes"""
     st.subheader("🖼️ Upload Image")
     
     try:
         _initialize_image_session_data(current_session_id)
         
+        # Pending upload first, then the session's stored image
         current_image_data = _get_current_image_data(current_session_id)
-        has_temp_image = hasattr(st.session_state, 'temp_image_data') and st.session_state.temp_image_data is not None
         
-        if not current_image_data and not has_temp_image:
+        if not current_image_data:
             _show_image_uploader()
         else:
             # Display file info if image is loaded
             _display_image_file_info(current_session_id)
+        return current_image_data
             
     except Exception as e:
         st.error(f"❌ Error in upload section: {str(e)}")
+        return None
 
 
 def _display_image_file_info(current_session_id):
@@ -90,10 +152,10 @@ def _initialize_image_session_data(current_session_id):
                 'loaded': True
             }
             
-            # Load actual image data
+            # Load actual image data; kept decoded so reruns never decode it again
             current_image_data = load_session_file_data(current_session_id, 'image')
             if current_image_data:
-                st.session_state.session_data[current_session_id]['image_data'] = current_image_data
+                st.session_state.session_data[current_session_id]['image_bytes'] = _decode_image_data(current_image_data)
                 st.success("✅ Image initialized from API")
             else:
                 st.warning("⚠️ Image data not found in storage")
@@ -135,28 +197,30 @@ def _show_image_uploader():
             with st.spinner("🖼️ Processing image..."):
                 try:
                     image_bytes = uploaded_image.read()
+                    image_name = uploaded_image.name
+                    image_type = uploaded_image.type
+                    # Identifies the stored image; repeat uploads of the same file reuse cached work
+                    digest = _digest_hex(image_bytes)
                     
                     # Compress image if larger than 2MB for better performance
                     if file_size > 2:
                         st.info("🔄 Compressing image for better performance...")
-                        image_bytes = _compress_image_data(image_bytes, uploaded_image.type)
-                    
-                    encoded_image = base64.b64encode(image_bytes).decode("utf-8")
+                        image_bytes, image_type, digest = _compress_upload(digest, image_type, image_bytes)
+                        if image_type == 'image/webp':
+                            image_name = os.path.splitext(image_name)[0] + '.webp'
                     
                     # Store file information
                     file_info = {
-                        'file_name': uploaded_image.name,
+                        'file_name': image_name,
                         'size_bytes': uploaded_image.size,
                         'size_mb': file_size,
-                        'format': uploaded_image.type,
+                        'format': image_type,
+                        'digest': digest,
                         'upload_timestamp': datetime.now().isoformat()
                     }
                     
-                    # Store temporary data
-                    st.session_state.temp_image_data = encoded_image
-                    st.session_state.temp_file_info = file_info
-                    st.session_state.uploaded_image_name = uploaded_image.name
-                    st.session_state.original_file_size = file_size
+                    # Store temporary data as raw bytes; base64 is only built when sending
+                    st.session_state.pending_upload = PendingUpload(image_bytes, file_info, digest)
                     
                     st.success("✅ Image uploaded successfully!")
                     st.rerun()
@@ -169,75 +233,147 @@ def _show_image_uploader():
         st.error(f"❌ Upload error: {str(e)}")
 
 
+def _digest_hex(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _compress_upload(digest, image_type, _image_bytes):
+    """_compress_image_data cached by the upload's digest; returns (bytes, mime type, digest)"""
+    compressed_bytes, output_type = _compress_image_data(_image_bytes, image_type)
+    if compressed_bytes is _image_bytes:
+        return compressed_bytes, output_type, digest
+    return compressed_bytes, output_type, _digest_hex(compressed_bytes)
+
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def _encode_for_api(digest, _image_bytes):
+    """Base64 payload for an image, encoded once and reused by every follow-up question
+
+    The string is immutable, so it is shared rather than copied out of the cache.
+    """
+    return _b64encode(_image_bytes)
+
+
+def _image_digest(session_id, image_bytes):
+    """Digest of the session's image, from its file_info; older records get one computed once"""
+    entry = st.session_state.session_data.get(session_id) or {}
+    file_info = entry.get('file_info')
+    if file_info is None:
+        return _digest_hex(image_bytes)
+    if 'digest' not in file_info:
+        file_info['digest'] = _digest_hex(image_bytes)
+    return file_info['digest']
+
+
 def _compress_image_data(image_bytes, image_type, max_size_mb=2):
-    """Compress image data to reduce file size"""
+    """Compress image data to reduce file size; returns (bytes, mime type)"""
     try:
-        from PIL import Image
-        import io
-        
-        # Open image from bytes
-        image = Image.open(io.BytesIO(image_bytes))
-        
         # Calculate current size
         current_size_mb = len(image_bytes) / (1024 * 1024)
         
         if current_size_mb <= max_size_mb:
-            return image_bytes  # No compression needed
+            return image_bytes, image_type  # No compression needed
             
-        # Determine output format and quality
-        if image_type in ['image/jpeg', 'image/jpg']:
-            output_format = 'JPEG'
-            quality = 85  # Reduce quality for JPEG
-        elif image_type == 'image/png':
-            output_format = 'PNG'
-            quality = 95  # PNG compression is different
+        # Format kept for images lossy WebP would harm (palette or transparency)
+        if image_type == 'image/png':
+            fallback_format = 'PNG'
         elif image_type == 'image/webp':
-            output_format = 'WEBP'
-            quality = 85
+            fallback_format = 'WEBP'
         else:
-            output_format = 'JPEG'  # Default to JPEG
-            quality = 85
+            fallback_format = 'JPEG'  # Default to JPEG
         
-        # Compress image
-        output_buffer = io.BytesIO()
-        
-        # For very large images, resize if necessary
-        max_dimension = 2048
-        if max(image.size) > max_dimension:
-            ratio = max_dimension / max(image.size)
-            new_size = (int(image.size[0] * ratio), int(image.size[1] * ratio))
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
-            st.info(f"📐 Resized image to {new_size[0]}x{new_size[1]} for better performance")
-        
-        # Save with compression
-        if output_format == 'PNG':
-            image.save(output_buffer, format=output_format, optimize=True)
-        else:
-            image.save(output_buffer, format=output_format, quality=quality, optimize=True)
-        
-        compressed_bytes = output_buffer.getvalue()
+        # libvips when installed, otherwise Pillow
+        compressed = _compress_with_vips(image_bytes, fallback_format)
+        if compressed is None:
+            compressed = _compress_with_pil(image_bytes, fallback_format)
+        compressed_bytes, output_format = compressed
         compressed_size_mb = len(compressed_bytes) / (1024 * 1024)
         
-        print(f"📊 Image compressed: {current_size_mb:.1f}MB → {compressed_size_mb:.1f}MB")
+        logger.debug("📊 Image compressed (%s): %.1fMB → %.1fMB", output_format, current_size_mb, compressed_size_mb)
         
-        return compressed_bytes
+        return compressed_bytes, FORMAT_MIME_TYPES[output_format]
         
-    except Exception as e:
-        print(f"❌ Image compression error: {e}")
-        return image_bytes  # Return original if compression fails
+    except Exception:
+        logger.exception("❌ Image compression error")
+        return image_bytes, image_type  # Return original if compression fails
+
+
+def _compress_with_vips(image_bytes, fallback_format):
+    """Shrink and re-encode in one libvips pipeline; returns None when pyvips is unavailable"""
+    if pyvips is None:
+        return None
+    
+    # Header only; pixels are not decoded here
+    original = pyvips.Image.new_from_buffer(image_bytes, "")
+    keeps_format = original.hasalpha() or original.get_typeof("palette-bit-depth") != 0
+    
+    # Shrink-on-load: JPEGs are reduced at the DCT level before any resampling
+    image = pyvips.Image.thumbnail_buffer(
+        image_bytes, MAX_IMAGE_DIMENSION, height=MAX_IMAGE_DIMENSION, size='down'
+    )
+    if max(original.width, original.height) > MAX_IMAGE_DIMENSION:
+        st.info(f"📐 Resized image to {image.width}x{image.height} for better performance")
+    
+    if not keeps_format or fallback_format == 'WEBP':
+        return image.webpsave_buffer(Q=WEBP_QUALITY, effort=4, strip=True), 'WEBP'
+    if fallback_format == 'PNG':
+        return image.pngsave_buffer(compression=6, strip=True), 'PNG'
+    return image.jpegsave_buffer(Q=85, optimize_coding=True, strip=True, interlace=True), 'JPEG'
+
+
+def _has_transparency(image):
+    """Palette images and images whose alpha channel is not fully opaque"""
+    if image.mode in ('P', 'LA', 'PA'):
+        return True
+    if image.mode == 'RGBA':
+        return image.getchannel('A').getextrema()[0] < 255
+    return False
+
+
+def _compress_with_pil(image_bytes, fallback_format):
+    """Decode, resize and re-encode with Pillow"""
+    if Image is None:
+        raise RuntimeError("Pillow is not installed")
+    
+    # Open image from bytes
+    image = Image.open(io.BytesIO(image_bytes))
+    output_format = fallback_format if _has_transparency(image) else 'WEBP'
+    
+    # Compress image
+    output_buffer = io.BytesIO()
+    
+    # For very large images, resize if necessary
+    if max(image.size) > MAX_IMAGE_DIMENSION:
+        ratio = MAX_IMAGE_DIMENSION / max(image.size)
+        new_size = (int(image.size[0] * ratio), int(image.size[1] * ratio))
+        image = image.resize(new_size, Image.Resampling.LANCZOS)
+        st.info(f"📐 Resized image to {new_size[0]}x{new_size[1]} for better performance")
+    
+    # Save with compression
+    if output_format == 'PNG':
+        image.save(output_buffer, format=output_format, optimize=True)
+    elif output_format == 'WEBP':
+        image.save(output_buffer, format=output_format, quality=WEBP_QUALITY, method=4)
+    else:
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(output_buffer, format=output_format, quality=85, optimize=True, progressive=True)
+    
+    return output_buffer.getvalue(), output_format
 
 
 def _get_current_image_data(current_session_id):
-    """Get current image data from session data or temporary storage"""
+    """Get current image bytes from session data or temporary storage"""
     try:
         # First check temporary data (for current session)
-        temp_image_data = getattr(st.session_state, 'temp_image_data', None)
-        if temp_image_data is not None:
-            return temp_image_data
+        pending = st.session_state.get('pending_upload')
+        if pending is not None:
+            return pending.image_bytes
             
         # Then check session data
         if current_session_id and current_session_id in st.session_state.session_data:
-            return st.session_state.session_data[current_session_id].get('image_data')
+            return st.session_state.session_data[current_session_id].get('image_bytes')
         
         return None
     except Exception as e:
@@ -245,45 +381,63 @@ def _get_current_image_data(current_session_id):
         return None
 
 
-def _get_image_data_for_analysis(session_id):
-    """Get image data for analysis"""
+def _decode_image_data(image_data):
+    """Turn stored image data (base64, data URL or file record) into raw bytes"""
+    if isinstance(image_data, dict):
+        image_data = image_data.get('data', image_data.get('image_data', ''))
+    if isinstance(image_data, (bytes, bytearray)):
+        return bytes(image_data)
+    if image_data.startswith('data:image'):
+        image_data = image_data.split(',', 1)[1]
+    return _b64decode(image_data)
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _preview_image(digest, _image_bytes):
+    """Bytes for the preview, built once per image: a downscaled copy when the image is large
+
+    st.image hashes and serves whatever it is given on every rerun, so a smaller copy
+    keeps that work small; without Pillow the original is shown.
+    """
+    if Image is None:
+        return _image_bytes
     try:
-        # First check temporary data (for current session)
-        temp_image_data = getattr(st.session_state, 'temp_image_data', None)
-        if temp_image_data is not None:
-            return temp_image_data
-            
-        if session_id and session_id in st.session_state.session_data:
-            return st.session_state.session_data[session_id].get('image_data')
+        image = Image.open(io.BytesIO(_image_bytes))
+        if max(image.size) <= PREVIEW_MAX_DIMENSION:
+            return _image_bytes
         
-        return None
-    except Exception as e:
-        print(f"❌ Error getting image data for analysis: {e}")
-        return None
+        image.thumbnail((PREVIEW_MAX_DIMENSION, PREVIEW_MAX_DIMENSION))
+        output_buffer = io.BytesIO()
+        if _has_transparency(image):
+            image.save(output_buffer, format='PNG')
+        else:
+            image.convert('RGB').save(output_buffer, format='JPEG', quality=85)
+        return output_buffer.getvalue()
+    except Exception:
+        logger.exception("❌ Error building image preview")
+        return _image_bytes
 
 
-def _display_image_preview(image_data):
+def _display_image_preview(image_bytes):
     """Display image preview with success message"""
     try:
         st.success("✅ Image loaded!")
         
-        if isinstance(image_data, dict):
-            image_base64 = image_data.get('data', image_data.get('image_data', image_data))
-        else:
-            image_base64 = image_data
-        
-        if isinstance(image_base64, str):
-            if not image_base64.startswith('data:image'):
-                image_base64 = f"data:image/jpeg;base64,{image_base64}"
+        if isinstance(image_bytes, bytes):
+            pending = st.session_state.get('pending_upload')
+            if pending is not None:
+                digest = pending.digest
+            else:
+                digest = _image_digest(st.session_state.current_session, image_bytes)
             
             # Display image with responsive sizing
-            st.image(image_base64, use_container_width=True, caption="Uploaded Image Preview")
+            st.image(_preview_image(digest, image_bytes), use_container_width=True, caption="Uploaded Image Preview")
             
             # Show file size info if available
-            original_size = getattr(st.session_state, 'original_file_size', None)
-            if original_size:
-                current_size = len(image_base64) / (1024 * 1024) * 0.75  # Approximate base64 size
-                st.caption(f"📊 File size: {original_size:.1f}MB → {current_size:.1f}MB (base64)")
+            if pending is not None:
+                original_size = pending.file_info['size_mb']
+                current_size = len(image_bytes) / (1024 * 1024)
+                st.caption(f"📊 File size: {original_size:.1f}MB → {current_size:.1f}MB")
         else:
             st.error("❌ Invalid image data format")
             
@@ -293,6 +447,14 @@ def _display_image_preview(image_data):
     st.info("💡 **Tip**: Click 'New Chat' in sidebar to chat with a different image")
 
 
+def _image_messages():
+    """current_messages as a bounded deque; other modes and resets may leave a plain list"""
+    messages = st.session_state.get("current_messages")
+    if not isinstance(messages, deque) or messages.maxlen != MAX_MESSAGES:
+        messages = st.session_state.current_messages = deque(messages or (), maxlen=MAX_MESSAGES)
+    return messages
+
+
 def _display_chat_history(current_session_id, display_image_data):
     """Display chat messages from session state"""
     try:
@@ -323,7 +485,7 @@ def _load_messages_from_api(session_id):
     try:
         db_messages = api_client.get_session_messages(session_id)
         if db_messages:
-            st.session_state.current_messages = db_messages
+            st.session_state.current_messages = deque(db_messages, maxlen=MAX_MESSAGES)
             st.session_state.last_session_id = session_id
             print(f"✅ Loaded {len(db_messages)} messages from API")
         else:
@@ -354,7 +516,7 @@ def _show_chat_placeholder(display_image_data):
 def _process_user_message(user_input, current_session_id, display_image_data):
     """Process user message and generate AI response"""
     try:
-        current_time = datetime.now()
+        user_iso, user_display = _ts()
         
         # Validate input
         if not user_input or not user_input.strip():
@@ -367,12 +529,9 @@ def _process_user_message(user_input, current_session_id, display_image_data):
         
         # Display user message
         with st.chat_message("user"):
-            st.caption(f"🕒 {current_time.strftime('%H:%M • %b %d, %Y')}")
+            st.caption(f"🕒 {user_display}")
             st.markdown(user_input)
         
-        # Auto-scroll to bottom
-        _auto_scroll_to_bottom()
-        
         # Ensure session exists
         session_id = _ensure_session_exists(user_input, current_session_id, display_image_data)
         if not session_id:
@@ -380,7 +539,7 @@ def _process_user_message(user_input, current_session_id, display_image_data):
             return
         
         # Generate AI response
-        _generate_ai_response(user_input, session_id, current_time)
+        _generate_ai_response(user_input, session_id, user_iso, display_image_data)
         
     except Exception as e:
         st.error(f"❌ Error processing message: {str(e)}")
@@ -418,33 +577,29 @@ def _create_new_image_session(user_input, display_image_data):
         print(f"🆕 Created image session: {chat_id}")
         
         # Save image data
-        if hasattr(st.session_state, 'temp_image_data'):
-            image_data = st.session_state.temp_image_data
-            file_info = getattr(st.session_state, 'temp_file_info', {})
-            image_name = st.session_state.uploaded_image_name
+        pending = st.session_state.get('pending_upload')
+        if pending is not None:
+            image_bytes, file_info, digest = pending
+            image_name = file_info['file_name']
             
             print(f"💾 Saving image to API for new session: {chat_id}")
             
-            # Extract base64 from data URL if needed
-            if image_data.startswith('data:image'):
-                image_data = image_data.split(',')[1]
-            
-            # Save file info to API
-            _save_image_info_to_api(chat_id, file_info)
-            
-            # Save actual image data
-            result = save_session_file_data(chat_id, 'image', image_data, image_name)
-            print(f"💾 Save session file result: {result is not None}")
+            # Metadata and the raw image bytes are saved off the render path,
+            # so the first analysis request does not wait for them
+            queue_session_files_save(chat_id, [
+                ('image_info', file_info, f"{image_name}_info"),
+                ('image', image_bytes, image_name)
+            ])
             
             # Update session data
             st.session_state.session_data[chat_id] = {
-                'image_data': image_data,
+                'image_bytes': image_bytes,
                 'file_info': file_info,
                 'loaded': True
             }
             
             # Clean up temporary data
-            _cleanup_temp_image_data()
+            st.session_state.pending_upload = None
         
         return chat_id
         
@@ -454,37 +609,12 @@ def _create_new_image_session(user_input, display_image_data):
         return None
 
 
-def _save_image_info_to_api(session_id, file_info):
-    """Save image metadata to API"""
-    try:
-        image_name = getattr(st.session_state, 'uploaded_image_name', "uploaded_image")
-        
-        print(f"💾 Saving image info to API for session: {session_id}")
-        
-        # Save metadata
-        result = save_session_file_data(session_id, 'image_info', file_info, f"{image_name}_info")
-        print(f"💾 Save image info result: {result is not None}")
-                
-    except Exception as e:
-        print(f"❌ Error saving image info: {e}")
-
-
-def _cleanup_temp_image_data():
-    """Clean up temporary image data after session creation"""
-    try:
-        for key in ['temp_image_data', 'temp_file_info', 'uploaded_image_name', 'original_file_size']:
-            if hasattr(st.session_state, key):
-                delattr(st.session_state, key)
-    except Exception as e:
-        print(f"❌ Error cleaning up temp data: {e}")
-
-
-def _generate_ai_response(user_input, session_id, current_time):
+def _generate_ai_response(user_input, session_id, user_iso, image_bytes):
     """Generate AI response using backend API with comprehensive error handling"""
     with st.chat_message("assistant"):
         try:
-            response_time = datetime.now()
-            st.caption(f"🕒 {response_time.strftime('%H:%M • %b %d, %Y')}")
+            response_iso, response_display = _ts()
+            st.caption(f"🕒 {response_display}")
             
             message_placeholder = st.empty()
             full_response = ""
@@ -494,49 +624,37 @@ def _generate_ai_response(user_input, session_id, current_time):
             
             # Prepare chat history
             try:
-                chat_history = prepare_chat_history_for_api(st.session_state.current_messages)
+                chat_history = get_chat_history_for_api(st.session_state.current_messages)
                 print(f"📝 Prepared chat history: {len(chat_history)} messages")
             except Exception as e:
                 st.error("❌ Error preparing conversation history")
                 chat_history = []
             
-            # Get image data for analysis
-            image_data = _get_image_data_for_analysis(session_id)
-            if not image_data:
+            if not image_bytes:
                 st.error("❌ No image data available for analysis")
                 error_msg = "I couldn't access the image for analysis. Please try uploading again."
-                _update_chat_history(user_input, error_msg, current_time, response_time)
+                _update_chat_history(user_input, error_msg, user_iso, response_iso)
                 return
             
             # Check image size for processing
-            image_size = len(image_data)
-            if image_size > 5 * 1024 * 1024:  # 5MB base64
+            image_size = len(image_bytes)
+            if image_size > 4 * 1024 * 1024:  # ~5MB once base64 encoded
                 st.warning("⚠️ Large image detected. Analysis may take longer than usual.")
             
             # Call API with timeout handling
             try:
-                response = api_client.stream_image_chat(user_input, image_data, chat_history)
+                response = _stream_image_chat(user_input, image_bytes, chat_history, session_id)
                 
                 if response and response.status_code == 200:
                     # Process streaming response
                     try:
-                        for chunk in response.iter_content(decode_unicode=True, chunk_size=1024):
-                            if chunk:
-                                full_response += chunk
-
-                                message_placeholder.markdown(full_response + "▌")
-                        
-                        message_placeholder.markdown(full_response)
+                        full_response = stream_api_response(response, message_placeholder)
                         
                         # Validate response
                         if not full_response.strip():
                             full_response = "I received an empty response. Please try again."
                             message_placeholder.markdown(full_response)
                             
-                    except UnicodeDecodeError as e:
-                        st.error("❌ Encoding error in response stream")
-                        full_response = "I encountered an encoding error. Please try again."
-                        message_placeholder.markdown(full_response)
                     except Exception as e:
                         st.error("❌ Error reading response stream")
                         full_response = "I encountered an error while processing the response. Please try again."
@@ -564,14 +682,41 @@ def _generate_ai_response(user_input, session_id, current_time):
                 message_placeholder.markdown(full_response)
             
             # Update chat history
-            _update_chat_history(user_input, full_response, current_time, response_time)
-            _auto_scroll_to_bottom()
+            _update_chat_history(user_input, full_response, user_iso, response_iso)
             
         except Exception as e:
             # Critical error handling
-            st.caption(f"🕒 {datetime.now().strftime('%H:%M • %b %d, %Y')}")
             st.error("A critical error occurred during image analysis.")
-            _handle_response_error(user_input, session_id, current_time, e)
+            _handle_response_error(user_input, session_id, user_iso, e)
+
+
+def _stream_image_chat(user_input, image_bytes, chat_history, session_id):
+    """Start the image chat stream, uploading the image only when the server doesn't have it"""
+    digest = _image_digest(session_id, image_bytes)
+    if not IMAGE_UPLOAD_BINARY:
+        return api_client.stream_image_chat(user_input, _encode_for_api(digest, image_bytes), chat_history, session_id)
+    
+    entry = st.session_state.session_data.setdefault(session_id, {})
+    mime_type = (entry.get('file_info') or {}).get('format') or 'image/jpeg'
+    response = None
+    for attempt in range(2):
+        if entry.get('image_version_sent') != digest:
+            if not api_client.ensure_image(session_id, image_bytes, mime_type, digest):
+                return None
+            entry['image_version_sent'] = digest
+        
+        response = api_client.stream_image_chat(user_input, None, chat_history, session_id, image_version=digest)
+        if response is None or response.status_code != 409:
+            return response
+        # Server lost its copy (e.g. restarted); upload again and retry once
+        entry.pop('image_version_sent', None)
+    return response
+
+
+def _ts():
+    """(ISO timestamp, caption text) for now, formatted once per event"""
+    now = datetime.now()
+    return now.isoformat(), now.strftime(TS_FMT)
 
 
 def _get_http_error_message(status_code):
@@ -590,35 +735,32 @@ def _get_http_error_message(status_code):
     return error_messages.get(status_code, f"❌ Request failed with status {status_code}")
 
 
-def _update_chat_history(user_input, ai_response, user_time, ai_time):
+def _update_chat_history(user_input, ai_response, user_iso, ai_iso):
     """Update chat history in session state and save to database"""
     try:
-        # Add new messages to session state
-        new_messages = st.session_state.current_messages + [
+        new_entries = [
             {
                 "role": "user", 
                 "content": user_input,
-                "timestamp": user_time.isoformat()
+                "timestamp": user_iso
             },
             {
                 "role": "assistant", 
                 "content": ai_response,
-                "timestamp": ai_time.isoformat()
+                "timestamp": ai_iso
             }
         ]
         
-        # Limit message history (keep last 40 messages)
-        if len(new_messages) > 40:
-            new_messages = new_messages[-40:]
-            print(f"ℹ️ Truncated chat history to 40 messages")
-        
-        # Update session state
-        st.session_state.current_messages = new_messages
+        # The deque's maxlen limits message history; appending in place lets the
+        # prepared API history only prepare the new entries
+        messages = _image_messages()
+        messages.extend(new_entries)
+        extend_chat_history_cache(messages, new_entries)
         
         # Save to database
         try:
-            save_current_session(new_messages)
-            print(f"💾 Saved {len(new_messages)} messages to database")
+            save_current_session(list(messages))
+            print(f"💾 Saved {len(messages)} messages to database")
         except Exception as e:
             st.error("❌ Error saving conversation. Your messages may not be persisted.")
             print(f"❌ Database save error: {e}")
@@ -628,34 +770,36 @@ def _update_chat_history(user_input, ai_response, user_time, ai_time):
         print(f"❌ Chat history update error: {e}")
 
 
-def _handle_response_error(user_input, session_id, current_time, error):
+def _handle_response_error(user_input, session_id, user_iso, error):
     """Handle errors during response generation"""
     try:
         error_msg = f"❌ **System Error**: {str(error)}"
-        error_time = datetime.now()
+        error_iso, error_display = _ts()
         
-        st.caption(f"🕒 {error_time.strftime('%H:%M • %b %d, %Y')}")
+        st.caption(f"🕒 {error_display}")
         st.error("An unexpected error occurred. Our team has been notified.")
         
         # Update session state with error message
-        new_messages = st.session_state.current_messages + [
+        new_entries = [
             {
                 "role": "user", 
                 "content": user_input,
-                "timestamp": current_time.isoformat()
+                "timestamp": user_iso
             },
             {
                 "role": "assistant", 
                 "content": error_msg,
-                "timestamp": error_time.isoformat()
+                "timestamp": error_iso
             }
         ]
         
-        st.session_state.current_messages = new_messages
+        messages = _image_messages()
+        messages.extend(new_entries)
+        extend_chat_history_cache(messages, new_entries)
         
         # Save to database
         try:
-            save_current_session(new_messages)
+            save_current_session(list(messages))
         except Exception as save_error:
             print(f"❌ Failed to save error messages: {save_error}")
             
@@ -663,18 +807,3 @@ def _handle_response_error(user_input, session_id, current_time, error):
         print(f"❌ Critical error in error handling: {e}")
         st.session_state.current_messages = []
         st.error("A critical error occurred. Please refresh the page.")
-
-
-def _auto_scroll_to_bottom():
-    """Force scroll to bottom of the chat container"""
-    st.markdown(
-        """
-        <script>
-        var chatContainer = window.parent.document.querySelector('[data-testid="stChatMessageContainer"]');
-        if (chatContainer) {
-            chatContainer.scrollTop = chatContainer.scrollHeight;
-        }
-        </script>
-        """,
-        unsafe_allow_html=True
-    )
\ No newline at end of file
@@ -1,4 +1,7 @@
+import logging
+import os
 import streamlit as st
+from collections import OrderedDict
 from dotenv import load_dotenv
 from components.sidebar import render_sidebar
 from core_chat import render_core_chat
@@ -8,12 +11,17 @@ from utils.database_setup import setup_database_tables
 
 # === Setup ===
 load_dotenv()
+# Configured once; at the default INFO level, debug messages are never formatted
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
 st.set_page_config(page_title="Gemini Chat", layout="wide")
 setup_database_tables()
 
 # === Session state init ===
 if "all_sessions" not in st.session_state:
-    st.session_state.all_sessions = {}
+    st.session_state.all_sessions = OrderedDict()
 if "current_session" not in st.session_state:
     st.session_state.current_session = None
 if "show_new_chat" not in st.session_state:
@@ -27,28 +35,18 @@ if "session_data" not in st.session_state:
 render_sidebar()
 
 # === Main UI ===
-mode_titles = {
-    "core": "💬 Core Chat",
-    "image": "🖼️ Image Chat", 
-    "csv": "📊 CSV Chat"
-}
-
-mode_descriptions = {
-    "core": "Multi-turn text conversations with full history",
-    "image": "Upload and ask questions about images", 
-    "csv": "Analyze and query CSV data files"
+# Mode -> (title, description, renderer)
+MODES = {
+    "core": ("💬 Core Chat", "Multi-turn text conversations with full history", render_core_chat),
+    "image": ("🖼️ Image Chat", "Upload and ask questions about images", render_image_chat),
+    "csv": ("📊 CSV Chat", "Analyze and query CSV data files", render_csv_chat)
 }
 
 if st.session_state.current_session is not None or st.session_state.show_new_chat:
-    st.subheader(mode_titles[st.session_state.current_mode])
-    st.caption(mode_descriptions[st.session_state.current_mode])
-
-    if st.session_state.current_mode == "core":
-        render_core_chat()
-    elif st.session_state.current_mode == "image":
-        render_image_chat()
-    elif st.session_state.current_mode == "csv":
-        render_csv_chat()
+    title, description, render_mode = MODES[st.session_state.current_mode]
+    st.subheader(title)
+    st.caption(description)
+    render_mode()
 else:
     st.info("👈 Select a chat from the sidebar or create a new one to get started!")
 
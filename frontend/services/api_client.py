@@ -1,60 +1,221 @@
+import logging
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import streamlit as st
-import json
-from typing import Dict
+import orjson
+import gzip
+import pandas as pd
+import pyarrow as pa
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+ARROW_STREAM_TYPE = "application/vnd.apache.arrow.stream"
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+GZIP_JSON_HEADERS = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+# File payloads (base64 images, Parquet, metadata) larger than this are gzipped on the wire
+GZIP_MIN_BYTES = 64_000
+
+# Full message histories kept for ETag revalidation, least recently used evicted first
+MESSAGE_CACHE_SIZE = 32
+
+def _pooled_session():
+    """One keep-alive connection pool shared by every call (and every browser session)"""
+    session = requests.Session()
+    # Retry connection failures, and gateway errors for idempotent methods only;
+    # POSTs are never resent after reaching the server
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=2,
+            read=0,
+            status=2,
+            status_forcelist=(502, 503, 504),
+            raise_on_status=False,
+            backoff_factor=0.2
+        )
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Accept"] = "application/json"
+    return session
+
+def _widen_for_upload(dataframe):
+    """Plain analysis dtypes for the backend: int64 integers and decoded categoricals
+
+    The UI keeps narrow integers to save memory, but the agent's arithmetic on
+    int8/int16 would overflow; categoricals would reach it as Arrow dictionaries.
+    """
+    widen = {}
+    for col, dtype in dataframe.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            widen[col] = dtype.categories.dtype
+        elif pd.api.types.is_integer_dtype(dtype) and getattr(dtype, "itemsize", 8) < 8:
+            widen[col] = "int64"
+    return dataframe.astype(widen) if widen else dataframe
+
+def _json(response):
+    """Decode a JSON response body with orjson, skipping requests' charset detection"""
+    return orjson.loads(response.content)
+
 class APIClient:
     def __init__(self, base_url="http://localhost:8000/api/v1"):
         self.base_url = base_url
+        self.http = _pooled_session()
+        # session_id -> (etag, messages) for full-history fetches, and known message counts;
+        # the background save worker shares these, hence the lock
+        self._messages = OrderedDict()
+        self._message_counts = {}
+        self._cache_lock = threading.Lock()
+    
+    def _post_json(self, url, payload, compress=False, **kwargs):
+        """POST a JSON body encoded with orjson instead of requests' stdlib json
+        
+        With compress=True, bodies over GZIP_MIN_BYTES are sent gzipped.
+        """
+        body = orjson.dumps(payload)
+        if compress and len(body) > GZIP_MIN_BYTES:
+            # Level 1: most of the size win for a fraction of the CPU
+            return self.http.post(url, data=gzip.compress(body, compresslevel=1), headers=GZIP_JSON_HEADERS, **kwargs)
+        return self.http.post(url, data=body, headers=JSON_HEADERS, **kwargs)
+    
+    def _cache_messages(self, session_id, etag, messages):
+        with self._cache_lock:
+            self._message_counts[session_id] = len(messages)
+            if etag:
+                self._messages[session_id] = (etag, messages)
+                self._messages.move_to_end(session_id)
+                while len(self._messages) > MESSAGE_CACHE_SIZE:
+                    self._messages.popitem(last=False)
+    
+    def _count_added(self, session_id, added):
+        """Keep a known message count in step with messages this client stored"""
+        with self._cache_lock:
+            if added is None:
+                # Unknown outcome: recount from the server next time
+                self._message_counts.pop(session_id, None)
+            elif session_id in self._message_counts:
+                self._message_counts[session_id] += added
+    
+    def _forget_session(self, session_id):
+        with self._cache_lock:
+            self._messages.pop(session_id, None)
+            self._message_counts.pop(session_id, None)
     
     def create_session(self, session_data):
         """Create new chat session"""
         try:
-            response = requests.post(f"{self.base_url}/sessions", json=session_data)
+            response = self._post_json(f"{self.base_url}/sessions", session_data)
             response.raise_for_status()
-            return response.json()
+            return _json(response)
         except Exception as e:
-            print(f"API Error creating session: {e}")
+            logger.error("API Error creating session: %s", e)
             return None
     
-    def get_session_messages(self, session_id):
-        """Get messages for a session"""
+    def get_session_messages(self, session_id, limit=None, before_id=None):
+        """Get messages for a session; pass limit (and before_id) to fetch one page"""
         try:
-            response = requests.get(f"{self.base_url}/sessions/{session_id}/messages")
+            params = {}
+            if limit is not None:
+                params["limit"] = limit
+            if before_id is not None:
+                params["before_id"] = before_id
+            if params:
+                # Pages are not cached; only whole histories are revalidated
+                response = self.http.get(f"{self.base_url}/sessions/{session_id}/messages", params=params)
+                response.raise_for_status()
+                return _json(response)
+            
+            with self._cache_lock:
+                cached = self._messages.get(session_id)
+            response = self.http.get(
+                f"{self.base_url}/sessions/{session_id}/messages",
+                headers={"If-None-Match": cached[0]} if cached else None
+            )
+            if response.status_code == 304 and cached:
+                self._cache_messages(session_id, cached[0], cached[1])
+                return cached[1]
             response.raise_for_status()
-            return response.json()
+            messages = _json(response)
+            self._cache_messages(session_id, response.headers.get("ETag"), messages)
+            return messages
         except Exception as e:
-            print(f"API Error getting messages: {e}")
+            logger.error("API Error getting messages: %s", e)
             return []
     
+    def get_message_count(self, session_id):
+        """Number of stored messages for a session; no request once the count is known"""
+        with self._cache_lock:
+            count = self._message_counts.get(session_id)
+        if count is not None:
+            return count
+        return len(self.get_session_messages(session_id))
+    
     def add_message(self, session_id, message_data):
         """Add message to session"""
         try:
-            response = requests.post(f"{self.base_url}/sessions/{session_id}/messages", json=message_data)
+            response = self._post_json(f"{self.base_url}/sessions/{session_id}/messages", message_data)
             response.raise_for_status()
-            return response.json()
+            self._count_added(session_id, 1)
+            return _json(response)
         except Exception as e:
-            print(f"API Error adding message: {e}")
+            logger.error("API Error adding message: %s", e)
+            self._count_added(session_id, None)
+            return None
+    
+    def add_messages(self, session_id, messages):
+        """Add several messages to session in one request"""
+        try:
+            response = self._post_json(
+                f"{self.base_url}/sessions/{session_id}/messages/bulk",
+                {"messages": messages}
+            )
+            if response.status_code == 404 and _json(response).get("detail") == "Not Found":
+                # Older server without the bulk route (not a missing session): one request per message
+                results = [self.add_message(session_id, message) for message in messages]
+                return None if None in results else results
+            response.raise_for_status()
+            self._count_added(session_id, len(messages))
+            return _json(response)
+        except Exception as e:
+            logger.error("API Error adding messages: %s", e)
+            self._count_added(session_id, None)
             return None
     
     def delete_session(self, session_id):
         """Delete session"""
+        self._forget_session(session_id)
         try:
-            response = requests.delete(f"{self.base_url}/sessions/{session_id}")
+            response = self.http.delete(f"{self.base_url}/sessions/{session_id}")
             response.raise_for_status()
-            return response.json()
+            return _json(response)
         except Exception as e:
-            print(f"API Error deleting session: {e}")
+            logger.error("API Error deleting session: %s", e)
             return None
     
     def get_all_sessions(self):
-        """Get all sessions"""
+        """Get all sessions; None on error, so a failure is distinguishable from no sessions"""
         try:
-            response = requests.get(f"{self.base_url}/sessions")
+            response = self.http.get(f"{self.base_url}/sessions")
             response.raise_for_status()
-            return response.json()
+            return _json(response)
         except Exception as e:
-            print(f"API Error getting sessions: {e}")
-            return {}
+            logger.error("API Error getting sessions: %s", e)
+            return None
+    
+    def get_sessions_version(self):
+        """Get a cheap token that changes whenever the session list changes"""
+        try:
+            response = self.http.get(f"{self.base_url}/sessions/version")
+            response.raise_for_status()
+            return _json(response).get("version")
+        except Exception as e:
+            logger.error("API Error getting sessions version: %s", e)
+            return None
     
     def save_session_file(self, session_id, file_type, file_data, file_name=None):
         """Save file data for session with storage strategy support"""
@@ -67,136 +228,226 @@ class APIClient:
             }
             
             
-            response = requests.post(f"{self.base_url}/sessions/{session_id}/files", json=payload)
+            response = self._post_json(f"{self.base_url}/sessions/{session_id}/files", payload, compress=True)
             response.raise_for_status()
             
-            result = response.json()
-            print(f"💾 API save file success: {file_type} for session {session_id}")
+            result = _json(response)
+            logger.debug("💾 API save file success: %s for session %s", file_type, session_id)
             return result
             
         except requests.exceptions.RequestException as e:
-            print(f"❌ API Error saving file {file_type}: {e}")
+            logger.error("❌ API Error saving file %s: %s", file_type, e)
             return None
         except Exception as e:
-            print(f"❌ Unexpected error saving file {file_type}: {e}")
+            logger.error("❌ Unexpected error saving file %s: %s", file_type, e)
+            return None
+
+    def save_session_file_raw(self, session_id, file_type, raw_bytes, mime_type, file_name=None):
+        """Save an image file for session as raw bytes, skipping base64 on the wire"""
+        try:
+            response = self.http.put(
+                f"{self.base_url}/sessions/{session_id}/files/{file_type}/raw",
+                params={"file_name": file_name} if file_name else None,
+                data=raw_bytes,
+                headers={"Content-Type": mime_type},
+                timeout=(3, 120)
+            )
+            response.raise_for_status()
+            
+            result = _json(response)
+            logger.debug("💾 API save file success: %s (%s bytes) for session %s", file_type, len(raw_bytes), session_id)
+            return result
+            
+        except requests.exceptions.RequestException as e:
+            logger.error("❌ API Error saving file %s: %s", file_type, e)
+            return None
+        except Exception as e:
+            logger.error("❌ Unexpected error saving file %s: %s", file_type, e)
+            return None
+
+    def save_session_files_batch(self, session_id, files):
+        """Save several file payloads for session in one request"""
+        try:
+            response = self._post_json(
+                f"{self.base_url}/sessions/{session_id}/files/batch",
+                {"files": files},
+                compress=True
+            )
+            response.raise_for_status()
+            
+            result = _json(response)
+            logger.debug("💾 API save files success: %s files for session %s", len(files), session_id)
+            return result
+            
+        except requests.exceptions.RequestException as e:
+            logger.error("❌ API Error saving files: %s", e)
+            return None
+        except Exception as e:
+            logger.error("❌ Unexpected error saving files: %s", e)
             return None
 
     def get_session_file(self, session_id, file_type):
         """Get file data for session with storage strategy support"""
         try:
-            response = requests.get(f"{self.base_url}/sessions/{session_id}/files/{file_type}")
+            response = self.http.get(f"{self.base_url}/sessions/{session_id}/files/{file_type}")
             
             if response.status_code == 404:
-                print(f"📭 File not found: {file_type} for session {session_id}")
+                logger.debug("📭 File not found: %s for session %s", file_type, session_id)
                 return None
                 
             response.raise_for_status()
             
-            result = response.json()
-            print(f"✅ API get file success: {file_type} for session {session_id}")
+            result = _json(response)
+            logger.debug("✅ API get file success: %s for session %s", file_type, session_id)
             return result
             
         except requests.exceptions.HTTPError as e:
             if response.status_code == 404:
-                print(f"📭 File not found: {file_type} for session {session_id}")
+                logger.debug("📭 File not found: %s for session %s", file_type, session_id)
                 return None
             else:
-                print(f"❌ API HTTP Error getting file {file_type}: {e}")
+                logger.error("❌ API HTTP Error getting file %s: %s", file_type, e)
                 return None
         except requests.exceptions.RequestException as e:
-            print(f"❌ API Connection Error getting file {file_type}: {e}")
+            logger.error("❌ API Connection Error getting file %s: %s", file_type, e)
             return None
         except Exception as e:
-            print(f"❌ Unexpected error getting file {file_type}: {e}")
+            logger.error("❌ Unexpected error getting file %s: %s", file_type, e)
             return None
     
-    def stream_chat(self, user_input, chat_history):
+    def stream_chat(self, user_input, chat_history, session_id=None):
         """Stream chat response from backend - FIXED"""
         try:
             payload = {
                 "user_input": user_input,
                 "chat_history": chat_history, 
+                "session_id": session_id,
             }
 
-            response = requests.post(
+            response = self._post_json(
                 f"{self.base_url}/ai/chat",
-                json=payload,
+                payload,
                 stream=True,
-                timeout=100
+                timeout=(3, 100)
             )
             
             # DEBUG: check response
-            print(f"🔍 API Response status: {response.status_code}")
+            logger.debug("🔍 API Response status: %s", response.status_code)
             if response.status_code != 200:
-                print(f"❌ API Error: {response.text}")
+                logger.error("❌ API Error: %s", response.text)
             
             return response
 
         except Exception as e:
-            print(f"[AIClient] Streaming error: {e}")
+            logger.error("[AIClient] Streaming error: %s", e)
             return None
 
-    def stream_image_chat(self, user_input, image_data, chat_history):
-        """Stream image chat response from backend AI"""
+    def ensure_image(self, session_id, image_bytes, mime_type, version=None):
+        """Upload a session's image once as raw bytes so image chat requests can reference it"""
+        try:
+            response = self.http.put(
+                f"{self.base_url}/ai/images/{session_id}",
+                params={"version": version} if version else None,
+                data=image_bytes,
+                headers={"Content-Type": mime_type},
+                timeout=(3, 120)
+            )
+            response.raise_for_status()
+            return True
+            
+        except Exception as e:
+            logger.error("❌ API Error uploading image: %s", e)
+            return False
+
+    def stream_image_chat(self, user_input, image_data, chat_history, session_id=None, image_version=None):
+        """Stream image chat response from backend AI
+        
+        Pass image_data=None to use the image uploaded with ensure_image; the
+        response is then a 409 if the server no longer has it.
+        """
         try:
             payload = {
                 "user_input": user_input,
                 "image_data": image_data,
-                "chat_history": chat_history
+                "chat_history": chat_history,
+                "session_id": session_id,
+                "image_version": image_version
             }
-            response = requests.post(
+            response = self._post_json(
                 f"{self.base_url}/ai/chat/image", 
-                json=payload, 
+                payload, 
                 stream=True,
-                timeout=120
+                timeout=(3, 120)
             )
             
-            print(f"🔍 API Response status: {response.status_code}")
+            logger.debug("🔍 API Response status: %s", response.status_code)
             if response.status_code != 200:
-                print(f"❌ API Error: {response.text}")
+                logger.error("❌ API Error: %s", response.text)
             
             return response
             
         except Exception as e:
-            print(f"API Error streaming image chat: {e}")
+            logger.error("API Error streaming image chat: %s", e)
             return None
-    def csv_chat(self, query: str, dataframe, session_id: str) -> Dict:
-        """Send CSV analysis request using CSV string format"""
+
+    def ensure_dataset(self, session_id, dataframe, version=None):
+        """Upload a session's dataset once so CSV requests can reference it by session_id"""
         try:
-            # Convert dataframe to CSV string (more reliable)
-            csv_data = ""
-            if dataframe is not None and hasattr(dataframe, 'to_csv'):
-                csv_data = dataframe.to_csv(index=False)
-                print(f"📤 Sending CSV data: {len(csv_data)} characters, {len(dataframe)} rows")
+            # Arrow IPC stream: typed columns, no CSV text round-trip on either side
+            table = pa.Table.from_pandas(_widen_for_upload(dataframe), preserve_index=False)
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            body = sink.getvalue().to_pybytes()
+            logger.debug("📤 Uploading dataset: %s bytes, %s rows", len(body), len(dataframe))
             
+            response = self.http.put(
+                f"{self.base_url}/ai/datasets/{session_id}",
+                params={"version": version} if version else None,
+                data=body,
+                headers={"Content-Type": ARROW_STREAM_TYPE},
+                timeout=(3, 120)
+            )
+            response.raise_for_status()
+            return True
+            
+        except Exception as e:
+            logger.error("❌ API Error uploading dataset: %s", e)
+            return False
+
+    def csv_chat_stream(self, query: str, session_id: str, dataset_version=None):
+        """Stream CSV analysis events: {"type": "status"|"text"|"plots"|"error", ...} dicts
+        
+        The dataset must already be uploaded with ensure_dataset; if the server no
+        longer has it, a single {"type": "dataset_missing"} event is yielded.
+        """
+        try:
             payload = {
                 "enhanced_query": query,
                 "session_id": session_id,
-                "csv_data": csv_data
+                "dataset_version": dataset_version
             }
             
-            response = requests.post(
-                f"{self.base_url}/ai/chat/csv",
-                json=payload,
-                timeout=120
-            )
-            response.raise_for_status()
-            
-            return response.json()
-            
+            # Closed on every exit, including a consumer that stops early, so the
+            # pooled connection is released instead of left half-read
+            with self._post_json(
+                f"{self.base_url}/ai/chat/csv/stream",
+                payload,
+                stream=True,
+                timeout=(3, 120)
+            ) as response:
+                if response.status_code == 409:
+                    yield {"type": "dataset_missing"}
+                    return
+                response.raise_for_status()
+                
+                for line in response.iter_lines():
+                    if line:
+                        yield orjson.loads(line)
+                    
         except requests.exceptions.RequestException as e:
-            print(f"❌ API Request failed: {e}")
-            # Display error details
-            if hasattr(e, 'response') and e.response is not None:
-                try:
-                    error_detail = e.response.json()
-                    print(f"❌ Error details: {error_detail}")
-                except:
-                    print(f"❌ Status code: {e.response.status_code}")
-            
-            return {
-                "content": f"❌ API Error: {str(e)}",
-                "plots": []
-            }
+            logger.error("❌ API Request failed: %s", e)
+            yield {"type": "error", "content": f"❌ API Error: {str(e)}"}
+
 # Global instance
 api_client = APIClient()
\ No newline at end of file
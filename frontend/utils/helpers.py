@@ -1,6 +1,16 @@
 from datetime import datetime
+import codecs
+import logging
+import time
 import streamlit as st
-import json
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Repaint the streaming placeholder at most this often, or after this many new characters;
+# each repaint resends the whole message
+STREAM_FLUSH_SECONDS = 0.08
+STREAM_FLUSH_CHARS = 4096
 
 def display_message_timestamp(msg):
     """Display formatted timestamp for chat messages"""
@@ -19,53 +29,151 @@ def display_message_timestamp(msg):
     except (ValueError, AttributeError):
         st.caption("🕒 Recent")
 
+# Messages with exactly these keys are already in API shape
+_API_MESSAGE_KEYS = frozenset(("role", "content"))
+
+def _clean_message(msg):
+    """A simple {"role", "content"} dict for one message"""
+    # ENSURE always simple dict
+    if isinstance(msg, dict):
+        return {
+            "role": msg.get("role", "user"),
+            "content": msg.get("content", "")
+        }
+    # If object, extract data
+    return {
+        "role": getattr(msg, "role", "user"),
+        "content": getattr(msg, "content", str(msg))
+    }
+
 def prepare_chat_history_for_api(messages):
-    """Convert messages to API-friendly format - FIXED"""
+    """Convert messages to API-friendly format, reusing dicts that already have only role/content"""
     if not messages:
         return []
     
-    api_messages = []
-    for msg in messages:
-        # ENSURE always simple dict
-        if isinstance(msg, dict):
-            clean_msg = {
-                "role": msg.get("role", "user"),
-                "content": msg.get("content", "")
-            }
-        else:
-            # If object, extract data
-            clean_msg = {
-                "role": getattr(msg, "role", "user"),
-                "content": getattr(msg, "content", str(msg))
-            }
-        
-        # Only keep necessary fields
-        api_messages.append(clean_msg)
+    return [
+        msg if type(msg) is dict and msg.keys() == _API_MESSAGE_KEYS else _clean_message(msg)
+        for msg in messages
+    ]
+
+def get_chat_history_for_api(messages):
+    """Prepared API history for messages, reusing the cached result while they are unchanged"""
+    cached = st.session_state.get("_prep_hist_cache")
+    # The cache holds the container and its last message, so neither id can be reused
+    if (cached and cached["ref"] is messages and cached["len"] == len(messages) and
+            cached["last"] is (messages[-1] if messages else None)):
+        return cached["val"]
     
-    print(f"🔍 Prepared {len(api_messages)} clean messages for API")
-    return api_messages
+    chat_history = prepare_chat_history_for_api(messages)
+    _store_chat_history_cache(messages, chat_history)
+    return chat_history
 
-def stream_api_response(api_response, message_placeholder):
-    """Stream response from API"""
-    full_response = ""
+def extend_chat_history_cache(messages, new_entries):
+    """Update the cached prepared history after new_entries were appended to messages in place"""
+    cached = st.session_state.get("_prep_hist_cache")
+    count = len(new_entries)
+    previous_last = messages[-count - 1] if len(messages) > count else None
+    if not cached or cached["ref"] is not messages or cached["last"] is not previous_last:
+        st.session_state.pop("_prep_hist_cache", None)
+        return
     
-    try:
-        for line in api_response.iter_lines():
-            if line:
-                line_text = line.decode('utf-8').strip()
-                if line_text.startswith('data: '):
-                    data_str = line_text[6:]  # Remove 'data: ' prefix
-                    try:
-                        data = json.loads(data_str)
-                        if 'content' in data:
-                            full_response += data['content']
-                            message_placeholder.markdown(full_response + "▌")
-                    except json.JSONDecodeError:
-                        continue
+    # Only the appended entries need preparing; trim to match a bounded container
+    chat_history = (cached["val"] + prepare_chat_history_for_api(new_entries))[-len(messages):]
+    _store_chat_history_cache(messages, chat_history)
+
+def _store_chat_history_cache(messages, chat_history):
+    st.session_state._prep_hist_cache = {
+        "ref": messages,
+        "len": len(messages),
+        "last": messages[-1] if messages else None,
+        "val": chat_history
+    }
+
+def _sse_data(frame):
+    """Payloads of a frame's data: lines (the space after the colon is optional)"""
+    for line in frame.split(b"\n"):
+        if line.startswith(b"data:"):
+            yield line[6:] if line[5:6] == b" " else line[5:]
+
+def _iter_sse_data(api_response, chunk_size=8192):
+    """Yield the raw bytes of each SSE data: line, scanning whole frames out of a byte buffer"""
+    raw = api_response.raw
+    if hasattr(raw, "read1"):
+        # read1 returns whatever the socket has, without waiting to fill chunk_size
+        chunks = iter(lambda: raw.read1(chunk_size, decode_content=True), b"")
+    else:
+        chunks = api_response.iter_content(chunk_size=chunk_size)
+    
+    buf = bytearray()
+    for chunk in chunks:
+        buf += chunk
+        # CRLF-framed streams are normalized; only the unscanned tail is kept, so a
+        # \r\n split across chunks is joined here before it is replaced
+        if b"\r" in buf:
+            buf = buf.replace(b"\r\n", b"\n")
+        # Only complete frames (terminated by a blank line) are dispatched
+        start = 0
+        end = buf.find(b"\n\n")
+        while end != -1:
+            yield from _sse_data(bytes(buf[start:end]))
+            start = end + 2
+            end = buf.find(b"\n\n", start)
+        del buf[:start]
+    
+    # A final frame may end without the blank line
+    yield from _sse_data(bytes(buf).rstrip(b"\r\n"))
+
+def _iter_stream_text(api_response):
+    """Yield the text of a streamed response: SSE data frames' content, or the raw body"""
+    if api_response.headers.get("content-type", "").startswith("text/event-stream"):
+        # Payloads stay bytes: orjson validates and decodes the UTF-8 itself
+        for payload in _iter_sse_data(api_response):
+            try:
+                data = orjson.loads(payload)
+            except orjson.JSONDecodeError:
+                continue
+            if isinstance(data, dict) and data.get('content'):
+                yield data['content']
+        return
     
+    # Take chunks as they arrive; the incremental decoder carries
+    # multibyte characters split across chunks over to the next one
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for chunk in api_response.iter_content(chunk_size=None):
+        if chunk:
+            yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+def stream_api_response(api_response, message_placeholder):
+    """Render a streamed response into message_placeholder as it arrives; returns the full text"""
+    parts = []
+    pending = 0
+    last_flush = time.monotonic()
+    markdown = message_placeholder.markdown
+    monotonic = time.monotonic
+    # The cursor is its own element, sent once, so repaints never copy text to append it
+    cursor = st.empty()
+    cursor.markdown("▌")
+    try:
+        for text in _iter_stream_text(api_response):
+            parts.append(text)
+            pending += len(text)
+            # Coalesce repaints; each one resends the whole message
+            now = monotonic()
+            if now - last_flush > STREAM_FLUSH_SECONDS or pending > STREAM_FLUSH_CHARS:
+                parts = ["".join(parts)]
+                markdown(parts[0])
+                last_flush = now
+                pending = 0
     except Exception as e:
-        print(f"Stream reading error: {e}")
+        # Callers show the error to the user; keep the cause in the log
+        logger.error("Stream reading error: %s", e)
+        raise
+    finally:
+        cursor.empty()
     
+    full_response = "".join(parts)
+    markdown(full_response)
     return full_response
 
 def generate_fallback_response(message_placeholder, fallback_text="I'm sorry, I couldn't process your request. Please try again."):
@@ -2,8 +2,43 @@ import streamlit as st
 import uuid
 import pandas as pd
 import base64
+from io import BytesIO
+from collections import OrderedDict
 from services.api_client import api_client
 from datetime import datetime
+import functools
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Background persistence: one worker thread per process, shared by all browser sessions
+_save_queue = queue.Queue()
+_save_lock = threading.Lock()
+_save_thread = None
+# session_id -> last background save error, shown on the session's next run
+_save_errors = {}
+
+# Concurrent deletes when clearing all chats; matches the API client's connection pool size
+MAX_DELETE_WORKERS = 16
+
+def _requires_api(default=None):
+    """Return default when no API is configured or the call raises, instead of repeating
+    the base_url guard and try/except in every API-backed helper"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not api_client.base_url:
+                return default
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                logger.error("❌ %s failed: %s", fn.__name__, e)
+                return default
+        return wrapper
+    return decorator
 
 def add_chat_to_sessions(chat_name, messages):
     """Add new chat to all_sessions and API"""
@@ -15,8 +50,9 @@ def add_chat_to_sessions(chat_name, messages):
         "mode": st.session_state.current_mode
     }
     
-    # Add to local state
+    # Add to local state, newest first
     st.session_state.all_sessions[chat_id] = session_data
+    touch_session(chat_id)
     st.session_state.current_session = chat_id
     st.session_state.show_new_chat = False
     
@@ -31,243 +67,453 @@ def add_chat_to_sessions(chat_name, messages):
             result = api_client.create_session(db_data)
             
             if result:
+                refresh_sessions_version()
                 # Update session ID with server ID if needed
                 # chat_id = result.get("session_id", chat_id)
                 
-                # Save each message if available
-                for msg in messages:
-                    api_client.add_message(chat_id, msg)
+                # Save any initial messages in one bulk request
+                if messages:
+                    _append_messages(chat_id, messages)
                     
         except Exception as e:
-            print(f"❌ Error saving session via API: {e}")
+            logger.error("❌ Error saving session via API: %s", e)
     
     return chat_id
 
-def save_session_file_data(session_id, file_type, file_data, file_name=None):
-    """Save file data (CSV/Image) for session to API"""
-    print(f"🔍 save_session_file_data called: session_id={session_id}, file_type={file_type}, file_name={file_name}")
-    
-    if not api_client.base_url or not session_id:
-        print(f"❌ Cannot save: client={api_client.base_url is not None}, session_id={session_id}")
-        return False
-        
-    try:
-        print(f"💾 Starting save_session_file_data...")
-        
-        # CSV INFO (metadata only)
-        if file_type == 'csv_info' and isinstance(file_data, dict):
-            print("📊 Storing CSV info metadata...")
-            file_data_to_save = {
-                'file_type': 'csv_info',
-                'metadata': file_data,
-                'has_full_data': False
-            }
+def touch_session(chat_id):
+    """Move a session to the front of all_sessions, which is kept newest first"""
+    if chat_id in st.session_state.all_sessions:
+        st.session_state.all_sessions.move_to_end(chat_id, last=False)
+        invalidate_sorted_sessions()
+
+def invalidate_sorted_sessions():
+    """Drop the sidebar's cached chat list; call after any change to all_sessions"""
+    st.session_state.cached_sorted_sessions = None
+
+# Leading magic bytes of the image formats uploads are re-encoded to
+_IMAGE_SIGNATURES = (
+    (b"\x89PNG", "image/png"),
+    (b"GIF8", "image/gif"),
+    (b"\xff\xd8", "image/jpeg"),
+)
+
+def _image_mime_type(image_bytes):
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime_type in _IMAGE_SIGNATURES:
+        if image_bytes.startswith(signature):
+            return mime_type
+    return "image/jpeg"
+
+def _is_raw_image(file_type, file_data):
+    """Images given as bytes are uploaded raw instead of as base64 inside JSON"""
+    return file_type == 'image' and isinstance(file_data, (bytes, bytearray))
+
+def _build_file_payload(file_type, file_data, file_name=None):
+    """Wrap raw file data in the stored shape for its file type"""
+    # CSV INFO (metadata only)
+    if file_type == 'csv_info' and isinstance(file_data, dict):
+        logger.debug("📊 Storing CSV info metadata...")
+        file_data_to_save = {
+            'file_type': 'csv_info',
+            'metadata': file_data,
+            'has_full_data': False
+        }
         
-        # CSV DATA (full data as CSV string)
-        elif file_type == 'csv_data' and isinstance(file_data, dict):
-            print("📊 Storing CSV full data as CSV string...")
-            file_data_to_save = {
-                'file_type': 'csv_full',
-                'csv_string': file_data.get('csv_string', ''),
-                'rows': file_data.get('rows', 0),
-                'columns': file_data.get('columns', 0),
-                'file_name': file_data.get('file_name', 'data.csv'),
-                'has_full_data': True
-            }
+    # CSV DATA (full data as base64 Parquet, or a CSV string from older callers)
+    elif file_type == 'csv_data' and isinstance(file_data, dict):
+        logger.debug("📊 Storing CSV full data...")
+        file_data_to_save = {
+            'file_type': 'csv_full',
+            'rows': file_data.get('rows', 0),
+            'columns': file_data.get('columns', 0),
+            'file_name': file_data.get('file_name', 'data.csv'),
+            'has_full_data': True
+        }
+        if file_data.get('format') == 'parquet':
+            file_data_to_save['format'] = 'parquet'
+            file_data_to_save['parquet_b64'] = file_data.get('parquet_b64', '')
+        else:
+            file_data_to_save['csv_string'] = file_data.get('csv_string', '')
         
-        # IMAGE INFO (metadata only)
-        elif file_type == 'image_info' and isinstance(file_data, dict):
-            print("🖼️ Storing image info metadata...")
-            file_data_to_save = {
-                'file_type': 'image_info',
-                'metadata': file_data,
-                'has_full_data': False
-            }
+    # IMAGE INFO (metadata only)
+    elif file_type == 'image_info' and isinstance(file_data, dict):
+        logger.debug("🖼️ Storing image info metadata...")
+        file_data_to_save = {
+            'file_type': 'image_info',
+            'metadata': file_data,
+            'has_full_data': False
+        }
         
-        # IMAGE DATA (full image for small files)
-        elif file_type == 'image' and isinstance(file_data, str):
-            print("🖼️ Storing image data...")
+    # IMAGE DATA (full image for small files)
+    elif file_type == 'image' and isinstance(file_data, str):
+        logger.debug("🖼️ Storing image data...")
             
-            # Extract base64 from data URL if needed
-            if file_data.startswith('data:image'):
-                file_data = file_data.split(',')[1] if ',' in file_data else file_data
+        # Extract base64 from data URL if needed
+        if file_data.startswith('data:image'):
+            file_data = file_data.split(',', 1)[1] if ',' in file_data else file_data
             
-            print(f"🖼️ Storing full image data...")
+        logger.debug("🖼️ Storing full image data...")
+        
+        # Exact decoded size: 3 bytes per 4 base64 characters, less the padding
+        size_bytes = len(file_data) * 3 // 4 - file_data[-2:].count('=')
             
-            file_data_to_save = {
-                'image_data': file_data,
-                'file_type': 'image_base64',
-                'format': 'base64',
-                'metadata': {
-                    'file_name': file_name or 'image.jpg',
-                    'size_bytes': int(len(file_data) / 0.75),  # Approximate original size
-                    'size_mb': len(file_data) / (1024 * 1024) * 0.75
-                },
-                'has_full_data': True
-            }
-        else:
-            # FALLBACK: save directly if not specific type
-            print(f"📁 Storing generic file data...")
-            file_data_to_save = file_data
+        file_data_to_save = {
+            'image_data': file_data,
+            'file_type': 'image_base64',
+            'format': 'base64',
+            'metadata': {
+                'file_name': file_name or 'image.jpg',
+                'size_bytes': size_bytes,
+                'size_mb': size_bytes / (1024 * 1024)
+            },
+            'has_full_data': True
+        }
+    else:
+        # FALLBACK: save directly if not specific type
+        logger.debug("📁 Storing generic file data...")
+        file_data_to_save = file_data
+    
+    return file_data_to_save
 
-        print(f"💾 Calling api_client.save_session_file...")
-        
+@_requires_api(default=False)
+def save_session_file_data(session_id, file_type, file_data, file_name=None):
+    """Save file data (CSV/Image) for session to API"""
+    if not session_id:
+        return False
+    
+    if _is_raw_image(file_type, file_data):
+        result = api_client.save_session_file_raw(
+            session_id, file_type, file_data, _image_mime_type(file_data), file_name
+        )
+    else:
         result = api_client.save_session_file(
             session_id=session_id,
             file_type=file_type,
-            file_data=file_data_to_save,
+            file_data=_build_file_payload(file_type, file_data, file_name),
             file_name=file_name
         )
-        
-        print(f"💾 API save result: {result is not None}")
-        
-        print(f"✅ Saved {file_type} file to API for session {session_id}")
-        return result is not None
-        
-    except Exception as e:
-        print(f"❌ Error saving session file data: {e}")
-        import traceback
-        traceback.print_exc()
+    invalidate_session_file(session_id, file_type)
+    
+    logger.debug("✅ Saved %s file to API for session %s", file_type, session_id)
+    return result is not None
+
+@_requires_api(default=False)
+def save_session_files_data(session_id, files):
+    """Save several (file_type, file_data, file_name) entries for a session in one request"""
+    if not session_id or not files:
         return False
+    
+    payloads = [
+        {
+            "file_type": file_type,
+            "file_data": _build_file_payload(file_type, file_data, file_name),
+            "file_name": file_name
+        }
+        for file_type, file_data, file_name in files
+        if not _is_raw_image(file_type, file_data)
+    ]
+    ok = not payloads or api_client.save_session_files_batch(session_id, payloads) is not None
+    
+    for file_type, file_data, file_name in files:
+        if _is_raw_image(file_type, file_data):
+            ok = api_client.save_session_file_raw(
+                session_id, file_type, file_data, _image_mime_type(file_data), file_name
+            ) is not None and ok
+    
+    for file_type, _, _ in files:
+        invalidate_session_file(session_id, file_type)
+    
+    logger.debug("✅ Saved %s files to API for session %s", len(files), session_id)
+    return ok
+
+def _read_csv_string(csv_string):
+    """Parse a stored CSV string with Arrow's multithreaded parser, or pandas' C engine"""
+    data = csv_string.encode('utf-8')
+    try:
+        return pd.read_csv(BytesIO(data), engine="pyarrow")
+    except Exception:
+        # pyarrow missing, or input its stricter parser rejects
+        return pd.read_csv(BytesIO(data))
 
+@_requires_api()
 def load_session_file_data(session_id, file_type):
-    """Load file data (CSV/Image) from API"""
-    if not api_client.base_url or not session_id:
+    """Load file data (CSV/Image) from API, reusing results across reruns and browser sessions"""
+    if not session_id:
         return None
-        
+    
     try:
-        file_record = api_client.get_session_file(session_id, file_type)
-        if file_record and file_record.get('file_data'):
-            file_data = file_record['file_data']
-            
-            # CSV INFO (metadata only)
-            if file_type == 'csv_info' and isinstance(file_data, dict):
-                if 'metadata' in file_data:
-                    print(f"📊 Loaded CSV info: {file_data['metadata']}")
-                    return file_data['metadata']
-                return file_data
-           
-            # CSV DATA (full data from CSV string)
-            elif file_type == 'csv_data' and isinstance(file_data, dict):
-                if 'csv_string' in file_data:
-                    try:
-                        from io import StringIO
-                        csv_string = file_data['csv_string']
-                        full_df = pd.read_csv(StringIO(csv_string))
-                        print(f"✅ Restored full DataFrame from CSV string: {full_df.shape}")
-                        return full_df
-                    except Exception as e:
-                        print(f"❌ Error parsing full CSV string: {e}")
-                        return None
-                return file_data
-            
-            # IMAGE INFO (metadata only)
-            elif file_type == 'image_info' and isinstance(file_data, dict):
-                if 'metadata' in file_data:
-                    print(f"🖼️ Loaded image info: {file_data['metadata']}")
-                    return file_data['metadata']
-                return file_data
-            
-            # IMAGE DATA (full image for small files)
-            elif file_type == 'image' and isinstance(file_data, dict):
-                if 'image_data' in file_data:
-                    image_base64 = file_data['image_data']
-                    print(f"✅ Restored image from base64: {len(image_base64)} bytes")
-                    return image_base64
-                return file_data
-            
-            print(f"✅ Loaded {file_type} file from API for session {session_id}")
+        return _cached_session_file(session_id, file_type)
+    except LookupError:
+        return None
+
+def invalidate_session_file(session_id, file_type):
+    """Drop a cached load_session_file_data result after the file was written"""
+    _cached_session_file.clear(session_id, file_type)
+
+@st.cache_data(ttl=300, max_entries=16, show_spinner=False)
+def _cached_session_file(session_id, file_type):
+    file_data = _fetch_session_file(session_id, file_type)
+    if file_data is None:
+        # Raising keeps misses out of the cache, so they are retried next time
+        raise LookupError(file_type)
+    return file_data
+
+def _fetch_session_file(session_id, file_type):
+    """Download a session file and decode it into its in-app form; errors propagate to the caller"""
+    file_record = api_client.get_session_file(session_id, file_type)
+    if file_record and file_record.get('file_data'):
+        file_data = file_record['file_data']
+        
+        # CSV INFO (metadata only)
+        if file_type == 'csv_info' and isinstance(file_data, dict):
+            if 'metadata' in file_data:
+                logger.debug("📊 Loaded CSV info: %s", file_data['metadata'])
+                return file_data['metadata']
+            return file_data
+       
+        # CSV DATA (full data from Parquet, or CSV string for older sessions)
+        elif file_type == 'csv_data' and isinstance(file_data, dict):
+            if file_data.get('format') == 'parquet' and 'parquet_b64' in file_data:
+                try:
+                    full_df = pd.read_parquet(BytesIO(base64.b64decode(file_data['parquet_b64'])))
+                    logger.debug("✅ Restored full DataFrame from Parquet: %s", full_df.shape)
+                    return full_df
+                except Exception as e:
+                    logger.error("❌ Error reading stored Parquet data: %s", e)
+                    return None
+            if 'csv_string' in file_data:
+                try:
+                    full_df = _read_csv_string(file_data['csv_string'])
+                    logger.debug("✅ Restored full DataFrame from CSV string: %s", full_df.shape)
+                    return full_df
+                except Exception as e:
+                    logger.error("❌ Error parsing full CSV string: %s", e)
+                    return None
             return file_data
         
-        print(f"❌ No file data found for session {session_id}, type {file_type}")
-        return None
+        # IMAGE INFO (metadata only)
+        elif file_type == 'image_info' and isinstance(file_data, dict):
+            if 'metadata' in file_data:
+                logger.debug("🖼️ Loaded image info: %s", file_data['metadata'])
+                return file_data['metadata']
+            return file_data
         
-    except Exception as e:
-        print(f"❌ Error loading session file data: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
+        # IMAGE DATA (full image for small files)
+        elif file_type == 'image' and isinstance(file_data, dict):
+            if 'image_data' in file_data:
+                image_base64 = file_data['image_data']
+                logger.debug("✅ Restored image from base64: %s bytes", len(image_base64))
+                return image_base64
+            return file_data
+        
+        logger.debug("✅ Loaded %s file from API for session %s", file_type, session_id)
+        return file_data
+    
+    logger.debug("📭 No file data found for session %s, type %s", session_id, file_type)
+    return None
+
 
 
+def batch_state(delete=(), scope="app", **updates):
+    """Apply several session_state writes (and key deletions) in one pass, then rerun once
+    
+    Pass scope="fragment" from inside an st.fragment when only that fragment needs redrawing.
+    """
+    for key, value in updates.items():
+        st.session_state[key] = value
+    for key in delete:
+        st.session_state.pop(key, None)
+    st.rerun(scope=scope)
+
+@_requires_api()
+def _delete_sessions(chat_ids):
+    """Delete sessions from the API; deletes are independent, so they run concurrently"""
+    if len(chat_ids) == 1:
+        api_client.delete_session(chat_ids[0])
+    elif chat_ids:
+        with ThreadPoolExecutor(max_workers=min(MAX_DELETE_WORKERS, len(chat_ids))) as pool:
+            list(pool.map(api_client.delete_session, chat_ids))
 
 def delete_chat_session(chat_id, name):
     """Delete chat session"""
+    updates = {}
     if chat_id in st.session_state.all_sessions:
         del st.session_state.all_sessions[chat_id]
+        invalidate_sorted_sessions()
         
-        if api_client.base_url:
-            try:
-                api_client.delete_session(chat_id)
-            except Exception as e:
-                print(f"❌ Error deleting session: {e}")
+        _delete_sessions([chat_id])
+        refresh_sessions_version()
         
         if st.session_state.current_session == chat_id:
-            create_new_chat()
+            updates = new_chat_state()
     
     st.toast(f"🗑️ Deleted: {name}")
-    st.rerun()
+    # Deleting another chat only changes the chat list; deleting the open one resets the page
+    batch_state(scope="app" if updates else "fragment", **updates)
 
 def clear_all_chats():
     """Delete all chats"""
-    if api_client.base_url:
-        try:
-            for chat_id in list(st.session_state.all_sessions.keys()):
-                api_client.delete_session(chat_id)
-        except Exception as e:
-            print(f"❌ Error deleting sessions: {e}")
+    _delete_sessions(list(st.session_state.all_sessions))
+    refresh_sessions_version()
     
     st.session_state.all_sessions.clear()
-    create_new_chat()
+    invalidate_sorted_sessions()
     st.toast("🗑️ Deleted all chats")
-    st.rerun()
+    batch_state(**new_chat_state())
 
 def load_sessions_from_database():
-    """Load sessions from API"""
-    if api_client.base_url:
-        try:
-            db_sessions = api_client.get_all_sessions()
-            if db_sessions:
-                st.session_state.all_sessions = db_sessions
-                print(f"✅ Loaded {len(db_sessions)} sessions from API")
-        except Exception as e:
-            st.error(f"❌ Error loading sessions: {e}")
+    """Load sessions from API; returns False when the load failed and should be retried"""
+    if not api_client.base_url:
+        return True
+    try:
+        db_sessions = api_client.get_all_sessions()
+        if db_sessions is None:
+            return False
+        # API returns sessions ordered by created_at, newest first; empty is a valid list
+        st.session_state.all_sessions = OrderedDict(db_sessions)
+        invalidate_sorted_sessions()
+        logger.debug("✅ Loaded %s sessions from API", len(db_sessions))
+        return True
+    except Exception as e:
+        st.error(f"❌ Error loading sessions: {e}")
+        return False
+
+def refresh_sessions_version():
+    """Record the server's session-list version after a change made from this tab,
+    so the sidebar does not reload the list it already has"""
+    if api_client.base_url and st.session_state.get("sessions_loaded"):
+        version = api_client.get_sessions_version()
+        if version is not None:
+            st.session_state._sessions_version = version
 
 def save_current_session(db_messages):
     """Save current session to API - ONLY save new messages"""
     if not api_client.base_url or not st.session_state.current_session:
         return
     
+    _save_new_messages(st.session_state.current_session, db_messages)
+
+def _append_messages(session_id, messages):
+    """Save messages that were just added to a session in one bulk request"""
+    result = api_client.add_messages(session_id, [
+        {
+            "role": msg["role"],
+            "content": msg["content"],
+            "timestamp": msg.get("timestamp"),
+        }
+        for msg in messages
+    ])
+    if result is None:
+        raise ConnectionError("bulk message save failed")
+    logger.debug("💾 Saved %s new messages for session %s", len(messages), session_id)
+
+def _save_new_messages(current_id, db_messages):
+    """Save messages not yet stored for a session; safe to call off the script thread"""
     try:
-        current_id = st.session_state.current_session
-        
-        # Get current messages from API to compare
-        existing_db_messages = api_client.get_session_messages(current_id)
+        # Stored count comes from the client's cache, so this is usually no request at all
+        existing_count = api_client.get_message_count(current_id)
         
         # Only save new messages (not already in API)
-        if len(db_messages) > len(existing_db_messages):
-            new_messages = db_messages[len(existing_db_messages):]
-            
-            for msg in new_messages:
-                api_client.add_message(current_id, {
-                    "role": msg["role"],
-                    "content": msg["content"],
-                    "timestamp": msg.get("timestamp"),
-                })
-            print(f"💾 Saved {len(new_messages)} new messages for session {current_id}")
+        if len(db_messages) > existing_count:
+            _append_messages(current_id, db_messages[existing_count:])
                 
     except Exception as e:
-        print(f"⚠️ Error saving session: {e}")
+        logger.warning("⚠️ Error saving session: %s", e)
 
-def create_new_chat():
-    """Prepare for new chat - DO NOT create chat_id here"""
-    st.session_state.current_session = None
-    st.session_state.show_new_chat = True
+def _save_files(session_id, files):
+    """Save a session's files in one request; raises so the worker records the failure"""
+    if not save_session_files_data(session_id, files):
+        raise ConnectionError("file save failed")
+
+def _run_save(save, session_id, messages):
+    try:
+        save(session_id, messages)
+    except Exception as e:
+        logger.warning("⚠️ Background save failed for session %s: %s", session_id, e)
+        with _save_lock:
+            _save_errors[session_id] = str(e)
+
+def _save_worker():
+    """Drain queued saves, coalescing whatever has piled up since the last pass"""
+    while True:
+        batch = [_save_queue.get()]
+        while True:
+            try:
+                batch.append(_save_queue.get_nowait())
+            except queue.Empty:
+                break
+        
+        # Appends and files accumulate in order into one bulk request each; for snapshots the latest wins
+        appends = OrderedDict()
+        snapshots = OrderedDict()
+        files = OrderedDict()
+        for kind, session_id, messages in batch:
+            if kind == "append":
+                appends.setdefault(session_id, []).extend(messages)
+            elif kind == "files":
+                files.setdefault(session_id, []).extend(messages)
+            else:
+                snapshots[session_id] = messages
+        
+        for session_id, entries in files.items():
+            _run_save(_save_files, session_id, entries)
+        for session_id, messages in appends.items():
+            _run_save(_append_messages, session_id, messages)
+        for session_id, messages in snapshots.items():
+            _run_save(_save_new_messages, session_id, messages)
+        
+        for _ in batch:
+            _save_queue.task_done()
+
+def _enqueue_save(kind, session_id, messages):
+    global _save_thread
+    with _save_lock:
+        if _save_thread is None:
+            _save_thread = threading.Thread(target=_save_worker, name="session-save", daemon=True)
+            _save_thread.start()
+    
+    _save_queue.put((kind, session_id, messages))
+
+def queue_session_save(session_id, db_messages):
+    """Save a session's new messages in the background; db_messages must be a list snapshot"""
+    if not api_client.base_url or not session_id:
+        return
+    _enqueue_save("snapshot", session_id, db_messages)
+
+def queue_session_append(session_id, messages):
+    """Append just-added messages in the background; failures are reported by pop_save_error"""
+    if not api_client.base_url or not session_id or not messages:
+        return
+    _enqueue_save("append", session_id, list(messages))
+
+def queue_session_files_save(session_id, files):
+    """Save (file_type, file_data, file_name) entries in the background, batched into one request"""
+    if not api_client.base_url or not session_id or not files:
+        return
+    _enqueue_save("files", session_id, list(files))
+
+def pop_save_error(session_id):
+    """Return (and forget) the last background save error for a session, if any"""
+    with _save_lock:
+        return _save_errors.pop(session_id, None)
+
+def new_chat_state():
+    """Session state updates that prepare for a new chat - DO NOT create chat_id here"""
+    updates = {"current_session": None, "show_new_chat": True}
     
     # Reset messages
     if "current_messages" in st.session_state:
-        st.session_state.current_messages = []
+        updates["current_messages"] = []
+    
+    return updates
+
+def create_new_chat():
+    """Prepare for new chat without rerunning"""
+    for key, value in new_chat_state().items():
+        st.session_state[key] = value
     
-    print("🆕 Prepared for new chat - waiting for user input")
+    logger.debug("🆕 Prepared for new chat - waiting for user input")
 
 # Helper functions for image processing
 def encode_image_to_base64(image_file):
@@ -277,7 +523,7 @@ def encode_image_to_base64(image_file):
         encoded_image = base64.b64encode(image_bytes).decode("utf-8")
         return encoded_image
     except Exception as e:
-        print(f"❌ Error encoding image: {e}")
+        logger.error("❌ Error encoding image: %s", e)
         return None
 
 def get_image_data_url(base64_string, mime_type="image/jpeg"):